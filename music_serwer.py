@@ -1,131 +1,544 @@
 import os
+import re
 import threading
 import json
 import logging
 import time
-from flask import Flask, render_template, request, jsonify, Response
+import hashlib
+import concurrent.futures
+from flask import Flask, render_template, request, jsonify, Response, abort, send_from_directory
 from flask_cors import CORS
-from queue import Queue
 
 LibMPVPlayer = None
 MusicLibrary = None
 
-from scripts.settings import paths, server, Player
+from scripts.settings import paths, server, stream, watch, assets, dedup, tag_edit, Player, zones as zone_settings
 from scripts.lib_mpv_player import LibMPVPlayer
 from scripts.music_library import MusicLibrary
+from scripts.event_broadcaster import EventBroadcaster, format_sse
+from scripts.async_server import AsyncServer
+from scripts.library_watcher import LibraryWatcher
+from scripts.player_commands import PlayerCommands
+from scripts.static_assets import StaticAssets
+from scripts.log_setup import setup_logging
+from scripts.tag_query import TagQueryError
+from scripts import library_delta
+from scripts import metrics
 
 
-song_update_queue = Queue()
+broadcaster = EventBroadcaster()
+commands = PlayerCommands()
+"""Wszystkie zmiany stanu odtwarzacza idą przez ten jeden wątek"""
+MAIN_ZONE = "main"
+"""Strefa główna, dostępna pod adresami bez prefiksu /zones/<nazwa>"""
+
+
+CLICK_SECONDS = metrics.histogram("http_click_seconds", "Czas obsługi /click", ["button"])
+CLICK_BUTTONS = {"test", "stop", "next", "before", "volume", "random"}
+"""Znane przyciski, pozostałe liczone jako "other", żeby klient nie mnożył etykiet"""
+SSE_CLIENTS = metrics.gauge("sse_clients", "Podłączeni klienci /stream wszystkich stref")
+SSE_QUEUE_DEPTH = metrics.gauge("sse_queue_depth", "Zdarzenia czekające w kolejce klienta", ["client"])
+SSE_DROPPED = metrics.gauge("sse_dropped_events", "Zdarzenia odrzucone z pełnej kolejki klienta", ["client"])
+SSE_EVENTS = metrics.gauge("sse_last_event_id", "Numer ostatniego opublikowanego zdarzenia")
+LIBRARY_FILES = metrics.gauge("library_scan_files", "Wynik ostatniego skanowania", ["kind"])
+LIBRARY_SONGS = metrics.gauge("library_songs", "Piosenki w bibliotece i w albumie", ["set"])
+COMMANDS_QUEUED = metrics.gauge("player_commands_queued", "Polecenia czekające w kolejce")
+COMMANDS_STATS = metrics.gauge("player_commands", "Liczniki kolejki poleceń", ["kind"])
+TAG_WRITES = metrics.gauge("tag_writes", "Zmiany tagów: czekające na zapis i liczniki zapisu w tle", ["kind"])
+
+
+@metrics.collector
+def collect_metrics():
+    """Stan odczytywany dopiero przy /metrics, bez kosztu na gorących ścieżkach"""
+    subscribers = [sub for ctrl in list(zones.values()) for sub in ctrl.broadcaster.subscribers]
+    SSE_CLIENTS.set(len(subscribers))
+    SSE_QUEUE_DEPTH.clear()
+    SSE_DROPPED.clear()
+    for sub in subscribers:
+        SSE_QUEUE_DEPTH.labels(str(sub.number)).set(len(sub.events))
+        SSE_DROPPED.labels(str(sub.number)).set(sub.dropped)
+    SSE_EVENTS.set(broadcaster.last_id)
+    for kind in ("files", "dirs", "skipped", "added", "removed"):
+        LIBRARY_FILES.labels(kind).set(MusicLibrary.last_scan.get(kind, 0))
+    LIBRARY_SONGS.labels("full").set(len(MusicLibrary.full_library))
+    LIBRARY_SONGS.labels("album").set(len(MusicLibrary.library))
+    COMMANDS_QUEUED.set(len(commands))
+    for kind, value in commands.stats.items():
+        COMMANDS_STATS.labels(kind).set(value)
+    writer = MusicLibrary._tag_writer
+    if writer is not None:
+        TAG_WRITES.labels("pending").set(writer.pending)
+        for kind, value in writer.stats.items():
+            TAG_WRITES.labels(kind).set(value)
 
 
 # Konfikuracja i tworzenie HTTP
 app = Flask(__name__)
 CORS(app)
+static_files = StaticAssets(os.path.join(app.root_path, "static")).build()
+"""script.js i style.css z hashem w nazwie, skompresowane raz przy starcie"""
+
+@app.context_processor
+def asset_helpers():
+    return {"asset_url": static_files.url}
+
+_rendered_index: dict[str, tuple] = {}
+"""strefa -> (stan wstawiony do strony, html, etag) ostatnio wyrenderowanej strony głównej"""
+
+def _zone_base(ctrl) -> str:
+    """Prefiks adresów strefy: "" dla głównej, "/zones/<nazwa>" dla pozostałych"""
+    return "" if ctrl.zone_id == MAIN_ZONE else f"/zones/{ctrl.zone_id}"
+
 @app.route("/")
-def index():
-    initial_state = {
-        "currentSong": "" if MusicLibrary.library == [] else MusicLibrary.library[Player.index_song],
-        "volume": Player.volume,
-        "isRandom": MusicLibrary.is_rnd_flag
-    }
-    api_url = server.get_address() + "/click"  # np: "http://192.168.0.106:8000"
-    logging.info("adres api: " + api_url)
-    return render_template(
-        "index.html", 
-        api_url=server.get_address() + "/click",
-        initial_state=json.dumps(initial_state)  # Dane jako JSON string
-    )
+@app.route("/zones/<zone_id>/")
+def index(zone_id=MAIN_ZONE):
+    """Strona główna strefy, renderowana ponownie tylko gdy zmieni się stan, który zawiera"""
+    ctrl = get_zone(zone_id)
+    base = _zone_base(ctrl)
+    # adres, pod którym klient nas widzi, bez szukania adresu IP w sieci
+    api_url = request.host_url.rstrip("/") + base + "/click"  # np: "http://192.168.0.106:8000/click"
+    album = ctrl.library
+    song = album.current_song()
+    zone_names = list(zones)
+    key = (api_url, song, ctrl.state.volume, album.is_rnd_flag, tuple(zone_names))
+    entry = _rendered_index.get(zone_id)
+    if entry is None or entry[0] != key:
+        initial_state = {
+            "currentSong": song,
+            "volume": ctrl.state.volume,
+            "isRandom": album.is_rnd_flag
+        }
+        logger.info("adres api: %s", api_url)
+        html = render_template(
+            "index.html", 
+            api_url=api_url,
+            zone_base=base,
+            zone_names=zone_names,
+            zone_id=zone_id,
+            initial_state=json.dumps(initial_state)  # Dane jako JSON string
+        )
+        entry = (key, html, hashlib.sha256(html.encode()).hexdigest()[:16])
+        _rendered_index[zone_id] = entry
+    response = Response(entry[1], mimetype="text/html")
+    response.set_etag(entry[2])
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+@app.route("/assets/<path:name>")
+def static_asset(name):
+    """Plik statyczny z hashem w nazwie, w najmniejszej wersji, którą przyjmie klient"""
+    found = static_files.get(name, request.headers.get("Accept-Encoding", ""))
+    if found is None:
+        abort(404)
+    asset, encoding, data = found
+    headers = {"Cache-Control": f"public, max-age={assets.max_age}, immutable", "Vary": "Accept-Encoding"}
+    response = Response(data, mimetype=asset.mimetype, headers=headers)
+    if encoding != "identity":
+        response.headers["Content-Encoding"] = encoding
+    response.set_etag(asset.etag, weak=True)
+    return response.make_conditional(request)
+
 
+# Logger serwera, konfiguracja (plik, poziomy, kolejka) w setup_logging przy starcie
+logger = logging.getLogger("music_serwer")
 
-# Konfiguracja loggera
-logging.basicConfig(
-    filename='app.log',       # plik do logów
-    level=logging.DEBUG,       # loguj wszystko od debug/warning
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    encoding='utf-8'
-)
+
+def _add_steps(old_args, new_args):
+    """Łączy naciśnięcia następna/poprzednia w jeden skok"""
+    return (old_args[0] + new_args[0],)
 
 
 class PlayerCtrl():
-    """Główna klasa do obsługi playera"""
-    global LibMPVPlayer, MusicLibrary
+    """Główna klasa do obsługi playera, steruje strefą główną.
+    Każda dodatkowa strefa (add_zone) to podklasa z własnym mpv, albumem,
+    stanem (głośność, aktualna piosenka) i kanałem /stream"""
+    zone_id = MAIN_ZONE
+    mpv = LibMPVPlayer
+    library = MusicLibrary
+    state = Player
+    broadcaster = broadcaster
     _is_pause = False
+    _published_library = {"version": None, "songs": []}
+    """Ostatnia wersja albumu wysłana do klientów, podstawa dla kolejnej różnicy"""
+
+    @classmethod
+    def submit(cls, name: str, func, *args, key: str | None = None, merge=None):
+        """Dodaje polecenie strefy do wspólnej kolejki poleceń. Nazwa i klucz
+        dostają nazwę strefy, więc polecenia różnych stref nie są ze sobą łączone"""
+        if cls.zone_id != MAIN_ZONE:
+            name = f"{name}@{cls.zone_id}"
+            key = None if key is None else f"{key}@{cls.zone_id}"
+        return commands.submit(name, func, *args, key=key, merge=merge)
+
     @classmethod
     def pause(cls):
-        if LibMPVPlayer.player:
+        if cls.mpv.player:
             if cls._is_pause:
-                LibMPVPlayer.resume()
+                cls.mpv.resume()
                 cls._is_pause = False
             else:
-                LibMPVPlayer.pause()
+                cls.mpv.pause()
                 cls._is_pause = True
         else:
-            logging.warning("Player not initialized!")
+            logger.warning("Player not initialized!")
+    @classmethod
+    def skip(cls, steps: int):
+        """Przechodzi o steps piosenek do przodu (ujemne - do tyłu), mpv dostaje tylko ostatnią
+        Args:
+            steps (int): suma połączonych naciśnięć następna/poprzednia"""
+        if not cls.library.library or not steps:
+            return
+        path = cls.library.next(steps) if steps > 0 else cls.library.before(-steps)
+        cls.mpv.next(path)
+        cls.notify_current_song(path)
+        cls.notify_update_library()
+        cls.queue_upcoming()
+        cls.library.save_resume()
     @classmethod
     def next(cls):
         """W pełni obsługuje rozpoczęcie odtwarzania następnej piosenki"""
-        path = MusicLibrary.next()
-        LibMPVPlayer.next(path)
-        notify_current_song(path)
-        notify_update_library()
+        cls.skip(1)
+    @classmethod
+    def advanced(cls, path):
+        """mpv sam przeszedł do piosenki z kolejki (gapless), aktualizuje album
+        Args:
+            path (str): pełna ścieżka piosenki, którą mpv zaczął odtwarzać"""
+        if not cls.library.library:
+            return
+        expected = cls.library.next()
+        if expected != path:
+            # kolejka była nieaktualna, poprawiamy na piosenkę z albumu
+            cls.mpv.next(expected)
+        cls.notify_current_song(expected)
+        cls.notify_update_library()
+        cls.queue_upcoming()
+        cls.library.save_resume()
     @classmethod
     def before(cls):
         """W pełni obsługuje rozpoczęcie odtwarzania poprzedniej piosenki"""
-        path = MusicLibrary.before()
-        LibMPVPlayer.next(path)
-        notify_current_song(path)
+        cls.skip(-1)
     @classmethod
     def play(cls):
         """W pełni obsługuje rozpoczęcie odtwarzania piosenki"""
-        path = MusicLibrary.play()
-        LibMPVPlayer.next(path)
-        if MusicLibrary.library:
-            notify_current_song(os.path.join(MusicLibrary.music_dir, 
-            MusicLibrary.library[Player.index_song]))
-            notify_update_library()
-
-def notify_current_song(song_path):
-    """Wysyla informacje o aktualnej piosence.  
+        if not cls.library.library:
+            return
+        path = cls.library.play()
+        cls.mpv.next(path)
+        if cls.library.library:
+            cls.notify_current_song(os.path.join(cls.library.music_dir,
+            cls.library.library[cls.state.index_song]))
+            cls.notify_update_library()
+        cls.queue_upcoming()
+        cls.library.save_resume()
+    @classmethod
+    def select(cls, song_name: str):
+        """Odtwarza piosenkę wybraną z listy"""
+        index = cls.library.get_index_song(song_name)
+        if not cls.library.library or cls.library.library[index] != song_name:
+            logger.warning("Wybranej piosenki nie ma w albumie: %s", song_name)
+            return
+        cls.state.name_song = song_name
+        cls.state.index_song = index
+        cls.play()
+    @classmethod
+    def set_volume(cls, volume):
+        cls.state.volume = volume
+        cls.mpv.set_volume()
+        cls.notify_volume()
+        cls.library.save_resume()
+    @classmethod
+    def toggle_random(cls):
+        cls.library.do_random(not cls.library.is_rnd_flag)
+        cls.notify_rnd_flag(cls.library.is_rnd_flag)
+        cls.queue_upcoming()
+        cls.library.save_resume()
+    @classmethod
+    def queue_upcoming(cls):
+        """Dopisuje do mpv piosenkę, która będzie następna, albo ją podmienia,
+        jeśli zmieniła się po przetasowaniu lub wyborze piosenki"""
+        cls.mpv.queue_next(cls.library.peek_next())
+    @classmethod
+    def set_playlist(cls, query: str, unique: bool | None = None):
+        """Buduje album z zapytania o tagi, wykonywane w wątku poleceń
+        Args:
+            unique (bool | None): jedna kopia z każdej grupy duplikatów, None - bez zmian"""
+        if unique is not None:
+            cls.library.unique = bool(unique)
+        cls.library.set_tag_query(query)
+        cls.notify_update_library()
+        cls.queue_upcoming()
+        cls.library.save_resume()
+
+    @classmethod
+    def notify_current_song(cls, song_path):
+        """Wysyla informacje o aktualnej piosence.  
+        Args:
+            song_path (str): ścieżka do audio od katalogu z muzyką
+        """
+        song_name = os.path.basename(song_path)
+        rel_path = os.path.relpath(song_path, cls.library.music_dir).replace("\\", "/")
+        cls.broadcaster.publish({"type": "song", "value": song_name, "path": rel_path,
+                                 "meta": cls.library.get_metadata(rel_path)})
+    @classmethod
+    def notify_volume(cls):
+        """Wysyla informacje o ustawionej głośności (0 do 100)"""
+        cls.broadcaster.publish({"type": "volume", "value": cls.state.volume})
+    @classmethod
+    def notify_rnd_flag(cls, is_rnd):
+        """Wysyla informacje, czy playlista jest ustawiona randomowo
+        Args:
+            is_rnd (bool): true -> jest ustawiona randomowo"""
+        cls.broadcaster.publish({"type": "random", "value": is_rnd})
+    @classmethod
+    def notify_progress(cls, state):
+        """Wysyla pozycję odtwarzania, długość utworu, pauzę i głośność z mpv
+        Args:
+            state (dict): LibMPVPlayer.state"""
+        # co sekundę, poza buforem powtórek - klient po ponownym połączeniu i tak dostanie następne
+        cls.broadcaster.publish({"type": "progress", "value": state}, replay=False)
+    @classmethod
+    def notify_update_library(cls):
+        """Wysyla zmiany w albumie względem poprzedniej wersji, jeśli jest nieaktualny"""
+        album = cls.library
+        if album.is_actual_library:
+            return
+        published = cls._published_library
+        # SongList się nie zmienia, zapamiętany album to tablica numerów, nie kopia nazw
+        songs = album.library
+        delta = library_delta.diff(published["songs"], songs)
+        value = {"version": album.library_version, "total": len(songs)}
+        if delta is None or published["version"] is None:
+            value["full"] = True
+        else:
+            value.update(delta, base=published["version"])
+        published["version"] = album.library_version
+        published["songs"] = songs
+        cls.broadcaster.publish({"type": "library_update", "value": value})
+        album.is_actual_library = True
+
+    @classmethod
+    def start_player(cls) -> bool:
+        """Tworzy mpv strefy i uruchamia jego pętlę zdarzeń
+        Returns:
+            bool: False, jeśli mpv nie został zainicjowany"""
+        cls.mpv()
+        if not cls.mpv.player:
+            logger.warning("Player strefy %s nie został zainicjowany", cls.zone_id)
+            return False
+        # pętla zdarzeń mpv nie zmienia stanu sama, tylko zleca to wątkowi poleceń
+        cls.mpv.on_song_end = lambda: cls.submit("skip", cls.skip, 1, merge=_add_steps)
+        cls.mpv.on_track_advance = lambda path: cls.submit("advance", cls.advanced, path)
+        cls.mpv.on_progress = cls.notify_progress
+        event_thread = threading.Thread(target=cls.mpv._event_loop, name=f"mpv-{cls.zone_id}", daemon=True)
+        event_thread.start()
+        logger.info("Pętla zdarzeń strefy %s uruchomiona", cls.zone_id)
+        return True
+
+    @classmethod
+    def resume_playback(cls):
+        """Wznawia ostatnio odtwarzaną piosenkę z zapisanego stanu, zanim biblioteka zostanie wczytana"""
+        snapshot = cls.library.load_resume()
+        cls.state.volume = snapshot.get("volume", cls.state.volume)
+        cls.library.is_rnd_flag = bool(snapshot.get("random", False))
+        cls.library.tag_query = snapshot.get("tag_query") or ""
+        cls.library.unique = bool(snapshot.get("unique", False))
+        cls.mpv.set_volume()
+        song = snapshot.get("song")
+        if song and os.path.isfile(os.path.join(cls.library.music_dir, song)):
+            cls.state.name_song = song
+            path = os.path.join(cls.library.music_dir, song)
+            cls.mpv.play(path)
+            cls.notify_current_song(path)
+
+    @classmethod
+    def start_album(cls):
+        """Buduje album po wczytaniu biblioteki. Wznowiona piosenka gra dalej,
+        bez niej odtwarzanie zaczyna się od początku albumu"""
+        resumed = cls.state.name_song
+        cls.library.do_library()
+        if cls.library.library:
+            index = cls.library.get_index_song(resumed)
+            path = cls.library.play(index)
+            if cls.library.library[index] != resumed:
+                cls.mpv.play(path)
+                cls.notify_current_song(path)
+            cls.queue_upcoming()
+        cls.notify_update_library()
+
+    @classmethod
+    def library_event(cls):
+        """Zdarzenie każące klientowi pobrać album od nowa przez /album"""
+        return {"type": "library_update",
+                "value": {"version": cls.library.library_version, "total": len(cls.library.library), "full": True}}
+
+    @classmethod
+    def current_state_events(cls):
+        """Zdarzenia z pełnym stanem, dla klienta który nie może nadrobić zaległości"""
+        song = cls.library.current_song()
+        return [
+            {"type": "song", "value": os.path.basename(song), "path": song},
+            {"type": "volume", "value": cls.state.volume},
+            {"type": "random", "value": cls.library.is_rnd_flag},
+            {"type": "library_status", "value": dict(_library_status)},
+            cls.library_event(),
+        ]
+
+broadcaster.snapshot = PlayerCtrl.current_state_events
+
+
+zones: dict[str, type[PlayerCtrl]] = {MAIN_ZONE: PlayerCtrl}
+"""Strefy odtwarzania: nazwa -> klasa sterująca"""
+_ZONE_NAME = re.compile(r"[A-Za-z0-9_-]+")
+
+def add_zone(zone_id: str, audio_device: str | None = None) -> type[PlayerCtrl]:
+    """Dodaje strefę: własny mpv, album, losowanie, głośność i kanał /zones/<zone_id>/stream.
+    Biblioteka, metadane i indeksy są wspólne. mpv startuje dopiero w start_player
     Args:
-        song_path (str): ścieżka do audio od katalogu z muzyką
-    """
-    song_name = os.path.basename(song_path)
-    song_update_queue.put({"type": "song", "value": song_name})
+        zone_id (str): nazwa strefy w adresach, litery, cyfry, "_" i "-"
+        audio_device (str | None): wyjście audio mpv, None - domyślne
+    Returns:
+        type[PlayerCtrl]: klasa sterująca strefą"""
+    if zone_id in zones:
+        return zones[zone_id]
+    if not _ZONE_NAME.fullmatch(zone_id):
+        raise ValueError(f"Niepoprawna nazwa strefy: {zone_id!r}")
+    state = type(f"Player_{zone_id}", (Player,), {"volume": Player.volume, "name_song": "", "index_song": 0})
+    ctrl = type(f"PlayerCtrl_{zone_id}", (PlayerCtrl,), {
+        "zone_id": zone_id,
+        "mpv": LibMPVPlayer.zone(zone_id, state, audio_device),
+        "library": MusicLibrary.zone(zone_id, state),
+        "state": state,
+        "broadcaster": EventBroadcaster(),
+        "_is_pause": False,
+        "_published_library": {"version": None, "songs": []},
+    })
+    ctrl.broadcaster.snapshot = ctrl.current_state_events
+    zones[zone_id] = ctrl
+    return ctrl
+
+for _zone_id, _device in zone_settings.devices.items():
+    add_zone(_zone_id, _device)
+
+def get_zone(zone_id: str) -> type[PlayerCtrl]:
+    """Klasa sterująca strefą z adresu, 404 dla nieznanej strefy"""
+    ctrl = zones.get(zone_id)
+    if ctrl is None:
+        abort(404)
+    return ctrl
 
-def notify_volume():
-    """Wysyla informacje o ustawionej głośności
+def library_changed(ops=None, scan=None):
+    """Nanosi zmiany z katalogu z muzyką i wysyła różnicę albumów wszystkich stref
     Args:
-        volume (int): Głośnośc do 0 do 100"""
-    song_update_queue.put({"type": "volume", "value": Player.volume})
+        ops (list | None): operacje z LibraryWatcher, None oznacza ponowne skanowanie
+        scan (tuple | None): wynik MusicLibrary.scan_music_files wykonanego w tle"""
+    changed = MusicLibrary.rescan(scan) if ops is None else MusicLibrary.apply_changes(ops)
+    if changed:
+        for ctrl in list(zones.values()):
+            ctrl.notify_update_library()
+            ctrl.queue_upcoming()
+    if ops is None and dedup.enabled:
+        # pełne skanowanie, hashe niezmienionych plików są w bazie
+        MusicLibrary.find_duplicates(lambda groups: commands.submit("duplicates", apply_duplicates, groups))
+
+def apply_duplicates(groups):
+    """Zapisuje grupy duplikatów i przebudowuje albumy stref w trybie jednej kopii"""
+    MusicLibrary.set_duplicates(groups)
+    for ctrl in list(zones.values()):
+        if ctrl.library.unique:
+            ctrl.library.do_library()
+            ctrl.notify_update_library()
+            ctrl.queue_upcoming()
+
+def apply_tags(ops) -> list[tuple]:
+    """Zmienia tagi paczką i przebudowuje albumy stref, które wybierają piosenki po tagach.
+    Wykonywane w wątku poleceń, zapis do bazy odbywa się w tle
+    Raises:
+        ValueError: niepoprawna operacja, nic nie zostało zmienione"""
+    changes = MusicLibrary.change_tags(ops)
+    if changes:
+        for ctrl in list(zones.values()):
+            if ctrl.library.tag_query or ctrl.library.tags:
+                ctrl.library.do_library()
+                ctrl.notify_update_library()
+                ctrl.queue_upcoming()
+    return changes
+
+_library_status = {"state": "starting"}
+"""Etap wczytywania biblioteki: starting, loading, scanning, ready"""
 
-def notify_rnd_flag(is_rnd):
-    """Wysyla informacje, czy playlista jest ustawiona randomowo
+def notify_library_status(state: str, **info):
+    """Wysyla do wszystkich stref etap wczytywania biblioteki przy starcie
     Args:
-        is_rnd (bool): true -> jest ustawiona randomowo"""
-    song_update_queue.put({"type": "random", "value": is_rnd})
-
-def notify_update_library():
-    """Wysyla aktualny album, jeśli jest nieaktualny"""
-    if MusicLibrary.is_actual_library:
-        return
-    album_data = MusicLibrary.library
-    if album_data == []:
-        album_data = ["aaa", "bbb", "ccc"] # do testów
-    song_update_queue.put({
-        "type": "library_update",
-        "value": album_data
-    })
-    MusicLibrary.is_actual_library = True
+        state (str): loading - odczyt z bazy, scanning - skanowanie katalogu, ready - gotowe"""
+    _library_status.clear()
+    _library_status.update(info, state=state)
+    for ctrl in list(zones.values()):
+        ctrl.broadcaster.publish({"type": "library_status", "value": dict(_library_status)})
+
+def load_library():
+    """Wczytuje wspólną bibliotekę z bazy w bieżącym wątku, w wątku poleceń
+    tylko ją podmienia i buduje albumy wszystkich stref"""
+    notify_library_status("loading")
+    loaded = MusicLibrary.load_dir_library()
+    commands.submit("load", _library_loaded, loaded).result()
+
+def _library_loaded(loaded: dict):
+    MusicLibrary.set_dir_library(loaded)
+    for ctrl in list(zones.values()):
+        ctrl.start_album()
+    notify_library_status("scanning", songs=len(MusicLibrary.full_library))
+
+def rescan_library():
+    """Skanuje katalog z muzyką w bieżącym wątku, w wątku poleceń tylko nanosi wynik"""
+    scan = MusicLibrary.scan_music_files()
+    commands.submit("library", library_changed, None, scan).result()
+
+def scan_library():
+    """Skanuje katalog z muzyką i zaczyna w tle odczyt metadanych"""
+    scan = MusicLibrary.scan_music_files()
+    commands.submit("scan", _library_scanned, scan).result()
 
+def _library_scanned(scan: tuple):
+    library_changed(None, scan)
+    MusicLibrary.update_metadata()
+    notify_library_status("ready", songs=len(MusicLibrary.full_library), scan=MusicLibrary.last_scan)
 
+def start_library() -> threading.Thread:
+    """Wznowienie każdej strefy w wątku poleceń, potem w osobnym wątku odczyt bazy
+    i skanowanie. Wątek poleceń tylko podmienia bibliotekę i nanosi wynik skanowania,
+    więc kliknięcia są obsługiwane od razu
+    Returns:
+        threading.Thread: wątek wczytywania biblioteki"""
+    for ctrl in list(zones.values()):
+        ctrl.submit("resume", ctrl.resume_playback)
+    thread = threading.Thread(target=_start_library, name="library", daemon=True)
+    thread.start()
+    return thread
+
+def _start_library():
+    try:
+        load_library()
+        scan_library()
+    except Exception as e:
+        logger.exception("Błąd wczytywania biblioteki: %s", e)
+
+def busy_response(future):
+    """Odpowiedź, gdy wątek poleceń nie zdążył wykonać polecenia: 503, jeśli polecenie
+    zostało anulowane i można je ponowić, 202, jeśli już się wykonuje"""
+    if future.cancel():
+        return jsonify({"error": "odtwarzacz zajęty, spróbuj ponownie"}), 503, {"Retry-After": "5"}
+    return jsonify({"status": "pending"}), 202
 
 @app.route('/click', methods=['GET', 'POST'])
-def click():
+@app.route('/zones/<zone_id>/click', methods=['GET', 'POST'])
+def click(zone_id=MAIN_ZONE):
     """Obsługuje odebranie informacji o kliknięciu w przycisk"""
-    
+    start = time.perf_counter()
+    button_id = None
+    ctrl = get_zone(zone_id)
     try:
         data = request.get_json()
-        print(f"Received data: {data}")
+        logger.debug("Received data: %s", data)
         
         if not data:
             return jsonify({"error": "No JSON data"}), 400
@@ -133,77 +546,236 @@ def click():
         button_id = data.get('button')
         
         if button_id == "test":
-            print("TEST button pressed")
+            logger.info("TEST button pressed")
             return jsonify({"status": "success", "message": "Test received in terminal"})
             
+        # polecenia trafiają do kolejki, odpowiedź nie czeka na mpv
         elif button_id == "stop":
-            PlayerCtrl.pause()
+            ctrl.submit("pause", ctrl.pause)
             
         elif button_id == "next":
-            PlayerCtrl.next()
+            ctrl.submit("skip", ctrl.skip, 1, merge=_add_steps)
             
         elif button_id == "before":
-            PlayerCtrl.before()
+            ctrl.submit("skip", ctrl.skip, -1, merge=_add_steps)
             
         elif button_id == "volume":
-            Player.volume = data.get('volume', Player.volume)
-            print(f"Volume change: {Player.volume}%")
-            LibMPVPlayer.set_volume()
-            notify_volume()
+            volume = data.get('volume', ctrl.state.volume)
+            logger.debug("Volume change: %s%%", volume)
+            # suwak wysyła serię zmian, wykonana będzie tylko najnowsza
+            ctrl.submit("volume", ctrl.set_volume, volume, key="volume")
             
         
         elif button_id == "random":
-            MusicLibrary.is_rnd_flag = not MusicLibrary.is_rnd_flag
-            print("Zmiana trybu randomowosci")
-            MusicLibrary.do_random(MusicLibrary.is_rnd_flag)
-            notify_rnd_flag(MusicLibrary.is_rnd_flag)
+            logger.debug("Zmiana trybu randomowosci")
+            ctrl.submit("random", ctrl.toggle_random)
             
         else:
-            print(f"Unknown button: {button_id}")
+            logger.warning("Unknown button: %s", button_id)
             return jsonify({"error": "Unknown button"}), 400
             
         return jsonify({"status": "success", "button": button_id})
         
     except Exception as e:
-        print(f"ERROR button: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("ERROR button: %s", e)
         return jsonify({"error": str(e)}), 500
+
+    finally:
+        label = button_id if button_id in CLICK_BUTTONS else "other"
+        CLICK_SECONDS.labels(label).observe(time.perf_counter() - start)
         
 
 @app.route("/stream", methods=['GET'])
-def stream():
-    def event_stream():
-        while True:
-            data = song_update_queue.get()
-            logging.debug("wyslano: " + str(data))
-            json_data = json.dumps(data)
-            yield f"data: {json_data}\n\n"
-    return Response(event_stream(), mimetype="text/event-stream")
+@app.route("/zones/<zone_id>/stream", methods=['GET'])
+def event_stream(zone_id=MAIN_ZONE):
+    """Kanał SSE strefy, każdy klient ma własną kolejkę zdarzeń"""
+    broadcaster = get_zone(zone_id).broadcaster
+    last_event_id = request.headers.get("Last-Event-ID", request.args.get("lastEventId"))
+    subscriber = broadcaster.subscribe(last_event_id)
+    def generate():
+        try:
+            yield f"retry: {stream.retry_ms}\n\n"
+            while True:
+                item = subscriber.get(stream.heartbeat)
+                if item is None:
+                    # komentarz podtrzymujący, przy okazji wykrywa rozłączonych klientów
+                    yield ": ping\n\n"
+                    continue
+                logger.debug("wyslano: %s", item[1])
+                yield format_sse(*item)
+        finally:
+            broadcaster.unsubscribe(subscriber)
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Metryki w formacie tekstowym Prometheusa"""
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
 
 @app.route('/test', methods=['GET'])
 def test_endpoint():
     return jsonify({"status": "ok", "message": "Serwer zwraca odp"})
 
 @app.route('/album', methods=['GET'])
-def get_album():
-    album_data = MusicLibrary.library
-    if album_data == []:
-        album_data = ["aaa", "bbb", "ccc"] # do testów
-    print(album_data)
-    return jsonify(album_data)
+@app.route('/zones/<zone_id>/album', methods=['GET'])
+def get_album(zone_id=MAIN_ZONE):
+    """Zwraca album stronami: /album?offset=0&limit=500.
+    Z meta=1 dołącza metadane piosenek ze strony.
+    Odpowiedź ma ETag z wersją albumu (z meta=1 także z wersją metadanych,
+    odczytywanych w tle), przy If-None-Match zwraca 304."""
+    album = get_zone(zone_id).library
+    version = album.library_version
+    songs = album.library
+    try:
+        offset = max(0, int(request.args.get("offset", 0)))
+        limit = int(request.args.get("limit", len(songs)))
+    except ValueError:
+        return jsonify({"error": "offset i limit muszą być liczbami"}), 400
+    limit = max(0, limit)
+    items = songs[offset:offset + limit]
+    data = {
+        "version": version,
+        "total": len(songs),
+        "offset": offset,
+        "items": items,
+    }
+    etag = str(version)
+    if request.args.get("meta"):
+        etag += f"-m{MusicLibrary.metadata_version}"
+        data["meta"] = {song: MusicLibrary.get_metadata(song) for song in items}
+    response = jsonify(data)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+@app.route('/media/<path:song>', methods=['GET'])
+def media(song):
+    """Plik piosenki do odtworzenia w przeglądarce. Obsługuje Range (206) do przewijania
+    i ETag/Last-Modified. W trybie async treść wysyła os.sendfile.
+    Args:
+        song (str): ścieżka względna piosenki, tylko z biblioteki"""
+    if song not in MusicLibrary.full_library:
+        abort(404)
+    # send_from_directory dodatkowo odrzuca ścieżki wychodzące poza katalog
+    return send_from_directory(MusicLibrary.music_dir, song, conditional=True)
+
+@app.route('/search', methods=['GET'])
+@app.route('/zones/<zone_id>/search', methods=['GET'])
+def search(zone_id=MAIN_ZONE):
+    """/search?q=kaz lodz&limit=20 - piosenki, w których słowa zaczynają się od słów zapytania,
+    bez rozróżniania wielkości liter i polskich znaków. Z album=1 tylko z aktualnego albumu,
+    z meta=1 dołącza metadane."""
+    query = request.args.get("q", "")
+    try:
+        limit = min(200, max(0, int(request.args.get("limit", 20))))
+    except ValueError:
+        return jsonify({"error": "limit musi być liczbą"}), 400
+    items = get_zone(zone_id).library.search(query, limit, album_only=bool(request.args.get("album")))
+    data = {"query": query, "items": items}
+    if request.args.get("meta"):
+        data["meta"] = {song: MusicLibrary.get_metadata(song) for song in items}
+    return jsonify(data)
+
+@app.route('/metadata', methods=['GET'])
+def get_metadata():
+    """/metadata?song=a.mp3&song=b.mp3 - metadane piosenek,
+    bez parametrów - stan odczytu metadanych w tle"""
+    songs = request.args.getlist("song")
+    if songs:
+        return jsonify({"songs": {song: MusicLibrary.get_metadata(song) for song in songs}})
+    extractor = MusicLibrary._extractor
+    return jsonify({
+        "known": len(MusicLibrary.metadata),
+        "running": extractor is not None and extractor.running,
+        "stats": extractor.stats if extractor is not None else {},
+    })
 
 @app.route('/wybrana-piosenka', methods=['POST'])
-def wybrana_piosenka():
+@app.route('/zones/<zone_id>/wybrana-piosenka', methods=['POST'])
+def wybrana_piosenka(zone_id=MAIN_ZONE):
     """Wykonuje się, gdy user wybrał z listy piosenkę"""
+    ctrl = get_zone(zone_id)
     data = request.json
-    Player.name_song = data["title"]
-    Player.index_song = MusicLibrary.get_index_song(Player.name_song)
-    print(f"Wybrano piosenkę: {data["title"]} {str(data["index"])} {str(Player.index_song)}")
-    PlayerCtrl.play()
+    logger.debug("Wybrano piosenkę: %s %s", data["title"], data["index"])
+    # szybkie wybieranie kolejnych piosenek - odtworzona będzie ostatnia
+    ctrl.submit("select", ctrl.select, data["title"], key="select")
     return jsonify({"status": "ok", "received": data})
 
 
+@app.route('/playlist', methods=['GET', 'POST'])
+@app.route('/zones/<zone_id>/playlist', methods=['GET', 'POST'])
+def playlist(zone_id=MAIN_ZONE):
+    """GET - aktualne zapytanie o tagi, POST {"query": "rock AND NOT live", "unique": true} - buduje album
+    z zapytania, unique (opcjonalne) zostawia jedną kopię z każdej grupy duplikatów"""
+    ctrl = get_zone(zone_id)
+    album = ctrl.library
+    if request.method == 'GET':
+        return jsonify({"query": album.tag_query, "unique": album.unique, "count": len(album.library)})
+    data = request.get_json(silent=True) or {}
+    future = ctrl.submit("playlist", ctrl.set_playlist, data.get("query", ""), data.get("unique"))
+    try:
+        future.result(timeout=10)
+    except TagQueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except concurrent.futures.TimeoutError:
+        return busy_response(future)
+    return jsonify({"status": "ok", "query": album.tag_query, "unique": album.unique, "count": len(album.library)})
+
+@app.route('/duplicates', methods=['GET'])
+def get_duplicates():
+    """Grupy piosenek o tej samej zawartości, z tagami każdej kopii (mogą się różnić)
+    i stanem wyszukiwania w tle. Tryb jednej kopii: POST /playlist {"unique": true}"""
+    library = MusicLibrary.full_library
+    groups = [{"songs": group, "tags": {song: library.get(song, []) for song in group}}
+              for group in MusicLibrary.duplicates]
+    finder = MusicLibrary._finder
+    return jsonify({
+        "groups": groups,
+        "copies": sum(len(group) - 1 for group in MusicLibrary.duplicates),
+        "running": finder is not None and finder.running,
+        "stats": finder.stats if finder is not None else {},
+    })
+
+@app.route('/tags', methods=['GET', 'POST'])
+def edit_tags():
+    """GET - tagi użyte w bibliotece i stan zapisu w tle.
+    POST {"ops": [{"path": "Kazik", "tag": "rock", "add": true}, ...]} - zmienia tagi paczką,
+    wszystkie operacje albo żadna. Ścieżka katalogu oznacza wszystkie piosenki w nim,
+    add domyślnie true. Odpowiedź nie czeka na zapis na dysk."""
+    writer = MusicLibrary._tag_writer
+    if request.method == 'GET':
+        return jsonify({"tags": sorted(MusicLibrary.full_library.tag_index),
+                        "pending": writer.pending if writer is not None else 0,
+                        "stats": writer.stats if writer is not None else {}})
+    data = request.get_json(silent=True) or {}
+    ops = data.get("ops")
+    if not isinstance(ops, list) or not all(isinstance(op, dict) for op in ops):
+        return jsonify({"error": "ops musi być listą operacji"}), 400
+    if len(ops) > tag_edit.max_ops:
+        return jsonify({"error": f"najwięcej {tag_edit.max_ops} operacji naraz"}), 400
+    ops = [(op.get("path"), op.get("tag"), op.get("add", True)) for op in ops]
+    future = commands.submit("tags", apply_tags, ops)
+    try:
+        changes = future.result(timeout=30)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except concurrent.futures.TimeoutError:
+        return busy_response(future)
+    writer = MusicLibrary._tag_writer
+    return jsonify({"status": "ok", "changed": len(changes), "songs": len({song for song, _, _ in changes}),
+                    "pending": writer.pending if writer is not None else 0})
+
+@app.route('/zones', methods=['GET'])
+def get_zones():
+    """Strefy odtwarzania z aktualną piosenką i głośnością"""
+    return jsonify({"zones": [
+        {"id": zone_id, "url": _zone_base(ctrl) + "/", "song": ctrl.state.name_song,
+         "volume": ctrl.state.volume, "songs": len(ctrl.library.library)}
+        for zone_id, ctrl in list(zones.items())
+    ]})
+
+
 @app.route('/test-post', methods=['POST'])
 def test_post():
     data = request.json
@@ -214,50 +786,47 @@ def run_flask_server():
     try:
         app.run(host="0.0.0.0", port=server.port, debug=True, use_reloader=False, threaded=True)
     except Exception as e:
-        logging.warning("Blad uruchomienia serwera Flask")
-        print(f"Blad uruchomienia serwera Flask: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Blad uruchomienia serwera Flask: %s", e)
+
+def _zone_stream(path: str):
+    """Kanał zdarzeń dla adresu /zones/<nazwa>/stream, None dla innych adresów"""
+    parts = path.split("/")
+    if len(parts) == 4 and parts[1] == "zones" and parts[3] == "stream":
+        ctrl = zones.get(parts[2])
+        return ctrl.broadcaster if ctrl is not None else None
+    return None
+
+def run_async_server():
+    """Uruchamia serwer asyncio, klienci /stream nie zajmują wątków"""
+    try:
+        AsyncServer(app, broadcaster, streams=_zone_stream).serve_forever("0.0.0.0", server.port)
+    except Exception as e:
+        logger.exception("Blad uruchomienia serwera async: %s", e)
 
 if __name__ == "__main__":
-    logging.debug("START")
-    
-    # Inicjalizuj player
-    player = LibMPVPlayer()
-    
-    if LibMPVPlayer.player:
-        print("Player created successfully")
-        LibMPVPlayer.on_song_end = PlayerCtrl.next
-        # Odtwórz pierwszą piosenkę jeśli biblioteka ma utwory
-        music_lib = MusicLibrary()
-        music_lib.read_dir_library()
-        music_lib._find_music_files()
-        print(len(music_lib.full_library))
-        music_lib.do_library()
-        print(len(music_lib.library))
-
-
-        if music_lib.library:
-            first_song_path = os.path.join(music_lib.music_dir, music_lib.library[0])
-            print(f"Piosenka : {first_song_path}")
-            LibMPVPlayer.play(first_song_path)
-
-            # wątek pętli zdarzeń
-            event_thread = threading.Thread(target=LibMPVPlayer._event_loop)
-            event_thread.daemon = True
-            event_thread.start()
-            print("Pętla zdarzeń uruchomiona")
-    else:
-        logging.warning("Player nie został zainicjowany")
-        print("player nie został zainicjowany")
+    setup_logging()
+    logger.debug("START")
     
-    print("Start serwera")
-    flask_thread = threading.Thread(target=run_flask_server)
+    # każda strefa ma własny mpv i pętlę zdarzeń
+    for ctrl in list(zones.values()):
+        if ctrl.start_player():
+            logger.info("Player strefy %s created successfully", ctrl.zone_id)
+
+    # serwer od razu, biblioteka wczytuje się w tle, klienci widzą postęp przez /stream
+    logger.info("Start serwera")
+    flask_thread = threading.Thread(target=run_async_server if server.mode == "async" else run_flask_server)
     flask_thread.daemon = True
     flask_thread.start()
+    start_library()
     
-    time.sleep(3)
-    print(f"Serwer dziala: {server.get_address()}")
+    if watch.enabled:
+        watcher = LibraryWatcher(MusicLibrary.music_dir, MusicLibrary.music_exts,
+                                 on_changes=lambda ops: commands.submit("library", library_changed, ops),
+                                 on_rescan=rescan_library)
+        watcher.start()
+
+    # adres IP tylko do wyświetlenia, nie opóźnia startu
+    threading.Thread(target=lambda: logger.info("Serwer dziala: %s", server.get_address()), daemon=True).start()
     
     while True:
         time.sleep(1)
@@ -0,0 +1,334 @@
+"""Serwer HTTP na asyncio: /stream jako korutyna, pozostałe trasy przez aplikację Flask w puli wątków"""
+import io
+import sys
+import asyncio
+import logging
+import functools
+from urllib.parse import unquote_to_bytes
+from concurrent.futures import ThreadPoolExecutor
+
+from scripts.settings import server, stream
+from scripts.event_broadcaster import EventBroadcaster, format_sse
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+_BUFFERED = 256 * 1024
+"""Tyle odpowiedzi Flask jest zbierane w wątku, zanim zacznie być wysyłane kawałkami"""
+_REASONS = {400: "Bad Request", 501: "Not Implemented"}
+
+
+class FileWrapper:
+    """wsgi.file_wrapper: plik oddany przez aplikację (np. send_file) jest wysyłany
+    przez loop.sendfile (os.sendfile, bez kopiowania do Pythona), a nie kawałkami"""
+
+    def __init__(self, file, block_size: int = 64 * 1024):
+        self.file = file
+        self.block_size = block_size
+
+    def seekable(self):
+        return self.file.seekable()
+
+    def seek(self, *args):
+        return self.file.seek(*args)
+
+    def tell(self):
+        return self.file.tell()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = self.file.read(self.block_size)
+        if not data:
+            raise StopIteration
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+class AsyncServer:
+    """Serwer HTTP/1.1 na asyncio, bez zewnętrznych bibliotek.
+
+    Klient /stream nie zajmuje wątku: czeka na zdarzenie z EventBroadcaster
+    albo na zamknięcie połączenia, więc rozłączony klient jest usuwany od razu,
+    a nie dopiero przy kolejnym zapisie. Pozostałe zapytania trafiają do
+    aplikacji WSGI (Flask) w puli server.workers wątków.
+    Kolejne kanały (np. strefy odtwarzania) podaje funkcja streams."""
+
+    def __init__(self, app, broadcaster: EventBroadcaster, stream_path: str = "/stream",
+                 workers: int = server.workers, streams=None):
+        """
+        Args:
+            streams: opcjonalna funkcja (ścieżka) -> EventBroadcaster | None
+                dla kanałów innych niż stream_path"""
+        self.app = app
+        self.broadcaster = broadcaster
+        self.stream_path = stream_path
+        self.streams = streams
+        self.port = None
+        """Port, na którym serwer faktycznie nasłuchuje (ważne dla portu 0)"""
+        self.stream_clients = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="wsgi")
+        self._server = None
+
+    def serve_forever(self, host: str, port: int):
+        asyncio.run(self._serve(host, port))
+
+    async def start(self, host: str, port: int):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Serwer async nasłuchuje na %s:%d", host, self.port)
+        return self._server
+
+    async def close(self):
+        """Zamyka gniazdo, czeka na zakończenie otwartych połączeń i zamyka pulę wątków"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self._pool.shutdown(wait=False)
+
+    async def _serve(self, host, port):
+        await self.start(host, port)
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        """Obsługuje połączenie, z keep-alive dla kolejnych zapytań"""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                request = self._parse(head)
+                if request is None:
+                    await self._error(writer, 400)
+                    break
+                method, target, version, headers = request
+                if "chunked" in headers.get("transfer-encoding", "").lower():
+                    await self._error(writer, 501)
+                    break
+                try:
+                    body = await reader.readexactly(int(headers.get("content-length") or 0))
+                except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                path, _, query = target.partition("?")
+                broadcaster = self._broadcaster_for(path) if method == "GET" else None
+                if broadcaster is not None:
+                    await self._stream(reader, writer, headers, query, broadcaster)
+                    break
+                environ = self._environ(writer, method, path, query, version, headers, body)
+                if not await self._wsgi(writer, environ, method, version, headers):
+                    break
+        except ConnectionError:
+            pass
+        except Exception as e:
+            logger.error("Błąd obsługi połączenia: %s", e)
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _parse(head: bytes):
+        """Zwraca (metoda, cel, wersja, nagłówki) albo None dla niepoprawnego zapytania"""
+        lines = head.decode("latin-1").split("\r\n")
+        parts = lines[0].split(" ")
+        if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+            return None
+        headers = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, sep, value = line.partition(":")
+            if not sep:
+                return None
+            name = name.strip().lower()
+            value = value.strip()
+            headers[name] = headers[name] + "," + value if name in headers else value
+        return parts[0], parts[1], parts[2], headers
+
+    def _environ(self, writer, method, path, query, version, headers, body) -> dict:
+        sockname = writer.get_extra_info("sockname") or ("", 0)
+        peername = writer.get_extra_info("peername") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": unquote_to_bytes(path).decode("latin-1"),
+            "QUERY_STRING": query,
+            "SERVER_NAME": str(sockname[0]),
+            "SERVER_PORT": str(sockname[1]),
+            "SERVER_PROTOCOL": version,
+            "REMOTE_ADDR": str(peername[0]),
+            "REMOTE_PORT": str(peername[1]),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in headers.items():
+            if name == "content-type":
+                environ["CONTENT_TYPE"] = value
+            elif name == "content-length":
+                environ["CONTENT_LENGTH"] = value
+            else:
+                environ["HTTP_" + name.upper().replace("-", "_")] = value
+        return environ
+
+    def _call_app(self, environ):
+        """Wywołuje aplikację WSGI w wątku z puli
+        Returns:
+            tuple: (status, nagłówki, zebrane kawałki, iterator reszty lub None, wynik aplikacji, plik lub None)"""
+        response = []
+        chunks = []
+        files = []
+
+        def file_wrapper(file, block_size=64 * 1024):
+            wrapper = FileWrapper(file, block_size)
+            files.append(wrapper)
+            return wrapper
+        environ["wsgi.file_wrapper"] = file_wrapper
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response[:] = [status, headers]
+            return chunks.append
+
+        result = self.app(environ, start_response)
+        sendable = bool(response) and response[0][:3] in ("200", "206")
+        if files and sendable and hasattr(files[-1].file, "fileno"):
+            # treść wyśle loop.sendfile, z przesunięciem z Content-Range dla zapytań Range
+            return response[0], response[1], chunks, None, result, files[-1].file
+        if not sendable:
+            # aplikacja odrzuciła otwarty plik (np. 416 dla zakresu spoza pliku),
+            # treścią jest odpowiedź błędu z jej własnym Content-Length
+            for wrapper in files:
+                wrapper.close()
+        iterator = iter(result)
+        size = 0
+        for chunk in iterator:
+            if chunk:
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= _BUFFERED:
+                    return response[0], response[1], chunks, iterator, result, None
+        return response[0], response[1], chunks, None, result, None
+
+    async def _wsgi(self, writer, environ, method, version, headers) -> bool:
+        """Wysyła odpowiedź aplikacji Flask
+        Returns:
+            bool: True, jeśli połączenie można wykorzystać ponownie"""
+        loop = asyncio.get_running_loop()
+        status, response_headers, chunks, rest, result, file = await loop.run_in_executor(
+            self._pool, self._call_app, environ)
+        try:
+            code = int(status.split(" ", 1)[0])
+            names = {name.lower() for name, _ in response_headers}
+            connection = headers.get("connection", "").lower()
+            keep_alive = ("close" not in connection if version == "HTTP/1.1" else "keep-alive" in connection)
+            # bez Content-Length koniec odpowiedzi wyznacza zamknięcie połączenia
+            if "content-length" not in names and (rest is not None or file is not None):
+                keep_alive = False
+            elif "content-length" not in names and method != "HEAD" and code not in (204, 304):
+                response_headers = response_headers + [("Content-Length", str(sum(map(len, chunks))))]
+            head = [f"HTTP/1.1 {status}"]
+            head += [f"{name}: {value}" for name, value in response_headers if name.lower() != "connection"]
+            head.append("Connection: " + ("keep-alive" if keep_alive else "close"))
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+            if file is not None and method != "HEAD":
+                await writer.drain()
+                offset, count = self._file_range(response_headers)
+                await loop.sendfile(writer.transport, file, offset, count)
+            elif method != "HEAD":
+                for chunk in chunks:
+                    writer.write(chunk)
+                await writer.drain()
+                while rest is not None:
+                    chunk = await loop.run_in_executor(self._pool, functools.partial(next, rest, _END))
+                    if chunk is _END:
+                        break
+                    writer.write(chunk)
+                    await writer.drain()
+            else:
+                await writer.drain()
+        finally:
+            if hasattr(result, "close"):
+                await loop.run_in_executor(self._pool, result.close)
+            if file is not None:
+                file.close()
+        return keep_alive
+
+    @staticmethod
+    def _file_range(headers):
+        """Przesunięcie i długość wysyłanej części pliku z Content-Range i Content-Length"""
+        values = {name.lower(): value for name, value in headers}
+        count = int(values["content-length"]) if "content-length" in values else None
+        offset = 0
+        content_range = values.get("content-range", "")
+        if content_range.startswith("bytes "):
+            offset = int(content_range[6:].split("-", 1)[0])
+        return offset, count
+
+    async def _error(self, writer, code: int):
+        writer.write(f"HTTP/1.1 {code} {_REASONS[code]}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+
+    def _broadcaster_for(self, path: str) -> EventBroadcaster | None:
+        if path == self.stream_path:
+            return self.broadcaster
+        if self.streams is not None:
+            return self.streams(path)
+        return None
+
+    async def _stream(self, reader, writer, headers, query, broadcaster: EventBroadcaster):
+        """Kanał SSE jako korutyna. Czeka na zdarzenie, heartbeat albo rozłączenie klienta."""
+        loop = asyncio.get_running_loop()
+        last_event_id = headers.get("last-event-id")
+        if last_event_id is None:
+            for pair in query.split("&"):
+                name, _, value = pair.partition("=")
+                if name == "lastEventId":
+                    last_event_id = value
+        wake = asyncio.Event()
+        subscriber = broadcaster.subscribe(last_event_id)
+        subscriber.notify = lambda: loop.call_soon_threadsafe(wake.set)
+        # klient nic już nie wysyła, koniec odczytu oznacza zamknięte połączenie
+        closed = asyncio.ensure_future(reader.read(1))
+        self.stream_clients += 1
+        try:
+            writer.write(("HTTP/1.1 200 OK\r\n"
+                          "Content-Type: text/event-stream; charset=utf-8\r\n"
+                          "Cache-Control: no-cache\r\n"
+                          "X-Accel-Buffering: no\r\n"
+                          "Access-Control-Allow-Origin: *\r\n"
+                          "Connection: close\r\n\r\n"
+                          f"retry: {stream.retry_ms}\n\n").encode())
+            await writer.drain()
+            while not closed.done():
+                # najpierw czyszczenie, żeby nie zgubić zdarzenia dodanego w międzyczasie
+                wake.clear()
+                item = subscriber.get(0)
+                if item is not None:
+                    writer.write(format_sse(*item).encode())
+                    await writer.drain()
+                    continue
+                woken = asyncio.ensure_future(wake.wait())
+                done, _ = await asyncio.wait({woken, closed}, timeout=stream.heartbeat,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                woken.cancel()
+                if not done:
+                    writer.write(b": ping\n\n")
+                    await writer.drain()
+        finally:
+            self.stream_clients -= 1
+            subscriber.notify = None
+            broadcaster.unsubscribe(subscriber)
+            closed.cancel()
@@ -0,0 +1,336 @@
+"""Zwarta reprezentacja biblioteki w pamięci, dla kolekcji z setkami tysięcy piosenek"""
+from array import array
+from collections.abc import Mapping, MutableMapping, Sequence
+
+
+class CompactLibrary(MutableMapping):
+    """Słownik ścieżka -> lista tagów, trzymany w tablicach zamiast obiektów na piosenkę.
+
+    Każda piosenka ma numer (id). Katalog jest zapisany raz, piosenka trzyma
+    tylko numer katalogu i nazwę pliku. Tagi mają numery, tagi piosenki to
+    maska bitowa (jedna liczba, takie same maski są współdzielone). Pełna
+    ścieżka i lista tagów są tworzone dopiero przy odczycie. Dla każdego tagu
+    jest zbiór numerów piosenek, aktualizowany przy każdej zmianie tagów.
+
+    Numery usuniętych piosenek nie są używane dla innych ścieżek, więc albumy (SongList)
+    zapisane wcześniej nadal odczytują ich ścieżki, a numery rosną w kolejności
+    dodania. Kolejność jak w dict: nowa piosenka trafia na koniec. Wyjątek: ścieżka
+    usunięta i dodana ponownie (np. plik zapisany od nowa) dostaje swój stary numer
+    i miejsce, więc albumy, które ją mają, nadal ją znajdują. Gdy usuniętych
+    numerów jest dużo (removed), compacted() daje kopię z numerami od nowa."""
+
+    def __init__(self, songs=None):
+        """
+        Args:
+            songs (dict | None): ścieżka -> lista tagów"""
+        self._dir_names: list[str] = []
+        self._dir_ids: dict[str, int] = {}
+        self._dir_songs: list[dict[str, int]] = []
+        """numer katalogu -> {nazwa pliku: id}"""
+        self._song_dir = array("i")
+        self._song_name: list[str] = []
+        self._song_tags: list[int] = []
+        """id -> maska bitowa tagów"""
+        self._alive = bytearray()
+        self._count = 0
+        self._removed_ids: dict[str, int] = {}
+        """ścieżka usuniętej piosenki -> jej numer, do ponownego użycia dla tej samej ścieżki"""
+        self._tag_names: list[str] = []
+        self._tag_ids: dict[str, int] = {}
+        self._masks: dict[int, int] = {}
+        """Maski bitowe, żeby piosenki z tymi samymi tagami dzieliły jeden obiekt int"""
+        self._tag_songs: list[set[int]] = []
+        """numer tagu -> numery piosenek z tym tagiem"""
+        self.tag_index = TagIndex(self)
+        """Widok tag -> zbiór ścieżek"""
+        self.tag_id_index = TagIndex(self, ids=True)
+        """Widok tag -> zbiór numerów piosenek, do zapytań bez tworzenia ścieżek"""
+        if songs:
+            self.update(songs)
+
+    @staticmethod
+    def _split(path: str) -> tuple[str, str]:
+        folder, _, name = path.rpartition("/")
+        return folder, name
+
+    def id_of(self, path: str) -> int | None:
+        """Numer piosenki albo None, jeśli jej nie ma"""
+        folder, name = self._split(path)
+        dir_id = self._dir_ids.get(folder)
+        if dir_id is None:
+            return None
+        return self._dir_songs[dir_id].get(name)
+
+    def path_of(self, song_id: int) -> str:
+        """Ścieżka piosenki, także usuniętej"""
+        folder = self._dir_names[self._song_dir[song_id]]
+        name = self._song_name[song_id]
+        return f"{folder}/{name}" if folder else name
+
+    def ids(self) -> array:
+        """Numery piosenek w kolejności dodania"""
+        alive = self._alive
+        return array("i", (song_id for song_id in range(len(alive)) if alive[song_id]))
+
+    @property
+    def removed(self) -> int:
+        """Liczba numerów usuniętych piosenek, które nadal zajmują miejsce"""
+        return len(self._alive) - self._count
+
+    def compacted(self) -> "CompactLibrary":
+        """Kopia z kolejnymi numerami piosenek, bez usuniętych piosenek i nieużywanych tagów.
+        Albumy (SongList) tej biblioteki trzeba utworzyć od nowa dla kopii"""
+        return CompactLibrary(self)
+
+    def _mask(self, tags) -> int:
+        mask = 0
+        for tag in tags:
+            tag_id = self._tag_ids.get(tag)
+            if tag_id is None:
+                tag_id = self._tag_ids[tag] = len(self._tag_names)
+                self._tag_names.append(tag)
+                self._tag_songs.append(set())
+            mask |= 1 << tag_id
+        return self._masks.setdefault(mask, mask)
+
+    def _set_mask(self, song_id: int, mask: int):
+        """Zmienia tagi piosenki i zbiory piosenek tylko tych tagów, które się zmieniły"""
+        changed = self._song_tags[song_id] ^ mask
+        tag_id = 0
+        while changed:
+            if changed & 1:
+                if mask >> tag_id & 1:
+                    self._tag_songs[tag_id].add(song_id)
+                else:
+                    self._tag_songs[tag_id].discard(song_id)
+            changed >>= 1
+            tag_id += 1
+        self._song_tags[song_id] = self._masks.setdefault(mask, mask)
+
+    def _tags(self, mask: int) -> list[str]:
+        names = self._tag_names
+        tags = []
+        tag_id = 0
+        while mask:
+            if mask & 1:
+                tags.append(names[tag_id])
+            mask >>= 1
+            tag_id += 1
+        return tags
+
+    def __getitem__(self, path: str) -> list[str]:
+        song_id = self.id_of(path)
+        if song_id is None:
+            raise KeyError(path)
+        return self._tags(self._song_tags[song_id])
+
+    def __setitem__(self, path: str, tags):
+        song_id = self.id_of(path)
+        if song_id is not None:
+            self._set_mask(song_id, self._mask(tags))
+            return
+        folder, name = self._split(path)
+        song_id = self._removed_ids.pop(path, None)
+        if song_id is not None:
+            self._dir_songs[self._song_dir[song_id]][name] = song_id
+            self._alive[song_id] = 1
+            self._count += 1
+            self._set_mask(song_id, self._mask(tags))
+            return
+        dir_id = self._dir_ids.get(folder)
+        if dir_id is None:
+            dir_id = self._dir_ids[folder] = len(self._dir_names)
+            self._dir_names.append(folder)
+            self._dir_songs.append({})
+        song_id = len(self._song_name)
+        self._dir_songs[dir_id][name] = song_id
+        self._song_dir.append(dir_id)
+        self._song_name.append(name)
+        self._song_tags.append(0)
+        self._set_mask(song_id, self._mask(tags))
+        self._alive.append(1)
+        self._count += 1
+
+    def __delitem__(self, path: str):
+        folder, name = self._split(path)
+        dir_id = self._dir_ids.get(folder)
+        song_id = None if dir_id is None else self._dir_songs[dir_id].pop(name, None)
+        if song_id is None:
+            raise KeyError(path)
+        self._set_mask(song_id, 0)
+        self._alive[song_id] = 0
+        self._removed_ids[path] = song_id
+        self._count -= 1
+
+    def __contains__(self, path) -> bool:
+        return isinstance(path, str) and self.id_of(path) is not None
+
+    def __iter__(self):
+        alive = self._alive
+        for song_id in range(len(alive)):
+            if alive[song_id]:
+                yield self.path_of(song_id)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __repr__(self):
+        return f"CompactLibrary({dict(self)!r})"
+
+    def add_tag(self, path: str, tag: str) -> bool:
+        """Returns:
+            bool: True, jeśli piosenka nie miała jeszcze tego tagu"""
+        song_id = self.id_of(path)
+        if song_id is None:
+            return False
+        mask = self._song_tags[song_id]
+        bit = self._mask([tag])
+        if mask & bit:
+            return False
+        self._set_mask(song_id, mask | bit)
+        return True
+
+    def remove_tag(self, path: str, tag: str) -> bool:
+        """Returns:
+            bool: True, jeśli piosenka miała ten tag"""
+        song_id = self.id_of(path)
+        tag_id = self._tag_ids.get(tag)
+        if song_id is None or tag_id is None or not self._song_tags[song_id] >> tag_id & 1:
+            return False
+        self._set_mask(song_id, self._song_tags[song_id] & ~(1 << tag_id))
+        return True
+
+    def ids_with_tag(self, tag: str) -> set[int]:
+        """Numery piosenek z tagiem (kopia), koszt zależy od liczby tych piosenek"""
+        tag_id = self._tag_ids.get(tag)
+        return set() if tag_id is None else set(self._tag_songs[tag_id])
+
+    def with_tag(self, tag: str) -> set[str]:
+        """Ścieżki piosenek z tagiem"""
+        tag_id = self._tag_ids.get(tag)
+        if tag_id is None:
+            return set()
+        return {self.path_of(song_id) for song_id in self._tag_songs[tag_id]}
+
+    def used_tags(self) -> list[str]:
+        """Tagi, które ma co najmniej jedna piosenka"""
+        return [tag for tag, songs in zip(self._tag_names, self._tag_songs) if songs]
+
+    def songs_under(self, path: str) -> list[str]:
+        """Piosenka o tej ścieżce albo wszystkie piosenki w katalogu i podkatalogach,
+        sprawdzane są katalogi, nie wszystkie piosenki"""
+        if path in self:
+            return [path]
+        prefix = path + "/"
+        songs = []
+        for dir_id, folder in enumerate(self._dir_names):
+            if folder == path or folder.startswith(prefix):
+                songs.extend((song_id, name) for name, song_id in self._dir_songs[dir_id].items())
+        songs.sort()
+        return [self.path_of(song_id) for song_id, _ in songs]
+
+
+class TagIndex(Mapping):
+    """Widok tag -> zbiór ścieżek (albo numerów piosenek) dla CompactLibrary.
+    Czyta zbiory piosenek tagów biblioteki, więc nie trzeba go aktualizować przy zmianie tagów"""
+
+    def __init__(self, library: CompactLibrary, ids: bool = False):
+        self._library = library
+        self._songs = library.ids_with_tag if ids else library.with_tag
+
+    def __getitem__(self, tag: str) -> set:
+        songs = self._songs(tag)
+        if not songs:
+            raise KeyError(tag)
+        return songs
+
+    def __iter__(self):
+        return iter(self._library.used_tags())
+
+    def __len__(self) -> int:
+        return len(self._library.used_tags())
+
+    def __repr__(self):
+        return f"TagIndex({dict(self)!r})"
+
+
+class SongList(Sequence):
+    """Album jako tablica numerów piosenek (4 bajty na piosenkę) z CompactLibrary.
+    Odczyt zwraca ścieżki, więc zachowuje się jak lista nazw. Nie zmienia się
+    po utworzeniu, zmiana albumu to nowy SongList."""
+    __slots__ = ("library", "song_ids", "_positions", "positions")
+
+    def __init__(self, library: CompactLibrary, song_ids=()):
+        self.library = library
+        self.song_ids = array("i", song_ids)
+        self._positions = array("i", [-1]) * (max(self.song_ids, default=-1) + 1)
+        """id -> pozycja w albumie, -1 gdy piosenki nie ma"""
+        for position, song_id in enumerate(self.song_ids):
+            self._positions[song_id] = position
+        self.positions = Positions(self)
+        """Widok ścieżka -> pozycja, zastępuje słownik pozycji"""
+
+    @classmethod
+    def from_paths(cls, library: CompactLibrary, paths) -> "SongList":
+        """Album z listy ścieżek, piosenki spoza biblioteki są pomijane"""
+        ids = (library.id_of(path) for path in paths)
+        return cls(library, (song_id for song_id in ids if song_id is not None))
+
+    def __len__(self) -> int:
+        return len(self.song_ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.library.path_of(song_id) for song_id in self.song_ids[index]]
+        return self.library.path_of(self.song_ids[index])
+
+    def __iter__(self):
+        return map(self.library.path_of, self.song_ids)
+
+    def __contains__(self, path) -> bool:
+        return self.position(path) is not None
+
+    def __eq__(self, other):
+        if isinstance(other, SongList) and other.library is self.library:
+            return self.song_ids == other.song_ids
+        if isinstance(other, (SongList, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"SongList({list(self)!r})"
+
+    def position(self, path: str, default=None):
+        """Pozycja piosenki w albumie w czasie stałym"""
+        song_id = self.library.id_of(path) if isinstance(path, str) else None
+        if song_id is None or song_id >= len(self._positions) or self._positions[song_id] < 0:
+            return default
+        return self._positions[song_id]
+
+
+class Positions(Mapping):
+    """Widok ścieżka -> pozycja w albumie dla SongList"""
+    __slots__ = ("_songs",)
+
+    def __init__(self, songs: SongList):
+        self._songs = songs
+
+    def __getitem__(self, path: str) -> int:
+        position = self._songs.position(path)
+        if position is None:
+            raise KeyError(path)
+        return position
+
+    def get(self, path, default=None):
+        return self._songs.position(path, default)
+
+    def __contains__(self, path) -> bool:
+        return self._songs.position(path) is not None
+
+    def __iter__(self):
+        return iter(self._songs)
+
+    def __len__(self) -> int:
+        return len(self._songs)
@@ -0,0 +1,181 @@
+"""Wyszukiwanie duplikatów po zawartości pliku, etapami: rozmiar, początek i koniec, całość"""
+import os
+import mmap
+import time
+import hashlib
+import logging
+import threading
+import functools
+
+from scripts.settings import dedup as settings
+from scripts.worker_pool import run_batches
+
+logger = logging.getLogger(__name__)
+
+
+def file_hash(path: str, size: int, full: bool, edge: int = settings.edge_bytes) -> str:
+    """Hash zawartości pliku przez mmap, bez kopiowania go do pamięci procesu
+    Args:
+        path (str): pełna ścieżka
+        size (int): rozmiar pliku, wchodzi do hasha
+        full (bool): False - tylko edge bajtów z początku i z końca
+    Returns:
+        str: hash, dla plików nie większych niż 2 * edge taki sam dla full=False i True"""
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    if size == 0:
+        return digest.hexdigest()
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if full or size <= 2 * edge:
+            digest.update(mm)
+        else:
+            digest.update(mm[:edge])
+            digest.update(mm[-edge:])
+    return digest.hexdigest()
+
+
+def _hash_batch(music_dir, full, edge, batch):
+    """Liczy hashe paczki plików, wywoływane w procesie roboczym
+    Args:
+        batch (list): (ścieżka względna, rozmiar, mtime)
+    Returns:
+        list: (ścieżka względna, hash albo None dla pliku, którego nie da się odczytać)"""
+    results = []
+    for rel_path, size, _ in batch:
+        try:
+            results.append((rel_path, file_hash(os.path.join(music_dir, rel_path), size, full, edge)))
+        except (OSError, ValueError):
+            results.append((rel_path, None))
+    return results
+
+
+def _groups(entries: dict, paths, key) -> list[list[str]]:
+    """Grupy ścieżek o tym samym kluczu, tylko grupy z więcej niż jedną ścieżką"""
+    groups = {}
+    for path in paths:
+        value = key(entries[path])
+        if value is not None:
+            groups.setdefault(value, []).append(path)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+class DuplicateFinder:
+    """Wątek w tle szukający plików o tej samej zawartości.
+
+    Pliki są grupowane po rozmiarze, hashowane są tylko te o powtarzającym się
+    rozmiarze, najpierw edge bajtów z początku i końca. Całe pliki są czytane
+    tylko wtedy, gdy i te hashe się powtarzają. Hashe są zapamiętywane
+    z (rozmiar, mtime), niezmienione pliki nie są czytane ponownie."""
+
+    def __init__(self, music_dir: str, cache: dict, on_hashes, on_done, workers: int = settings.workers):
+        """
+        Args:
+            music_dir (str): katalog z muzyką
+            cache (dict): ścieżka -> (rozmiar, mtime, hash początku i końca, hash całości)
+            on_hashes: funkcja wywoływana z listą nowych wierszy w formacie cache (ścieżka, ...)
+            on_done: funkcja wywoływana z listą grup duplikatów (posortowane listy ścieżek)"""
+        self.music_dir = music_dir
+        self.cache = cache
+        self.on_hashes = on_hashes
+        self.on_done = on_done
+        self.workers = workers
+        self.edge = settings.edge_bytes
+        self.stats = {"total": 0, "same_size": 0, "partial": 0, "full": 0, "groups": 0, "time": 0.0}
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, songs):
+        """Uruchamia wyszukiwanie w tle
+        Args:
+            songs (list[str]): ścieżki względne plików do porównania"""
+        self._thread = threading.Thread(target=self._run, args=(list(songs),), name="duplicates", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self, songs):
+        start = time.perf_counter()
+        try:
+            groups = self.find(songs)
+        except Exception as e:
+            logger.error("Błąd wyszukiwania duplikatów: %s", e)
+            return
+        if groups is None:
+            return
+        self.stats["time"] = round(time.perf_counter() - start, 3)
+        logger.info("Duplikaty: %(groups)d grup, rozmiar powtarza się w %(same_size)d/%(total)d plikach, "
+                    "hashowane: %(partial)d częściowo, %(full)d w całości, %(time).3f s", self.stats)
+        self.on_done(groups)
+
+    def find(self, songs) -> list[list[str]] | None:
+        """Wyszukuje duplikaty w bieżącym wątku
+        Returns:
+            list[list[str]] | None: grupy duplikatów, None po stop()"""
+        entries = {}
+        """ścieżka -> [rozmiar, mtime, hash początku i końca, hash całości]"""
+        for rel_path in songs:
+            if self._stop.is_set():
+                return None
+            try:
+                st = os.stat(os.path.join(self.music_dir, rel_path))
+            except OSError:
+                continue
+            cached = self.cache.get(rel_path)
+            if cached is not None and tuple(cached[:2]) == (st.st_size, st.st_mtime_ns):
+                entries[rel_path] = list(cached)
+            else:
+                entries[rel_path] = [st.st_size, st.st_mtime_ns, None, None]
+        self.stats["total"] = len(entries)
+
+        same_size = _groups(entries, entries, lambda e: e[0])
+        candidates = [path for group in same_size for path in group]
+        self.stats["same_size"] = len(candidates)
+        self.stats["partial"] = self._hash(entries, [p for p in candidates if entries[p][2] is None], full=False)
+        if self._stop.is_set():
+            return None
+
+        same_edges = _groups(entries, candidates, lambda e: e[2] and (e[0], e[2]))
+        colliding = [path for group in same_edges for path in group]
+        self.stats["full"] = self._hash(entries, [p for p in colliding if entries[p][3] is None], full=True)
+        if self._stop.is_set():
+            return None
+
+        groups = sorted(sorted(group) for group in _groups(entries, colliding, lambda e: e[3] and (e[0], e[3])))
+        self.stats["groups"] = len(groups)
+        return groups
+
+    def _hash(self, entries: dict, paths: list[str], full: bool) -> int:
+        """Liczy hashe w puli procesów i zapisuje je w entries oraz przez on_hashes
+        Returns:
+            int: liczba plików, dla których liczono hash"""
+        if not paths:
+            return 0
+        todo = [(path, entries[path][0], entries[path][1]) for path in paths]
+        run_batches(functools.partial(_hash_batch, self.music_dir, full, self.edge), todo,
+                    lambda results: self._collect(entries, results, full), settings,
+                    self.workers, self._stop, "hashe")
+        return len(todo)
+
+    def _collect(self, entries: dict, results, full: bool):
+        rows = []
+        for path, digest in results:
+            entry = entries[path]
+            if full:
+                entry[3] = digest
+            else:
+                entry[2] = digest
+                if digest is not None and entry[0] <= 2 * self.edge:
+                    # mały plik został zahashowany w całości już w pierwszym etapie
+                    entry[3] = digest
+            if digest is not None:
+                rows.append((path, *entry))
+        if rows:
+            self.on_hashes(rows)
@@ -0,0 +1,152 @@
+"""Rozsyłanie zdarzeń SSE do wielu klientów /stream"""
+import json
+import itertools
+import threading
+import logging
+from collections import deque
+
+from scripts.settings import stream
+
+logger = logging.getLogger(__name__)
+
+
+class Subscriber:
+    """Kolejka zdarzeń jednego klienta /stream.
+    Zdarzenia z stream.merged_types opisują stan (piosenka, głośność...), więc nowsze
+    zastępuje starsze tego samego typu, które klient jeszcze nie odebrał. Zmiany albumu
+    (library_update) zależą od poprzednich i nie są łączone. Gdy kolejka jest pełna,
+    najstarsze zdarzenie jest odrzucane."""
+
+    _numbers = itertools.count(1)
+
+    def __init__(self, maxsize: int = stream.queue_size):
+        self.number = next(self._numbers)
+        """Numer klienta, etykieta w metrykach"""
+        self.maxsize = maxsize
+        self.events = deque()
+        self.dropped = 0
+        """Liczba zdarzeń odrzuconych, bo klient nie nadążał"""
+        self.merged = 0
+        """Liczba zdarzeń zastąpionych nowszymi tego samego typu"""
+        self._cond = threading.Condition()
+        self.notify = None
+        """Funkcja wywoływana po dodaniu zdarzenia, np. budzi korutynę serwera async"""
+
+    def put(self, event_id: int, event: dict):
+        """Dodaje zdarzenie do kolejki klienta, nigdy nie blokuje"""
+        with self._cond:
+            event_type = event.get("type")
+            if event_type in stream.merged_types:
+                for i, (_, queued) in enumerate(self.events):
+                    if queued.get("type") == event_type:
+                        del self.events[i]
+                        self.merged += 1
+                        break
+            if len(self.events) >= self.maxsize:
+                self.events.popleft()
+                self.dropped += 1
+            self.events.append((event_id, event))
+            self._cond.notify()
+        if self.notify is not None:
+            self.notify()
+
+    def get(self, timeout: float = stream.heartbeat):
+        """Zwraca (id, zdarzenie) lub None, jeśli w czasie timeout nic nie przyszło"""
+        with self._cond:
+            if not self.events:
+                self._cond.wait(timeout)
+            if not self.events:
+                return None
+            return self.events.popleft()
+
+    def __len__(self):
+        return len(self.events)
+
+
+def format_sse(event_id: int, event: dict) -> str:
+    """Zdarzenie w formacie text/event-stream"""
+    return f"id: {event_id}\ndata: {json.dumps(event)}\n\n"
+
+
+class EventBroadcaster:
+    """Rozsyła każde zdarzenie do wszystkich podłączonych klientów.
+    Ostatnie zdarzenia trzyma w buforze cyklicznym, żeby klient, który się
+    ponownie połączył z nagłówkiem Last-Event-ID, dostał to, co go ominęło."""
+
+    def __init__(self, history_size: int = stream.history_size, queue_size: int = stream.queue_size):
+        self.queue_size = queue_size
+        self.snapshot = None
+        """Funkcja zwracająca listę zdarzeń z pełnym stanem, używana gdy
+        brakujących zdarzeń nie ma już w buforze"""
+        self._lock = threading.Lock()
+        self._subscribers: set[Subscriber] = set()
+        self._history = deque(maxlen=history_size)
+        self._evicted_id = 0
+        """Id ostatniego zdarzenia usuniętego z bufora, starszych nie da się powtórzyć"""
+        self._last_id = 0
+
+    @property
+    def subscribers(self):
+        """Kopia listy podłączonych klientów"""
+        with self._lock:
+            return tuple(self._subscribers)
+
+    @property
+    def last_id(self) -> int:
+        """Numer ostatniego opublikowanego zdarzenia"""
+        return self._last_id
+
+    def publish(self, event: dict, replay: bool = True) -> int:
+        """Wysyła zdarzenie do wszystkich klientów
+        Args:
+            event (dict): zdarzenie {"type": ..., "value": ...}
+            replay (bool): False - tylko dla podłączonych klientów, bez zapisu w buforze
+                (np. postęp odtwarzania co sekundę, który wypchnąłby z bufora resztę zdarzeń)
+        Returns:
+            int: id nadane zdarzeniu"""
+        with self._lock:
+            self._last_id += 1
+            if replay:
+                if len(self._history) == self._history.maxlen:
+                    self._evicted_id = self._history[0][0]
+                self._history.append((self._last_id, event))
+            for sub in self._subscribers:
+                sub.put(self._last_id, event)
+            return self._last_id
+
+    def subscribe(self, last_event_id=None) -> Subscriber:
+        """Rejestruje nowego klienta.
+        Args:
+            last_event_id (str | int | None): id ostatniego zdarzenia, które klient odebrał
+        Returns:
+            Subscriber: kolejka zdarzeń klienta"""
+        sub = Subscriber(self.queue_size)
+        with self._lock:
+            for event_id, event in self._missed(last_event_id):
+                sub.put(event_id, event)
+            self._subscribers.add(sub)
+        logger.debug("Nowy klient /stream, razem: %d", len(self._subscribers))
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        """Usuwa klienta, np. po zerwaniu połączenia"""
+        with self._lock:
+            self._subscribers.discard(sub)
+        logger.debug("Klient /stream rozłączony, razem: %d", len(self._subscribers))
+
+    def _missed(self, last_event_id):
+        """Zdarzenia, których klient nie dostał od last_event_id"""
+        if last_event_id in (None, ""):
+            return []
+        try:
+            last_event_id = int(last_event_id)
+        except (TypeError, ValueError):
+            last_event_id = -1
+        if last_event_id == self._last_id:
+            return []
+        if self._evicted_id <= last_event_id < self._last_id:
+            return [(i, e) for i, e in self._history if i > last_event_id]
+        # Zdarzeń nie ma już w buforze (albo serwer był restartowany) - pełny stan
+        if self.snapshot is None:
+            return []
+        return [(self._last_id, event) for event in self.snapshot()]
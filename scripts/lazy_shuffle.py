@@ -0,0 +1,74 @@
+"""Leniwe tasowanie Fishera-Yatesa"""
+import random
+
+
+class LazyShuffle:
+    """Losowa permutacja liczb 0..n-1 wyciągana po jednej liczbie w O(1).
+
+    Zamiast tasować całą listę z góry, każde draw() wykonuje jeden krok
+    algorytmu Fishera-Yatesa. Tablica permutacji jest rzadka: pamiętane są
+    tylko pozycje, które zostały zamienione, więc utworzenie kolejki
+    dla miliona piosenek nic nie kosztuje, a pamięć rośnie z liczbą losowań."""
+
+    def __init__(self, n: int = 0):
+        self.reset(n)
+
+    def reset(self, n: int):
+        """Nowa runda: wszystkie liczby 0..n-1 znowu są do wylosowania"""
+        self.n = n
+        self._drawn = 0
+        self._values: dict[int, int] = {}
+        """pozycja -> wartość, tylko tam gdzie wartość różni się od pozycji"""
+        self._positions: dict[int, int] = {}
+        """wartość -> pozycja, odwrotność _values"""
+        self._peeked = None
+
+    @property
+    def remaining(self) -> int:
+        return self.n - self._drawn + (self._peeked is not None)
+
+    def _swap(self, p: int, q: int):
+        a, b = self._values.get(p, p), self._values.get(q, q)
+        for pos, value in ((p, b), (q, a)):
+            if pos == value:
+                self._values.pop(pos, None)
+                self._positions.pop(value, None)
+            else:
+                self._values[pos] = value
+                self._positions[value] = pos
+
+    def _step(self):
+        if self._drawn >= self.n:
+            return None
+        i = self._drawn
+        self._swap(i, random.randrange(i, self.n))
+        self._drawn += 1
+        value = self._values.pop(i, i)
+        self._positions.pop(value, None)
+        return value
+
+    def draw(self):
+        """Zwraca kolejną wylosowaną liczbę albo None na końcu rundy"""
+        if self._peeked is not None:
+            value, self._peeked = self._peeked, None
+            return value
+        return self._step()
+
+    def peek(self):
+        """Liczba, którą zwróci następne draw(), bez jej zużywania"""
+        if self._peeked is None:
+            self._peeked = self._step()
+        return self._peeked
+
+    def take(self, value: int):
+        """Oznacza liczbę jako już wylosowaną, np. piosenkę, która właśnie gra"""
+        if self._peeked == value:
+            self._peeked = None
+            return
+        pos = self._positions.get(value, value)
+        if not self._drawn <= pos < self.n or self._values.get(pos, pos) != value:
+            return
+        self._swap(self._drawn, pos)
+        self._drawn += 1
+        self._values.pop(self._drawn - 1, None)
+        self._positions.pop(value, None)
@@ -2,15 +2,52 @@
 import os
 import ctypes
 import logging
+import threading
 import time
+import functools
+from concurrent.futures import Future
 logger = logging.getLogger(__name__)
 
 from scripts.settings import paths, Player
+from scripts import metrics
+
+MPV_COMMAND_SECONDS = metrics.histogram(
+    "mpv_command_seconds", "Czas od wysłania polecenia do odpowiedzi mpv", ["command"])
+MPV_COMMAND_ERRORS = metrics.counter(
+    "mpv_command_errors_total", "Polecenia odrzucone przez mpv", ["command"])
+EVENT_LOOP_LAG = metrics.histogram(
+    "mpv_event_loop_wakeup_lag_seconds", "Czas od callbacka budzącego mpv do obsługi zdarzeń w pętli")
 
 MPV_END_FILE_REASON_EOF = 0  # Normalne zakończenie
 MPV_END_FILE_REASON_STOP = 2  # Zatrzymane przez użytkownika
 MPV_END_FILE_REASON_QUIT = 3  # Zakończenie aplikacji
+MPV_END_FILE_REASON_ERROR = 4  # Błąd odtwarzania pliku
+MPV_EVENT_NONE = 0
+MPV_EVENT_SHUTDOWN = 1
+MPV_EVENT_SET_PROPERTY_REPLY = 4
+MPV_EVENT_COMMAND_REPLY = 5
+MPV_EVENT_START_FILE = 6
 MPV_EVENT_END_FILE = 7  # Zakończenie pliku
+MPV_EVENT_PROPERTY_CHANGE = 22
+
+MPV_FORMAT_NONE = 0
+MPV_FORMAT_STRING = 1
+MPV_FORMAT_FLAG = 3
+MPV_FORMAT_INT64 = 4
+MPV_FORMAT_DOUBLE = 5
+MPV_FORMAT_NODE_ARRAY = 7
+MPV_FORMAT_NODE_MAP = 8
+
+MPV_ERROR_UNINITIALIZED = -3
+
+OBSERVED_PROPERTIES = {
+    # reply_userdata: (nazwa w mpv, format, klucz w LibMPVPlayer.state)
+    1: ("time-pos", MPV_FORMAT_DOUBLE, "time"),
+    2: ("duration", MPV_FORMAT_DOUBLE, "duration"),
+    3: ("pause", MPV_FORMAT_FLAG, "pause"),
+    4: ("volume", MPV_FORMAT_DOUBLE, "volume"),
+}
+"""Właściwości mpv obserwowane przez mpv_observe_property"""
 
 try:
     libmpv = ctypes.CDLL(paths.libmpv_path_termux)
@@ -18,7 +55,7 @@ except Exception as e:
     try:
         libmpv = ctypes.CDLL(paths.libmpv_path_local)
     except Exception as e:
-        logging.error(f"Nie udało się załadować libmpv: {e}")
+        logger.error(f"Nie udało się załadować libmpv: {e}")
         libmpv = None
 
 # Definicje potrzebne do mpv_handle
@@ -38,6 +75,134 @@ class mpv_event(ctypes.Structure):
         ("data", ctypes.c_void_p),
     ]
 
+class mpv_event_property(ctypes.Structure):
+    _fields_ = [
+        ("name", ctypes.c_char_p),
+        ("format", ctypes.c_int),
+        ("data", ctypes.c_void_p),
+    ]
+
+class mpv_event_start_file(ctypes.Structure):
+    _fields_ = [
+        ("playlist_entry_id", ctypes.c_int64),
+    ]
+
+class mpv_event_end_file(ctypes.Structure):
+    _fields_ = [
+        ("reason", ctypes.c_int),
+        ("error", ctypes.c_int),
+        ("playlist_entry_id", ctypes.c_int64),
+        ("playlist_insert_id", ctypes.c_int64),
+        ("playlist_insert_num_entries", ctypes.c_int),
+    ]
+
+class mpv_node(ctypes.Structure):
+    pass
+
+class mpv_node_list(ctypes.Structure):
+    _fields_ = [
+        ("num", ctypes.c_int),
+        ("values", ctypes.POINTER(mpv_node)),
+        ("keys", ctypes.POINTER(ctypes.c_char_p)),
+    ]
+
+class _mpv_node_u(ctypes.Union):
+    _fields_ = [
+        ("string", ctypes.c_char_p),
+        ("flag", ctypes.c_int),
+        ("int64", ctypes.c_int64),
+        ("double_", ctypes.c_double),
+        ("list", ctypes.POINTER(mpv_node_list)),
+        ("ba", ctypes.c_void_p),
+    ]
+
+mpv_node._fields_ = [
+    ("u", _mpv_node_u),
+    ("format", ctypes.c_int),
+]
+
+class mpv_event_command(ctypes.Structure):
+    _fields_ = [
+        ("result", mpv_node),
+    ]
+
+def _node_value(node: mpv_node):
+    """Zamienia mpv_node na typy pythonowe"""
+    fmt = node.format
+    if fmt == MPV_FORMAT_STRING:
+        return node.u.string.decode("utf-8", "replace")
+    if fmt == MPV_FORMAT_FLAG:
+        return bool(node.u.flag)
+    if fmt == MPV_FORMAT_INT64:
+        return node.u.int64
+    if fmt == MPV_FORMAT_DOUBLE:
+        return node.u.double_
+    if fmt in (MPV_FORMAT_NODE_ARRAY, MPV_FORMAT_NODE_MAP) and node.u.list:
+        lst = node.u.list.contents
+        values = [_node_value(lst.values[i]) for i in range(lst.num)]
+        if fmt == MPV_FORMAT_NODE_ARRAY:
+            return values
+        return {lst.keys[i].decode(): values[i] for i in range(lst.num)}
+    return None
+
+def _error_string(error: int) -> str:
+    """Opis kodu błędu libmpv"""
+    if libmpv is None:
+        return str(error)
+    return libmpv.mpv_error_string(error).decode("utf-8", "replace")
+
+
+class MPVError(Exception):
+    """Polecenie albo zmiana właściwości odrzucona przez mpv"""
+
+    def __init__(self, code: int, operation: str):
+        self.code = code
+        self.operation = operation
+        super().__init__(f"{operation}: {_error_string(code)} ({code})")
+
+
+@functools.lru_cache(maxsize=128)
+def _encode_args(args: tuple):
+    """Tablica char* dla mpv_command_async. mpv kopiuje argumenty, więc tablice
+    powtarzanych poleceń (playlist-clear, stop...) mogą być używane wielokrotnie"""
+    return (ctypes.c_char_p * (len(args) + 1))(*[a.encode("utf-8") for a in args], None)
+
+
+@functools.lru_cache(maxsize=None)
+def _encode_name(name: str) -> bytes:
+    return name.encode("utf-8")
+
+
+def _property_data(value):
+    """Zamienia wartość na (format mpv, obiekt ctypes) dla mpv_set_property_async"""
+    if isinstance(value, bool):
+        return MPV_FORMAT_FLAG, ctypes.c_int(int(value))
+    if isinstance(value, int):
+        return MPV_FORMAT_INT64, ctypes.c_int64(value)
+    if isinstance(value, float):
+        return MPV_FORMAT_DOUBLE, ctypes.c_double(value)
+    return MPV_FORMAT_STRING, ctypes.c_char_p(str(value).encode("utf-8"))
+
+
+def _log_failure(future: Future):
+    """Domyślne zgłoszenie błędu polecenia, gdy wywołujący nie czeka na wynik"""
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("mpv: %s", future.exception())
+
+def _preread(file_path: str):
+    """Wczytuje początek pliku do pamięci podręcznej systemu, żeby przejście
+    na ten plik nie czekało na odczyt z karty SD"""
+    try:
+        with open(file_path, "rb") as f:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), 0, Player.preread_bytes, os.POSIX_FADV_WILLNEED)
+            else:
+                f.read(Player.preread_bytes)
+    except OSError as e:
+        logger.debug("Nie udało się wczytać początku %s: %s", file_path, e)
+
+WAKEUP_CALLBACK = ctypes.CFUNCTYPE(None, ctypes.c_void_p)
+
 if libmpv:
     libmpv.mpv_wait_event.argtypes = [ctypes.c_void_p, ctypes.c_double]
     libmpv.mpv_wait_event.restype = ctypes.POINTER(mpv_event)
@@ -45,6 +210,18 @@ if libmpv:
     libmpv.mpv_event_name.argtypes = [ctypes.c_int]
     libmpv.mpv_event_name.restype = ctypes.c_char_p
 
+    libmpv.mpv_set_wakeup_callback.argtypes = [ctypes.c_void_p, WAKEUP_CALLBACK, ctypes.c_void_p]
+    libmpv.mpv_set_wakeup_callback.restype = None
+    libmpv.mpv_observe_property.argtypes = [ctypes.c_void_p, ctypes.c_uint64, ctypes.c_char_p, ctypes.c_int]
+    libmpv.mpv_observe_property.restype = ctypes.c_int
+    libmpv.mpv_command_async.argtypes = [ctypes.c_void_p, ctypes.c_uint64, ctypes.POINTER(ctypes.c_char_p)]
+    libmpv.mpv_command_async.restype = ctypes.c_int
+    libmpv.mpv_set_property_async.argtypes = [ctypes.c_void_p, ctypes.c_uint64, ctypes.c_char_p,
+                                              ctypes.c_int, ctypes.c_void_p]
+    libmpv.mpv_set_property_async.restype = ctypes.c_int
+    libmpv.mpv_error_string.argtypes = [ctypes.c_int]
+    libmpv.mpv_error_string.restype = ctypes.c_char_p
+
 
 class LibMPVPlayer:
     """Obsługuje zewnętrzną bibliotekę libmpv"""
@@ -54,14 +231,67 @@ class LibMPVPlayer:
     running = False
     counter = 0
     on_song_end = None
-    _time_last_event_stop = time.time()  # Czas ostatniego zatrzymania piosenki
-    
+    on_track_advance = None
+    """Wywoływane ze ścieżką pliku, gdy mpv sam przeszedł do pliku z kolejki (gapless)"""
+    on_progress = None
+    """Wywoływane z dict state po zmianie obserwowanych właściwości (ograniczone czasowo)"""
+    state = {"time": None, "duration": None, "pause": False, "volume": None}
+    """Ostatnie wartości obserwowanych właściwości mpv"""
+    _wakeup = threading.Event()
+    _wakeup_cb = None  # referencja do callbacka, żeby nie został zwolniony
+    _load_token = 0
+    """reply_userdata ostatniego polecenia asynchronicznego"""
+    _replies: dict[int, tuple] = {}
+    """reply_userdata -> (Future, nazwa operacji, czas wysłania) dla poleceń czekających na odpowiedź"""
+    _wakeup_at = 0.0
+    """Czas ostatniego callbacka budzącego, do pomiaru opóźnienia pętli"""
+    _cmd_lock = threading.RLock()
+    """RLock: odpowiedź może być obsłużona jeszcze w trakcie wysyłania, w tym samym wątku"""
+    _pending_load = None
+    """token loadfile, na którego odpowiedź jeszcze czekamy"""
+    _current_entry_id = None
+    """playlist_entry_id pliku wczytanego ostatnim loadfile"""
+    _expect_start_file = False
+    _current_path = None
+    """Ścieżka aktualnie odtwarzanego pliku"""
+    _queued_path = None
+    """Ścieżka pliku dopisanego do playlisty mpv jako następny"""
+    _queued_entry_id = None
+    _pending_queue = None
+    """token loadfile append, na którego odpowiedź jeszcze czekamy"""
+    _last_progress = 0.0
+    player_state = Player
+    """Ustawienia odtwarzania (głośność, gapless), dla strefy jej własna podklasa Player"""
+    audio_device = None
+    """Wyjście audio mpv (audio-device), None - domyślne"""
+
+    @classmethod
+    def zone(cls, name: str, player_state=Player, audio_device: str | None = None):
+        """Tworzy niezależny odtwarzacz dla strefy: podklasę z własnym uchwytem mpv
+        i stanem. Kod pozostaje wspólny, strefa kosztuje kilka słowników i jeden uchwyt mpv.
+        Args:
+            name (str): nazwa strefy
+            player_state: ustawienia odtwarzania strefy
+            audio_device (str | None): wyjście audio mpv, np. "alsa/hw:1"
+        Returns:
+            type[LibMPVPlayer]: klasa odtwarzacza strefy"""
+        return type(f"{cls.__name__}_{name}", (cls,), {
+            "_instance": None, "_initialized": False, "player": None, "running": False, "counter": 0,
+            "on_song_end": None, "on_track_advance": None, "on_progress": None,
+            "state": {"time": None, "duration": None, "pause": False, "volume": None},
+            "_wakeup": threading.Event(), "_wakeup_cb": None, "_load_token": 0, "_replies": {},
+            "_wakeup_at": 0.0, "_cmd_lock": threading.RLock(), "_pending_load": None,
+            "_current_entry_id": None, "_expect_start_file": False, "_current_path": None,
+            "_queued_path": None, "_queued_entry_id": None, "_pending_queue": None,
+            "_last_progress": 0.0, "player_state": player_state, "audio_device": audio_device,
+        })
+
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
             
             if libmpv is None:
-                logging.error("Biblioteka libmpv nie jest dostępna")
+                logger.error("Biblioteka libmpv nie jest dostępna")
                 return cls._instance
 
             # Tworzenie instancji mpv tylko jeśli biblioteka jest dostępna
@@ -70,123 +300,318 @@ class LibMPVPlayer:
                 if cls.player:
                     ret = libmpv.mpv_initialize(cls.player)
                     if ret < 0:
-                        logging.error(f"Nie udało się zainicjalizować mpv, kod: {ret}")
+                        logger.error(f"Nie udało się zainicjalizować mpv, kod: {ret}")
                         cls.player = None
                     else:
                         cls._initialized = True
-                        logging.info("MPV zainicjalizowany pomyślnie")
+                        cls._setup_events()
+                        logger.info("MPV zainicjalizowany pomyślnie")
                 else:
-                    logging.error("Nie udało się utworzyć instancji mpv")
+                    logger.error("Nie udało się utworzyć instancji mpv")
             except Exception as e:
-                logging.exception("Błąd podczas inicjalizacji mpv: %s", e)
+                logger.exception("Błąd podczas inicjalizacji mpv: %s", e)
                 cls.player = None
         
         return cls._instance
 
     @classmethod
-    def _event_stop_time(cls):
-        print(str(time.time() - cls._time_last_event_stop))
-        if time.time() - cls._time_last_event_stop > 2:
-            cls._time_last_event_stop = time.time()
-            return True
+    def _setup_events(cls):
+        """Rejestruje callback budzący pętlę zdarzeń i obserwowane właściwości"""
+        cls._wakeup_cb = WAKEUP_CALLBACK(lambda _: cls._wake())
+        libmpv.mpv_set_wakeup_callback(cls.player, cls._wakeup_cb, None)
+        for userdata, (name, fmt, _) in OBSERVED_PROPERTIES.items():
+            ret = libmpv.mpv_observe_property(cls.player, userdata, name.encode(), fmt)
+            if ret < 0:
+                logger.warning(f"Nie można obserwować {name}: {_error_string(ret)}")
+        if cls.audio_device:
+            cls._set_property("audio-device", cls.audio_device)
+        if cls.player_state.gapless:
+            # mpv otwiera i demultipleksuje następny wpis playlisty zawczasu
+            cls._set_property("gapless-audio", "yes")
+            cls._set_property("prefetch-playlist", True)
+
+    @classmethod
+    def _wake(cls):
+        """Callback budzący z wątku mpv"""
+        if not cls._wakeup.is_set():
+            cls._wakeup_at = time.perf_counter()
+            cls._wakeup.set()
 
     @classmethod
-    def _cmd(cls, *args):
-        """Wywołanie polecenia mpv"""
+    def _submit(cls, operation: str, send, pending: str | None = None) -> Future:
+        """Wysyła asynchroniczne zapytanie do mpv i zwraca Future z jego wynikiem.
+        Odpowiedź przychodzi w pętli zdarzeń i jest dopasowywana przez reply_userdata.
+        Args:
+            operation (str): opis do komunikatów o błędach
+            send: funkcja (reply_userdata) -> kod zwrócony przez libmpv
+            pending (str | None): atrybut klasy (np. "_pending_load"), w którym token jest
+                zapisany przed wysłaniem, bo odpowiedź może przyjść, zanim send zwróci"""
+        future = Future()
+        future.token = None
+        future.add_done_callback(_log_failure)
         if not cls.player:
-            logging.warning("Player nie jest zainicjalizowany")
-            return
-        
-        try:
-            arr = (ctypes.c_char_p * (len(args) + 1))()
-            arr[:-1] = [s.encode("utf-8") for s in args]
-            arr[-1] = None
-            libmpv.mpv_command(cls.player, arr)
-        except Exception as e:
-            logging.error(f"Błąd podczas wykonywania polecenia: {e}")
+            future.set_exception(MPVError(MPV_ERROR_UNINITIALIZED, operation))
+            return future
+        with cls._cmd_lock:
+            cls._load_token += 1
+            token = cls._load_token
+            # rejestracja przed wysłaniem, odpowiedź może przyjść od razu
+            future.token = token
+            cls._replies[token] = (future, operation, time.perf_counter())
+            if pending is not None:
+                setattr(cls, pending, token)
+            try:
+                ret = send(token)
+            except Exception:
+                cls._unregister(token, pending)
+                raise
+            if ret < 0:
+                cls._unregister(token, pending)
+                future.token = None
+                MPV_COMMAND_ERRORS.labels(operation).inc()
+                future.set_exception(MPVError(ret, operation))
+        return future
+
+    @classmethod
+    def _unregister(cls, token: int, pending: str | None):
+        """Wycofuje rejestrację polecenia, którego nie udało się wysłać"""
+        cls._replies.pop(token, None)
+        if pending is not None and getattr(cls, pending) == token:
+            setattr(cls, pending, None)
+
+    @classmethod
+    def _cmd(cls, *args, pending: str | None = None) -> Future:
+        """Polecenie mpv przez mpv_command_async, nie czeka na wykonanie
+        Args:
+            pending (str | None): atrybut na token polecenia, patrz _submit
+        Returns:
+            Future: wynik polecenia albo MPVError, future.token to reply_userdata"""
+        arr = _encode_args(args)
+        return cls._submit(args[0], lambda token: libmpv.mpv_command_async(cls.player, token, arr), pending)
+
+    @classmethod
+    def _set_property(cls, name: str, value) -> Future:
+        """Ustawia właściwość mpv w jej typie (flag, double...), bez zamiany na tekst
+        Returns:
+            Future: None albo MPVError"""
+        fmt, data = _property_data(value)
+        return cls._submit(f"set {name}", lambda token: libmpv.mpv_set_property_async(
+            cls.player, token, _encode_name(name), fmt, ctypes.addressof(data)))
 
     @classmethod
     def play(cls, file_path):
         if not cls.player:
-            logging.warning("Player nie jest zainicjalizowany")
+            logger.warning("Player nie jest zainicjalizowany")
             return
             
         if file_path is None:
-            logging.warning("Nie podano pliku do odtworzenia")
+            logger.warning("Nie podano pliku do odtworzenia")
             return
             
         if not os.path.exists(file_path):
-            logging.warning(f"Plik nie istnieje: {file_path}")
+            logger.warning("Plik nie istnieje: %s", file_path)
             return
-            
-        cls._cmd("loadfile", file_path, "replace")
-    
+
+        # Koniec pliku liczy się tylko dla pliku z tego loadfile,
+        # odpowiedź (reply_userdata == token) poda jego playlist_entry_id
+        cls._current_entry_id = None
+        cls._current_path = file_path
+        # replace czyści playlistę mpv, razem z plikiem z kolejki
+        cls._queued_path = None
+        cls._queued_entry_id = None
+        cls._pending_queue = None
+        return cls._cmd("loadfile", file_path, "replace", pending="_pending_load")
+
+    @classmethod
+    def queue_next(cls, file_path):
+        """Dopisuje plik do playlisty mpv jako następny (gapless), zastępując
+        poprzednio dopisany. Początek pliku jest wczytywany do pamięci podręcznej.
+        Args:
+            file_path (str | None): pełna ścieżka, None usuwa plik z kolejki"""
+        if not cls.player or not cls.player_state.gapless or file_path == cls._queued_path:
+            return
+        if cls._queued_path is not None or cls._pending_load is None:
+            # usuwa wszystko poza aktualnym plikiem: dopisany wcześniej i już odtworzone
+            cls._cmd("playlist-clear")
+        cls._queued_path = file_path
+        cls._queued_entry_id = None
+        cls._pending_queue = None
+        if file_path is None:
+            return
+        cls._cmd("loadfile", file_path, "append", pending="_pending_queue")
+        threading.Thread(target=_preread, args=(file_path,), daemon=True).start()
+
     @classmethod
     def _event_loop(cls):
+        """Pętla zdarzeń mpv. Śpi, dopóki mpv nie wywoła callbacka budzącego,
+        potem odbiera wszystkie oczekujące zdarzenia."""
         if not cls.player:
             return
         cls.running = True
+        cls._wake()  # zdarzenia sprzed startu pętli
         while cls.running:
+            cls._wakeup.wait()
+            cls._wakeup.clear()
+            EVENT_LOOP_LAG.observe(time.perf_counter() - cls._wakeup_at)
             try:
-                event_ptr = libmpv.mpv_wait_event(cls.player, 0.1)
-                if not event_ptr:
-                    continue
-                event = event_ptr.contents
-                ev_name = libmpv.mpv_event_name(event.event_id).decode()
-                if event.event_id == 0:
-                    continue
-                if event.event_id == MPV_EVENT_END_FILE and cls._event_stop_time():
-                    # Koniec odtwarzania pliku
-                    print(f"EVENT: {event.event_id} ({ev_name})")
-                    reason = ctypes.cast(event.data, ctypes.POINTER(ctypes.c_int)).contents.value
-                    if reason == MPV_END_FILE_REASON_EOF:
-                        print("Plik się skończył")
-                    elif reason == MPV_END_FILE_REASON_QUIT or reason == MPV_END_FILE_REASON_STOP:
-                        print("User zmienił utwór")
-                        continue
-                    else:
-                        logging.info("Koniec pliku (brak danych o przyczynie)")
-                        
-                    if cls.on_song_end:
-                        cls.on_song_end()
+                while cls.running and cls.player:
+                    event = libmpv.mpv_wait_event(cls.player, 0).contents
+                    if event.event_id == MPV_EVENT_NONE:
+                        break
+                    cls._handle_event(event)
             except Exception as e:
-                logging.error(f"Błąd w pętli zdarzeń: {e}")
+                logger.error("Błąd w pętli zdarzeń: %s", e)
                 break
 
     @classmethod
-    def pause(cls):
-        logging.debug("LIBMPV - PAUSE")
-        cls._cmd("set", "pause", "yes")
+    def _handle_event(cls, event):
+        """Obsługuje jedno zdarzenie z mpv_wait_event"""
+        event_id = event.event_id
+        if event_id == MPV_EVENT_PROPERTY_CHANGE:
+            cls._property_changed(event)
+        elif event_id == MPV_EVENT_COMMAND_REPLY:
+            cls._command_reply(event)
+            cls._resolve(event)
+        elif event_id == MPV_EVENT_SET_PROPERTY_REPLY:
+            cls._resolve(event)
+        elif event_id == MPV_EVENT_START_FILE:
+            if cls._expect_start_file:
+                start = ctypes.cast(event.data, ctypes.POINTER(mpv_event_start_file)).contents
+                cls._current_entry_id = start.playlist_entry_id
+                cls._expect_start_file = False
+        elif event_id == MPV_EVENT_END_FILE:
+            end = ctypes.cast(event.data, ctypes.POINTER(mpv_event_end_file)).contents
+            if cls._pending_load is not None or end.playlist_entry_id != cls._current_entry_id:
+                # koniec pliku, który został już zastąpiony innym
+                return
+            if end.reason in (MPV_END_FILE_REASON_EOF, MPV_END_FILE_REASON_ERROR):
+                if end.reason == MPV_END_FILE_REASON_ERROR:
+                    logger.warning("Błąd odtwarzania: %s", _error_string(end.error))
+                if cls._queued_path is not None:
+                    # mpv sam przechodzi do dopisanego pliku, bez przerwy
+                    path = cls._queued_path
+                    cls._current_path = path
+                    cls._current_entry_id = cls._queued_entry_id
+                    cls._expect_start_file = cls._queued_entry_id is None
+                    cls._queued_path = None
+                    cls._queued_entry_id = None
+                    cls._pending_queue = None
+                    if cls.on_track_advance:
+                        cls.on_track_advance(path)
+                    return
+                cls._current_entry_id = None
+                if cls.on_song_end:
+                    cls.on_song_end()
+        elif event_id == MPV_EVENT_SHUTDOWN:
+            cls.running = False
+
+    @classmethod
+    def _command_reply(cls, event):
+        """Odpowiedź na mpv_command_async, dopasowana przez reply_userdata"""
+        if event.reply_userdata == cls._pending_load:
+            cls._pending_load = None
+            entry_id = cls._reply_entry_id(event)
+            if entry_id is not None:
+                cls._current_entry_id = entry_id
+            else:
+                # starsze mpv nie zwracają id, weźmiemy je z najbliższego START_FILE
+                cls._expect_start_file = event.error >= 0
+        elif event.reply_userdata == cls._pending_queue:
+            cls._pending_queue = None
+            cls._queued_entry_id = cls._reply_entry_id(event)
+            if event.error < 0:
+                cls._queued_path = None
+
+    @classmethod
+    def _resolve(cls, event):
+        """Kończy Future polecenia, na które przyszła odpowiedź"""
+        with cls._cmd_lock:
+            entry = cls._replies.pop(event.reply_userdata, None)
+        if entry is None:
+            return
+        future, operation, sent = entry
+        MPV_COMMAND_SECONDS.labels(operation).observe(time.perf_counter() - sent)
+        if event.error < 0:
+            MPV_COMMAND_ERRORS.labels(operation).inc()
+            future.set_exception(MPVError(event.error, operation))
+        elif event.event_id == MPV_EVENT_COMMAND_REPLY and event.data:
+            future.set_result(_node_value(ctypes.cast(event.data, ctypes.POINTER(mpv_event_command)).contents.result))
+        else:
+            future.set_result(None)
+
+    @staticmethod
+    def _reply_entry_id(event):
+        """playlist_entry_id z odpowiedzi na loadfile, None gdy go nie ma"""
+        if event.error < 0:
+            # błąd zgłasza Future polecenia
+            return None
+        result = _node_value(ctypes.cast(event.data, ctypes.POINTER(mpv_event_command)).contents.result)
+        if isinstance(result, dict):
+            return result.get("playlist_entry_id")
+        return None
+
+    @classmethod
+    def _property_changed(cls, event):
+        """Zapisuje nową wartość obserwowanej właściwości i powiadamia klientów"""
+        observed = OBSERVED_PROPERTIES.get(event.reply_userdata)
+        if observed is None:
+            return
+        _, _, key = observed
+        prop = ctypes.cast(event.data, ctypes.POINTER(mpv_event_property)).contents
+        if prop.format == MPV_FORMAT_DOUBLE and prop.data:
+            value = ctypes.cast(prop.data, ctypes.POINTER(ctypes.c_double)).contents.value
+        elif prop.format == MPV_FORMAT_FLAG and prop.data:
+            value = bool(ctypes.cast(prop.data, ctypes.POINTER(ctypes.c_int)).contents.value)
+        else:
+            value = None
+        if cls.state.get(key) == value:
+            return
+        cls.state[key] = value
+        now = time.monotonic()
+        # pozycja zmienia się ciągle, więc jest wysyłana co najwyżej co progress_interval,
+        # pozostałe zmiany (pauza, głośność, długość) od razu
+        if key == "time" and now - cls._last_progress < cls.player_state.progress_interval:
+            return
+        cls._last_progress = now
+        if cls.on_progress:
+            cls.on_progress(dict(cls.state))
+
+    @classmethod
+    def pause(cls) -> Future:
+        logger.debug("LIBMPV - PAUSE")
+        return cls._set_property("pause", True)
 
     @classmethod
-    def resume(cls):
-        logging.debug("LIBMPV - RESUME")
-        cls._cmd("set", "pause", "no")
+    def resume(cls) -> Future:
+        logger.debug("LIBMPV - RESUME")
+        return cls._set_property("pause", False)
 
     @classmethod
-    def stop(cls):
-        logging.debug("LIBMPV - STOP")
-        cls._cmd("stop")
+    def stop(cls) -> Future:
+        logger.debug("LIBMPV - STOP")
+        return cls._cmd("stop")
 
     @classmethod
-    def set_volume(cls):
-        """Ustawia głośność zapisaną w Player.volume"""
-        logging.debug("LIBMPV - SET_VOLUME " + str(Player.volume))
-        cls._cmd("set", "volume", str(Player.volume))
+    def set_volume(cls) -> Future:
+        """Ustawia głośność zapisaną w player_state.volume"""
+        logger.debug("LIBMPV - SET_VOLUME %s", cls.player_state.volume)
+        return cls._set_property("volume", float(cls.player_state.volume))
 
     @classmethod
     def next(cls, file_path):
-        logging.debug("LIBMPV - NEXT")
-        cls.play(file_path)
+        logger.debug("LIBMPV - NEXT")
+        return cls.play(file_path)
         
     
     @classmethod
     def close(cls):
-        logging.debug("LIBMPV - CLOSE")
+        logger.debug("LIBMPV - CLOSE")
+        cls.running = False
+        cls._wakeup.set()
         if cls.player:
             try:
                 libmpv.mpv_destroy(cls.player)
             except Exception as e:
-                logging.error(f"Błąd podczas zamykania player: {e}")
+                logger.error(f"Błąd podczas zamykania player: {e}")
             finally:
                 cls.player = None
@@ -0,0 +1,47 @@
+"""Różnice między wersjami albumu wysyłane w zdarzeniach library_update
+
+Klient odtwarza nową listę ze starej w trzech krokach:
+    1. usuwa elementy o indeksach z "remove",
+    2. jeśli jest "order", układa pozostałe elementy: nowa[i] = pozostałe[order[i]],
+    3. wstawia elementy z "insert" ([indeks, nazwa], rosnąco po indeksie).
+Po przetasowaniu wysyłana jest sama permutacja indeksów zamiast nazw piosenek.
+"""
+
+
+def diff(old: list[str], new: list[str]) -> dict | None:
+    """Liczy różnicę między dwiema wersjami albumu
+    Args:
+        old (list[str]): album w wersji, którą ma klient
+        new (list[str]): aktualny album
+    Returns:
+        dict | None: {"remove": [...], "order": [...] (opcjonalnie), "insert": [...]}
+        lub None, gdy różnica nie byłaby mniejsza niż cały album"""
+    new_set = set(new)
+    remove = [i for i, song in enumerate(old) if song not in new_set]
+    if remove:
+        removed = set(remove)
+        kept = [song for i, song in enumerate(old) if i not in removed]
+    else:
+        kept = old
+    kept_pos = {song: i for i, song in enumerate(kept)}
+    if len(kept_pos) != len(kept):
+        return None  # powtórzone nazwy, indeksy byłyby niejednoznaczne
+    insert = [[i, song] for i, song in enumerate(new) if song not in kept_pos]
+    if len(insert) * 2 > len(new):
+        return None
+    delta = {"remove": remove, "insert": insert}
+    new_kept = [song for song in new if song in kept_pos] if insert else new
+    if new_kept != kept:
+        delta["order"] = [kept_pos[song] for song in new_kept]
+    return delta
+
+
+def apply(old: list[str], delta: dict) -> list[str]:
+    """Odtwarza nową wersję albumu z różnicy (to samo robi klient w script.js)"""
+    removed = set(delta.get("remove", ()))
+    songs = [song for i, song in enumerate(old) if i not in removed]
+    if "order" in delta:
+        songs = [songs[i] for i in delta["order"]]
+    for i, song in delta.get("insert", ()):
+        songs.insert(i, song)
+    return songs
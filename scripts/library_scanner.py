@@ -0,0 +1,137 @@
+"""Przyrostowe, równoległe skanowanie katalogu z muzyką"""
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from scripts.settings import scan
+
+logger = logging.getLogger(__name__)
+
+
+class ScanError(OSError):
+    """Katalogu z muzyką nie ma albo nie można go odczytać (np. odmontowana karta),
+    wynik skanowania nie może posłużyć do usuwania piosenek"""
+
+
+class LibraryScanner:
+    """Skanuje katalog z muzyką przez os.scandir.
+
+    Dla każdego katalogu pamięta mtime oraz listę plików audio i podkatalogów.
+    Jeśli mtime katalogu się nie zmienił, jego zawartość jest brana z pamięci
+    podręcznej i katalog nie jest listowany. mtime katalogu zmienia się tylko
+    gdy zmieniają się jego bezpośrednie wpisy, więc podkatalogi i tak są
+    sprawdzane, ale kosztuje to jeden stat zamiast listowania.
+    Katalogi najwyższego poziomu są skanowane równolegle."""
+
+    def __init__(self, music_dir: str, music_exts, cache: dict | None = None, workers: int = scan.workers):
+        self.music_dir = music_dir
+        self.music_exts = {ext.lower() for ext in music_exts}
+        self.workers = workers
+        cache = cache or {}
+        self._old_dirs = cache.get("dirs", {}) if cache.get("music_dir") == music_dir else {}
+        self._trusted_before = cache.get("time", 0) - scan.mtime_granularity
+        self.cache = {}
+        """Nowa pamięć podręczna po skanowaniu, do zapisania i podania przy kolejnym skanowaniu"""
+        self.stats = {}
+        """Statystyki ostatniego skanowania"""
+        self.unreadable: list[str] = []
+        """Katalogi, których nie udało się odczytać, ich zawartość jest brana z pamięci podręcznej"""
+
+    def scan(self) -> list[str]:
+        """Skanuje cały katalog z muzyką
+        Returns:
+            list[str]: ścieżki względne wszystkich plików audio, z separatorem "/"
+        Raises:
+            ScanError: katalogu z muzyką nie ma albo nie można go odczytać"""
+        start = time.perf_counter()
+        started_at = time.time()
+        dirs = {}
+        self.unreadable = []
+        root = self._list_dir("", self.music_dir)
+        if root is None or "" in self.unreadable:
+            self.stats = {"time": 0.0, "dirs": 0, "skipped": 0, "files": 0, "unreadable": 1}
+            raise ScanError(f"Katalog z muzyką nie istnieje lub nie można go odczytać: {self.music_dir}")
+        files, subdirs, skipped = list(root[1]), root[2], int(root[3])
+        dirs[""] = root[:3]
+
+        if subdirs:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(subdirs)))) as pool:
+                for sub_files, sub_dirs, sub_skipped in pool.map(self._walk, subdirs):
+                    files.extend(sub_files)
+                    dirs.update(sub_dirs)
+                    skipped += sub_skipped
+
+        self.cache = {"music_dir": self.music_dir, "time": started_at, "dirs": dirs}
+        self.stats = {
+            "time": round(time.perf_counter() - start, 3),
+            "dirs": len(dirs),
+            "skipped": skipped,
+            "files": len(files),
+            "unreadable": len(self.unreadable),
+        }
+        logger.info("Skanowanie: %(files)d plików, %(dirs)d katalogów, "
+                    "pominięto %(skipped)d, nieczytelne %(unreadable)d, czas %(time).3f s", self.stats)
+        return files
+
+    def _walk(self, rel_dir: str):
+        """Przechodzi poddrzewo zaczynające się w rel_dir"""
+        files, dirs, skipped = [], {}, 0
+        stack = [rel_dir]
+        while stack:
+            rel = stack.pop()
+            entry = self._list_dir(rel, os.path.join(self.music_dir, rel))
+            if entry is None:
+                continue
+            dirs[rel] = entry[:3]
+            files.extend(entry[1])
+            stack.extend(entry[2])
+            skipped += entry[3]
+        return files, dirs, skipped
+
+    def _list_dir(self, rel_dir: str, abs_dir: str):
+        """Zwraca (mtime, pliki, podkatalogi, czy_pominięty) dla jednego katalogu
+        lub None, jeśli katalogu nie ma. Katalog, którego nie da się odczytać,
+        zachowuje zawartość z pamięci podręcznej, jego piosenki nie są usuwane"""
+        try:
+            mtime = os.stat(abs_dir).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        except OSError as e:
+            return self._unreadable(rel_dir, abs_dir, e)
+        cached = self._old_dirs.get(rel_dir)
+        # mtime z tej samej chwili co poprzednie skanowanie jest niepewny,
+        # np. FAT na karcie SD zapisuje go z dokładnością do 2 s
+        if cached and cached[0] == mtime and mtime / 1e9 < self._trusted_before:
+            return mtime, cached[1], cached[2], True
+
+        prefix = rel_dir + "/" if rel_dir else ""
+        files, subdirs = [], []
+        try:
+            with os.scandir(abs_dir) as it:
+                for entry in it:
+                    name = entry.name
+                    try:
+                        if entry.is_dir():
+                            # jak os.walk: dowiązań do katalogów nie odwiedzamy
+                            if not entry.is_symlink():
+                                subdirs.append(prefix + name)
+                            continue
+                    except OSError:
+                        continue
+                    dot = name.rfind(".")
+                    if dot > 0 and name[dot:].lower() in self.music_exts:
+                        files.append(prefix + name)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        except OSError as e:
+            return self._unreadable(rel_dir, abs_dir, e)
+        return mtime, files, subdirs, False
+
+    def _unreadable(self, rel_dir: str, abs_dir: str, error: OSError):
+        logger.warning("Nie można odczytać katalogu %s: %s", abs_dir, error)
+        self.unreadable.append(rel_dir)
+        cached = self._old_dirs.get(rel_dir)
+        if cached is None:
+            return None
+        return cached[0], cached[1], cached[2], True
@@ -0,0 +1,237 @@
+"""Zapis biblioteki muzycznej w bazie SQLite"""
+import os
+import json
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS songs (
+    path TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS song_tags (
+    path TEXT NOT NULL REFERENCES songs(path) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    UNIQUE (path, tag)
+);
+CREATE TABLE IF NOT EXISTS scan_dirs (
+    dir TEXT PRIMARY KEY,
+    mtime INTEGER NOT NULL,
+    files TEXT NOT NULL,
+    subdirs TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metadata (
+    path TEXT PRIMARY KEY REFERENCES songs(path) ON DELETE CASCADE,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    title TEXT,
+    artist TEXT,
+    album TEXT,
+    duration REAL
+);
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT PRIMARY KEY REFERENCES songs(path) ON DELETE CASCADE,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    partial TEXT,
+    full TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class LibraryStore:
+    """Biblioteka (piosenki, tagi, stan skanowania) w bazie SQLite w trybie WAL.
+    Każda zmiana zapisuje tylko zmienione wiersze, w jednej transakcji."""
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        with self._lock:
+            self._conn.executescript(_SCHEMA)
+        self._scan_dirs = None
+        """Stan skanowania wczytany z bazy, do porównania przy zapisie"""
+
+    def _transaction(self, statements):
+        """Wykonuje listę (sql, lista_parametrów) w jednej transakcji"""
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN")
+                for sql, params in statements:
+                    self._conn.executemany(sql, params)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get_meta(self, key: str, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_meta(self, key: str, value):
+        self._transaction([("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [(key, value)])])
+
+    def load(self, library=None) -> dict[str, list[str]]:
+        """Wczytuje wszystkie piosenki z tagami
+        Args:
+            library: słownik do wypełnienia (np. CompactLibrary), domyślnie nowy dict
+        Returns:
+            dict[str, list[str]]: ścieżka względna -> lista tagów"""
+        library = {} if library is None else library
+        tags = {}
+        with self._lock:
+            for (path,) in self._conn.execute("SELECT path FROM songs ORDER BY rowid"):
+                library[path] = []
+            for path, tag in self._conn.execute("SELECT path, tag FROM song_tags ORDER BY rowid"):
+                tags.setdefault(path, []).append(tag)
+        # lista tagów tylko dla piosenek, które je mają
+        for path, song_tags in tags.items():
+            library[path] = song_tags
+        return library
+
+    def import_json(self, json_file: str):
+        """Jednorazowo przenosi dane ze starego pliku json do bazy"""
+        if self.get_meta("json_imported"):
+            return
+        if os.path.exists(json_file):
+            try:
+                with open(json_file, "r", encoding="utf-8") as f:
+                    library = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error("Nie udało się odczytać %s: %s", json_file, e)
+                return
+            self._transaction([
+                ("INSERT OR IGNORE INTO songs (path) VALUES (?)", [(path,) for path in library]),
+                ("INSERT OR IGNORE INTO song_tags (path, tag) VALUES (?, ?)",
+                 [(path, tag) for path, tags in library.items() for tag in tags]),
+            ])
+            logger.info("Zaimportowano %d piosenek z %s", len(library), json_file)
+        self.set_meta("json_imported", "1")
+
+    def add_songs(self, paths):
+        self._transaction([("INSERT OR IGNORE INTO songs (path) VALUES (?)", [(path,) for path in paths])])
+
+    def remove_songs(self, paths):
+        self._transaction([("DELETE FROM songs WHERE path = ?", [(path,) for path in paths])])
+
+    def apply_changes(self, removed, added, tags: dict | None = None, metadata=()):
+        """Zapisuje zmiany z obserwowania katalogu w jednej transakcji.
+        Zmiana nazwy to usunięcie starej ścieżki i dodanie nowej z jej tagami i metadanymi.
+        Args:
+            removed: usunięte ścieżki
+            added: nowe ścieżki
+            tags (dict): ścieżka -> tagi do zapisania dla nowych ścieżek
+            metadata: lista (ścieżka, rozmiar, mtime, metadane) dla nowych ścieżek"""
+        tags = tags or {}
+        self._transaction([
+            ("DELETE FROM songs WHERE path = ?", [(path,) for path in removed]),
+            ("INSERT OR IGNORE INTO songs (path) VALUES (?)", [(path,) for path in added]),
+            ("INSERT OR IGNORE INTO song_tags (path, tag) VALUES (?, ?)",
+             [(path, tag) for path, song_tags in tags.items() for tag in song_tags]),
+            ("INSERT OR REPLACE INTO metadata (path, size, mtime, title, artist, album, duration) "
+             "VALUES (?, ?, ?, ?, ?, ?, ?)",
+             [(path, size, mtime, meta["title"], meta["artist"], meta["album"], meta["duration"])
+              for path, size, mtime, meta in metadata]),
+        ])
+
+    def add_tag(self, path: str, tag: str):
+        self._transaction([
+            ("INSERT OR IGNORE INTO songs (path) VALUES (?)", [(path,)]),
+            ("INSERT OR IGNORE INTO song_tags (path, tag) VALUES (?, ?)", [(path, tag)]),
+        ])
+
+    def remove_tag(self, path: str, tag: str):
+        self._transaction([("DELETE FROM song_tags WHERE path = ? AND tag = ?", [(path, tag)])])
+
+    def apply_tags(self, added, removed):
+        """Zapisuje paczkę zmian tagów w jednej transakcji. Tagi piosenek,
+        których już nie ma w bazie (usunięte w międzyczasie), są pomijane
+        Args:
+            added: lista (ścieżka, tag) do dodania
+            removed: lista (ścieżka, tag) do usunięcia"""
+        self._transaction([
+            ("DELETE FROM song_tags WHERE path = ? AND tag = ?", list(removed)),
+            ("INSERT OR IGNORE INTO song_tags (path, tag) SELECT ?, ? WHERE EXISTS "
+             "(SELECT 1 FROM songs WHERE path = ?)", [(path, tag, path) for path, tag in added]),
+        ])
+
+    def load_metadata(self) -> dict[str, tuple]:
+        """Wczytuje metadane zapisane w bazie
+        Returns:
+            dict[str, tuple]: ścieżka -> (rozmiar, mtime, metadane)"""
+        with self._lock:
+            rows = self._conn.execute("SELECT path, size, mtime, title, artist, album, duration FROM metadata").fetchall()
+        return {
+            path: (size, mtime, {"title": title, "artist": artist, "album": album, "duration": duration})
+            for path, size, mtime, title, artist, album, duration in rows
+        }
+
+    def save_metadata(self, results):
+        """Zapisuje metadane, results: lista (ścieżka, rozmiar, mtime, metadane)"""
+        self._transaction([
+            ("INSERT OR IGNORE INTO songs (path) VALUES (?)", [(r[0],) for r in results]),
+            ("INSERT OR REPLACE INTO metadata (path, size, mtime, title, artist, album, duration) "
+             "VALUES (?, ?, ?, ?, ?, ?, ?)",
+             [(path, size, mtime, meta["title"], meta["artist"], meta["album"], meta["duration"])
+              for path, size, mtime, meta in results]),
+        ])
+
+    def load_hashes(self) -> dict[str, tuple]:
+        """Hashe zawartości policzone przez DuplicateFinder
+        Returns:
+            dict[str, tuple]: ścieżka -> (rozmiar, mtime, hash początku i końca, hash całości)"""
+        with self._lock:
+            rows = self._conn.execute("SELECT path, size, mtime, partial, full FROM hashes").fetchall()
+        return {path: (size, mtime, partial, full) for path, size, mtime, partial, full in rows}
+
+    def save_hashes(self, rows):
+        """Zapisuje hashe, rows: lista (ścieżka, rozmiar, mtime, hash początku i końca, hash całości)"""
+        self._transaction([
+            ("INSERT OR IGNORE INTO songs (path) VALUES (?)", [(r[0],) for r in rows]),
+            ("INSERT OR REPLACE INTO hashes (path, size, mtime, partial, full) VALUES (?, ?, ?, ?, ?)",
+             [tuple(r) for r in rows]),
+        ])
+
+    def load_scan_cache(self) -> dict:
+        """Stan poprzedniego skanowania w formacie LibraryScanner.cache"""
+        with self._lock:
+            dirs = {
+                d: (mtime, json.loads(files), json.loads(subdirs))
+                for d, mtime, files, subdirs in self._conn.execute(
+                    "SELECT dir, mtime, files, subdirs FROM scan_dirs")
+            }
+        self._scan_dirs = dirs
+        return {
+            "music_dir": self.get_meta("scan_music_dir"),
+            "time": float(self.get_meta("scan_time", 0)),
+            "dirs": dirs,
+        }
+
+    def save_scan_cache(self, cache: dict):
+        """Zapisuje stan skanowania, tylko katalogi które się zmieniły"""
+        old = self._scan_dirs if self._scan_dirs is not None else self.load_scan_cache()["dirs"]
+        new = cache.get("dirs", {})
+        changed = [(d, entry[0], json.dumps(entry[1], ensure_ascii=False), json.dumps(entry[2], ensure_ascii=False))
+                   for d, entry in new.items() if old.get(d) != tuple(entry)]
+        removed = [(d,) for d in old if d not in new]
+        self._transaction([
+            ("INSERT OR REPLACE INTO scan_dirs (dir, mtime, files, subdirs) VALUES (?, ?, ?, ?)", changed),
+            ("DELETE FROM scan_dirs WHERE dir = ?", removed),
+            ("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+             [("scan_music_dir", cache.get("music_dir")), ("scan_time", str(cache.get("time", 0)))]),
+        ])
+        self._scan_dirs = {d: tuple(entry) for d, entry in new.items()}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,305 @@
+"""Obserwowanie katalogu z muzyką przez inotify (Linux), bez ponownego skanowania całego drzewa"""
+import os
+import time
+import errno
+import ctypes
+import ctypes.util
+import select
+import struct
+import logging
+import threading
+
+from scripts.settings import watch
+
+logger = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+
+_EVENT = struct.Struct("iIII")
+"""Nagłówek struct inotify_event: wd, mask, cookie, len"""
+
+
+class LibraryWatcher:
+    """Wątek obserwujący rekurencyjnie katalog z muzyką.
+
+    Zdarzenia są zamieniane na operacje na ścieżkach względnych (z separatorem "/"):
+    ("add", ścieżka), ("remove", ścieżka) i ("move", stara, nowa). Usunięcie
+    i przeniesienie dotyczy też całych katalogów. Operacje są zbierane, aż
+    przez watch.coalesce sekund nic się nie zmieni (najdłużej watch.max_delay),
+    i oddawane jedną paczką przez on_changes, w kolejności wystąpienia.
+
+    Gdy inotify jest niedostępne albo skończy się limit obserwowanych katalogów
+    (fs.inotify.max_user_watches), co watch.poll_interval sekund jest wywoływane
+    on_rescan, czyli przyrostowe skanowanie. Tak samo po przepełnieniu kolejki
+    zdarzeń jądra."""
+
+    def __init__(self, music_dir: str, music_exts, on_changes, on_rescan):
+        """
+        Args:
+            music_dir (str): katalog z muzyką
+            music_exts: rozszerzenia plików audio
+            on_changes: funkcja wywoływana z listą operacji
+            on_rescan: funkcja wywoływana, gdy trzeba przeskanować cały katalog"""
+        self.music_dir = music_dir
+        self.music_exts = {ext.lower() for ext in music_exts}
+        self.on_changes = on_changes
+        self.on_rescan = on_rescan
+        self.mode = None
+        """"inotify", "poll" albo None przed uruchomieniem"""
+        self._fd = None
+        self._libc = None
+        self._wd_paths: dict[int, str] = {}
+        self._path_wds: dict[str, int] = {}
+        self._ops = []
+        self._added = set()
+        """Ścieżki z operacją add w bieżącej paczce, żeby nie powtarzać CREATE + CLOSE_WRITE"""
+        self._moved_from: dict[int, tuple[str, bool]] = {}
+        """cookie -> (ścieżka, czy_katalog) dla IN_MOVED_FROM czekających na IN_MOVED_TO"""
+        self._rescan = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        try:
+            self._init_inotify()
+            self._add_tree("")
+        except OSError as e:
+            self._close()
+            logger.warning("inotify niedostępne (%s), skanowanie co %s s", e, watch.poll_interval)
+            self._poll_loop()
+            return
+        self.mode = "inotify"
+        logger.info("Obserwowanie %d katalogów przez inotify", len(self._wd_paths))
+        try:
+            self._inotify_loop()
+        except OSError as e:
+            # np. nowe katalogi przekroczyły limit obserwacji
+            self._close()
+            logger.warning("Koniec obserwowania przez inotify (%s), skanowanie co %s s", e, watch.poll_interval)
+            self.on_rescan()
+            self._poll_loop()
+        finally:
+            self._close()
+
+    def _poll_loop(self):
+        self.mode = "poll"
+        while not self._stop.wait(watch.poll_interval):
+            try:
+                self.on_rescan()
+            except Exception as e:
+                logger.error("Błąd skanowania katalogu z muzyką: %s", e)
+
+    def _init_inotify(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "brak inotify_init1")
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._libc = libc
+        self._fd = fd
+
+    def _close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._wd_paths.clear()
+        self._path_wds.clear()
+
+    def _add_watch(self, rel_dir: str) -> bool:
+        """Dodaje obserwację katalogu
+        Returns:
+            bool: False, jeśli katalogu już nie ma lub nie można go odczytać
+        Raises:
+            OSError: ENOSPC po przekroczeniu limitu obserwacji"""
+        path = os.path.join(self.music_dir, rel_dir) if rel_dir else self.music_dir
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOSPC, errno.ENOMEM):
+                raise OSError(err, os.strerror(err))
+            logger.debug("Nie można obserwować %s: %s", path, os.strerror(err))
+            return False
+        self._wd_paths[wd] = rel_dir
+        self._path_wds[rel_dir] = wd
+        return True
+
+    def _add_tree(self, rel_dir: str) -> list[str]:
+        """Obserwuje katalog razem z podkatalogami
+        Returns:
+            list[str]: pliki audio, które już są w tym drzewie"""
+        files = []
+        stack = [rel_dir]
+        while stack:
+            rel = stack.pop()
+            # obserwacja przed listowaniem, żeby nie zgubić plików dodanych w międzyczasie
+            if not self._add_watch(rel):
+                continue
+            prefix = rel + "/" if rel else ""
+            try:
+                with os.scandir(os.path.join(self.music_dir, rel)) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir():
+                                if not entry.is_symlink():
+                                    stack.append(prefix + entry.name)
+                                continue
+                        except OSError:
+                            continue
+                        if self._is_audio(entry.name):
+                            files.append(prefix + entry.name)
+            except OSError:
+                continue
+        return files
+
+    def _forget_tree(self, rel_dir: str, remove_watches: bool):
+        """Zapomina obserwacje katalogu i podkatalogów"""
+        prefix = rel_dir + "/"
+        for rel in [r for r in self._path_wds if r == rel_dir or r.startswith(prefix)]:
+            wd = self._path_wds.pop(rel)
+            self._wd_paths.pop(wd, None)
+            if remove_watches:
+                self._libc.inotify_rm_watch(self._fd, wd)
+
+    def _rename_tree(self, old: str, new: str):
+        """Przenosi ścieżki obserwacji po przeniesieniu katalogu, deskryptory zostają te same"""
+        prefix = old + "/"
+        for rel in [r for r in self._path_wds if r == old or r.startswith(prefix)]:
+            wd = self._path_wds.pop(rel)
+            moved = new + rel[len(old):]
+            self._path_wds[moved] = wd
+            self._wd_paths[wd] = moved
+
+    def _is_audio(self, name: str) -> bool:
+        dot = name.rfind(".")
+        return dot > 0 and name[dot:].lower() in self.music_exts
+
+    def _inotify_loop(self):
+        first = last = None
+        while not self._stop.is_set():
+            if first is None:
+                timeout = 1.0
+            else:
+                now = time.monotonic()
+                timeout = max(0.0, min(last + watch.coalesce, first + watch.max_delay) - now)
+            ready, _, _ = select.select([self._fd], [], [], timeout)
+            if ready:
+                try:
+                    data = os.read(self._fd, 65536)
+                except BlockingIOError:
+                    continue
+                self._read_events(data)
+                last = time.monotonic()
+                if first is None:
+                    first = last
+            now = time.monotonic()
+            if first is not None and (now >= last + watch.coalesce or now >= first + watch.max_delay):
+                self._flush()
+                first = last = None
+
+    def _read_events(self, data: bytes):
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            self._handle(wd, mask, cookie, name)
+
+    def _handle(self, wd: int, mask: int, cookie: int, name: str):
+        """Zamienia jedno zdarzenie inotify na operacje"""
+        if mask & IN_Q_OVERFLOW:
+            self._rescan = True
+            return
+        if mask & IN_IGNORED:
+            rel = self._wd_paths.pop(wd, None)
+            if rel is not None and self._path_wds.get(rel) == wd:
+                del self._path_wds[rel]
+            return
+        parent = self._wd_paths.get(wd)
+        if parent is None or mask & IN_DELETE_SELF:
+            return
+        rel = parent + "/" + name if parent else name
+        is_dir = bool(mask & IN_ISDIR)
+
+        if mask & IN_MOVED_FROM:
+            self._moved_from[cookie] = (rel, is_dir)
+        elif mask & IN_MOVED_TO:
+            source = self._moved_from.pop(cookie, None)
+            if source is not None and is_dir:
+                self._rename_tree(source[0], rel)
+                self._op("move", source[0], rel)
+            elif source is not None and self._is_audio(rel):
+                self._op("move", source[0], rel)
+            else:
+                if source is not None:
+                    # np. zmiana rozszerzenia na inne niż audio
+                    self._op("remove", source[0])
+                self._created(rel, is_dir)
+        elif mask & (IN_CREATE | IN_CLOSE_WRITE):
+            self._created(rel, is_dir)
+        elif mask & IN_DELETE:
+            if is_dir:
+                self._forget_tree(rel, remove_watches=False)
+            if is_dir or self._is_audio(rel):
+                self._op("remove", rel)
+
+    def _created(self, rel: str, is_dir: bool):
+        if is_dir:
+            for song in self._add_tree(rel):
+                self._op("add", song)
+        elif self._is_audio(rel):
+            self._op("add", rel)
+
+    def _op(self, *op):
+        if op[0] == "add":
+            if op[1] in self._added:
+                return
+            self._added.add(op[1])
+        else:
+            self._added.discard(op[1])
+        self._ops.append(op)
+
+    def _flush(self):
+        # przeniesione poza katalog z muzyką (brak IN_MOVED_TO) są usunięte
+        for rel, is_dir in self._moved_from.values():
+            if is_dir:
+                self._forget_tree(rel, remove_watches=True)
+            self._op("remove", rel)
+        self._moved_from.clear()
+        ops, self._ops, rescan, self._rescan = self._ops, [], self._rescan, False
+        self._added.clear()
+        if rescan:
+            logger.warning("Przepełniona kolejka inotify, skanowanie całego katalogu")
+            # ponowne dodanie obserwacji obejmuje katalogi, których zdarzenia przepadły
+            self._add_tree("")
+        try:
+            if rescan:
+                self.on_rescan()
+            elif ops:
+                self.on_changes(ops)
+        except Exception as e:
+            logger.error("Błąd aktualizacji biblioteki: %s", e)
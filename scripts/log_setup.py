@@ -0,0 +1,80 @@
+"""Logowanie przez kolejkę: wątki serwera i mpv tylko dodają rekord, zapisuje osobny wątek"""
+import sys
+import time
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from scripts.settings import log
+
+FORMAT = "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
+
+
+class RateLimitFilter(logging.Filter):
+    """Ogranicza komunikaty z tego samego miejsca w kodzie do rate na sekundę
+    (kubełek żetonów o pojemności burst). Ostrzeżenia i błędy przechodzą zawsze.
+    Pierwszy przepuszczony komunikat po przerwie podaje, ile pominięto."""
+
+    def __init__(self, rate: float = log.rate, burst: int = log.burst):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets: dict[tuple, list] = {}
+        """(plik, linia) -> [żetony, czas ostatniego uzupełnienia, pominięte]"""
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            skipped, bucket[2] = bucket[2], 0
+        if skipped:
+            record.msg = f"{record.msg} (pominięto {skipped} podobnych)"
+        return True
+
+
+def setup_logging(file: str | None = log.file, console: bool = log.console) -> QueueListener:
+    """Konfiguruje logger główny: QueueHandler z ograniczeniem częstotliwości,
+    zapis do pliku z rotacją i na konsolę w wątku QueueListener
+    Returns:
+        QueueListener: zatrzymywany automatycznie przy wyjściu z programu"""
+    formatter = logging.Formatter(FORMAT)
+    handlers = []
+    if file:
+        file_handler = RotatingFileHandler(file, maxBytes=log.max_bytes, backupCount=log.backups,
+                                           encoding="utf-8")
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+    if console:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(logging.Formatter("%(levelname)s - %(name)s - %(message)s"))
+        handlers.append(console_handler)
+
+    records = queue.SimpleQueue()
+    queue_handler = QueueHandler(records)
+    queue_handler.addFilter(RateLimitFilter())
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(log.level)
+    for name, level in log.levels.items():
+        logging.getLogger(name).setLevel(level)
+
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
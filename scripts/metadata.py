@@ -0,0 +1,362 @@
+"""Odczyt metadanych (tytuł, wykonawca, album, długość) z nagłówków plików audio.
+
+Czytane są tylko bajty potrzebne do nagłówków: ramki ID3v2 inne niż tekstowe,
+okładki FLAC i atomy MP4 z tablicami próbek są przeskakiwane przez seek.
+Funkcje są wywoływane w osobnych procesach (MetadataExtractor), więc nie
+korzystają ze stanu MusicLibrary.
+"""
+import os
+import struct
+
+MAX_BLOCK = 256 * 1024
+"""Największy blok nagłówka czytany w całości"""
+
+_ID3_FRAMES = {
+    b"TIT2": "title", b"TPE1": "artist", b"TALB": "album", b"TLEN": "length",
+    b"TT2": "title", b"TP1": "artist", b"TAL": "album", b"TLE": "length",
+}
+_VORBIS_FIELDS = {"TITLE": "title", "ARTIST": "artist", "ALBUM": "album"}
+_MP4_ATOMS = {b"\xa9nam": "title", b"\xa9ART": "artist", b"\xa9alb": "album"}
+
+# Tabele nagłówka ramki MPEG audio
+_MPEG_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MPEG_BITRATES[(2, 3)] = _MPEG_BITRATES[(2, 2)]
+_MPEG_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+def read_metadata(path: str) -> dict:
+    """Zwraca metadane pliku audio
+    Args:
+        path (str): pełna ścieżka do pliku
+    Returns:
+        dict: klucze "title", "artist", "album", "duration" (sekundy), brakujące mają None"""
+    meta = {"title": None, "artist": None, "album": None, "duration": None}
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        head = f.read(12)
+        f.seek(0)
+        if head.startswith(b"ID3") or _is_mpeg_frame(head):
+            _read_mp3(f, size, meta)
+        elif head.startswith(b"fLaC"):
+            _read_flac(f, meta)
+        elif head.startswith(b"OggS"):
+            _read_ogg(f, size, meta)
+        elif head[4:8] == b"ftyp":
+            _read_mp4(f, size, meta)
+        elif head.startswith(b"RIFF") and head[8:12] == b"WAVE":
+            _read_wav(f, size, meta)
+    if meta["duration"] is not None:
+        meta["duration"] = round(meta["duration"], 3)
+    return meta
+
+
+def _text(value):
+    value = value.strip("\x00 \t\r\n")
+    return value or None
+
+
+# ---------- MP3: ID3v2, ID3v1, ramka MPEG (Xing/Info lub CBR) ----------
+
+def _syncsafe(data: bytes) -> int:
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _id3_text(data: bytes):
+    if not data:
+        return None
+    encoding, body = data[0], data[1:]
+    codec = {0: "latin-1", 1: "utf-16", 2: "utf-16-be", 3: "utf-8"}.get(encoding, "latin-1")
+    try:
+        text = body.decode(codec, "replace")
+    except LookupError:
+        return None
+    # kilka wartości jest rozdzielonych znakiem \x00, bierzemy pierwszą
+    return _text(text.split("\x00")[0])
+
+
+def _read_mp3(f, size, meta):
+    audio_start = 0
+    header = f.read(10)
+    if header.startswith(b"ID3") and len(header) == 10:
+        version, flags = header[3], header[5]
+        tag_size = _syncsafe(header[6:10])
+        audio_start = 10 + tag_size + (10 if flags & 0x10 else 0)
+        _read_id3v2_frames(f, version, tag_size, flags, meta)
+    if not (meta["title"] and meta["artist"]) and size >= 128:
+        f.seek(size - 128)
+        v1 = f.read(128)
+        if v1.startswith(b"TAG"):
+            for key, start in (("title", 3), ("artist", 33), ("album", 63)):
+                if not meta[key]:
+                    meta[key] = _text(v1[start:start + 30].decode("latin-1"))
+    length = meta.pop("length", None)
+    if length:
+        try:
+            meta["duration"] = int(length) / 1000
+            return
+        except ValueError:
+            pass
+    meta["duration"] = _mpeg_duration(f, audio_start, size)
+
+
+def _read_id3v2_frames(f, version, tag_size, flags, meta):
+    pos = 10
+    end = 10 + tag_size
+    if flags & 0x40 and version >= 3:
+        # rozszerzony nagłówek
+        ext = f.read(4)
+        ext_size = _syncsafe(ext) if version == 4 else struct.unpack(">I", ext)[0] + 4
+        pos += ext_size
+        f.seek(pos)
+    header_size = 6 if version == 2 else 10
+    wanted = {k: v for k, v in _ID3_FRAMES.items() if len(k) == (3 if version == 2 else 4)}
+    while pos + header_size <= end:
+        frame = f.read(header_size)
+        if len(frame) < header_size or frame[0] == 0:
+            break
+        if version == 2:
+            frame_id, frame_size = frame[:3], int.from_bytes(frame[3:6], "big")
+        else:
+            frame_id = frame[:4]
+            frame_size = _syncsafe(frame[4:8]) if version == 4 else struct.unpack(">I", frame[4:8])[0]
+        pos += header_size
+        key = wanted.get(frame_id)
+        if key and frame_size <= MAX_BLOCK and not meta.get(key):
+            meta[key] = _id3_text(f.read(frame_size))
+        else:
+            f.seek(frame_size, os.SEEK_CUR)
+        pos += frame_size
+
+
+def _is_mpeg_frame(data: bytes) -> bool:
+    return len(data) >= 4 and data[0] == 0xFF and (data[1] & 0xE0) == 0xE0 and (data[1] >> 1) & 3 != 0
+
+
+def _mpeg_duration(f, audio_start, size):
+    """Długość z nagłówka Xing/Info/VBRI albo z bitrate pierwszej ramki (CBR)"""
+    f.seek(audio_start)
+    data = f.read(64 * 1024)
+    i = data.find(b"\xff")
+    while 0 <= i <= len(data) - 4:
+        if _is_mpeg_frame(data[i:i + 4]):
+            b1, b2, b3 = data[i + 1], data[i + 2], data[i + 3]
+            version_bits = (b1 >> 3) & 3
+            layer = 4 - ((b1 >> 1) & 3)
+            bitrate_index, rate_index = b2 >> 4, (b2 >> 2) & 3
+            if version_bits != 1 and 0 < bitrate_index < 15 and rate_index < 3:
+                version = 1 if version_bits == 3 else 2
+                bitrate = _MPEG_BITRATES[(version, layer)][bitrate_index] * 1000
+                sample_rate = _MPEG_RATES[version_bits][rate_index]
+                if layer == 1:
+                    samples = 384
+                elif layer == 3 and version == 2:
+                    samples = 576
+                else:
+                    samples = 1152
+                mono = (b3 >> 6) == 3
+                if version == 1:
+                    side = 17 if mono else 32
+                else:
+                    side = 9 if mono else 17
+                frame = data[i:i + 4 + side + 120]
+                for marker, offset in ((b"Xing", 4 + side), (b"Info", 4 + side)):
+                    if frame[offset:offset + 4] == marker:
+                        xing_flags = struct.unpack(">I", frame[offset + 4:offset + 8])[0]
+                        if xing_flags & 1:
+                            frames = struct.unpack(">I", frame[offset + 8:offset + 12])[0]
+                            return frames * samples / sample_rate
+                if frame[36:40] == b"VBRI":
+                    frames = struct.unpack(">I", frame[50:54])[0]
+                    return frames * samples / sample_rate
+                return (size - audio_start - i) * 8 / bitrate
+        i = data.find(b"\xff", i + 1)
+    return None
+
+
+# ---------- FLAC ----------
+
+def _vorbis_comments(data: bytes, meta):
+    """Komentarze Vorbis (FLAC, Ogg): długość vendor, vendor, liczba, "KLUCZ=wartość" """
+    try:
+        pos = 4 + struct.unpack("<I", data[:4])[0]
+        count = struct.unpack("<I", data[pos:pos + 4])[0]
+        pos += 4
+        for _ in range(count):
+            length = struct.unpack("<I", data[pos:pos + 4])[0]
+            pos += 4
+            key, _, value = data[pos:pos + length].decode("utf-8", "replace").partition("=")
+            pos += length
+            field = _VORBIS_FIELDS.get(key.upper())
+            if field and not meta[field]:
+                meta[field] = _text(value)
+    except struct.error:
+        pass  # komentarz ucięty na MAX_BLOCK, zostaje to, co zdążyliśmy odczytać
+
+
+def _read_flac(f, meta):
+    f.seek(4)
+    last = False
+    while not last:
+        header = f.read(4)
+        if len(header) < 4:
+            break
+        last = bool(header[0] & 0x80)
+        block_type = header[0] & 0x7F
+        length = int.from_bytes(header[1:4], "big")
+        if block_type == 0:  # STREAMINFO
+            info = f.read(length)
+            sample_rate = (info[10] << 12) | (info[11] << 4) | (info[12] >> 4)
+            total = ((info[13] & 0x0F) << 32) | struct.unpack(">I", info[14:18])[0]
+            if sample_rate:
+                meta["duration"] = total / sample_rate
+        elif block_type == 4:  # VORBIS_COMMENT
+            _vorbis_comments(f.read(min(length, MAX_BLOCK)), meta)
+            f.seek(max(0, length - MAX_BLOCK), os.SEEK_CUR)
+        else:
+            f.seek(length, os.SEEK_CUR)
+
+
+# ---------- Ogg Vorbis / Opus ----------
+
+def _ogg_packets(f, limit):
+    """Składa pierwsze pakiety strumienia Ogg, czyta co najwyżej limit bajtów"""
+    packet = b""
+    read = 0
+    while read < limit:
+        header = f.read(27)
+        if len(header) < 27 or not header.startswith(b"OggS"):
+            break
+        segments = f.read(header[26])
+        body = f.read(sum(segments))
+        read += 27 + len(segments) + len(body)
+        pos = 0
+        for lacing in segments:
+            packet += body[pos:pos + lacing]
+            pos += lacing
+            if lacing < 255:
+                yield packet
+                packet = b""
+    if packet:
+        yield packet
+
+
+def _read_ogg(f, size, meta):
+    sample_rate, pre_skip = None, 0
+    for i, packet in enumerate(_ogg_packets(f, MAX_BLOCK)):
+        if packet.startswith(b"\x01vorbis"):
+            sample_rate = struct.unpack("<I", packet[12:16])[0]
+        elif packet.startswith(b"OpusHead"):
+            sample_rate = 48000
+            pre_skip = struct.unpack("<H", packet[10:12])[0]
+        elif packet.startswith(b"\x03vorbis"):
+            _vorbis_comments(packet[7:], meta)
+        elif packet.startswith(b"OpusTags"):
+            _vorbis_comments(packet[8:], meta)
+        if i >= 1:
+            break
+    if not sample_rate:
+        return
+    # pozycja granule ostatniej strony to liczba próbek całego pliku
+    f.seek(max(0, size - 64 * 1024))
+    tail = f.read()
+    last = tail.rfind(b"OggS")
+    if last >= 0 and len(tail) >= last + 14:
+        granule = struct.unpack("<q", tail[last + 6:last + 14])[0]
+        if granule > 0:
+            meta["duration"] = (granule - pre_skip) / sample_rate
+
+
+# ---------- MP4 / M4A ----------
+
+def _mp4_atoms(f, start, end):
+    """Przechodzi po atomach w zakresie [start, end), zwraca (typ, początek danych, koniec)"""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        atom_size, atom_type = struct.unpack(">I", header[:4])[0], header[4:8]
+        data_start = pos + 8
+        if atom_size == 1:
+            atom_size = struct.unpack(">Q", f.read(8))[0]
+            data_start += 8
+        elif atom_size == 0:
+            atom_size = end - pos
+        if atom_size < 8:
+            return
+        yield atom_type, data_start, pos + atom_size
+        pos += atom_size
+
+
+def _read_mp4(f, size, meta):
+    for atom_type, start, end in _mp4_atoms(f, 0, size):
+        if atom_type != b"moov":
+            continue
+        for child, c_start, c_end in _mp4_atoms(f, start, end):
+            if child == b"mvhd":
+                f.seek(c_start)
+                data = f.read(32)
+                if data[0] == 1:
+                    timescale, duration = struct.unpack(">IQ", data[20:32])
+                else:
+                    timescale, duration = struct.unpack(">II", data[12:20])
+                if timescale:
+                    meta["duration"] = duration / timescale
+            elif child == b"udta":
+                _read_mp4_udta(f, c_start, c_end, meta)
+        return
+
+
+def _read_mp4_udta(f, start, end, meta):
+    for atom_type, m_start, m_end in _mp4_atoms(f, start, end):
+        if atom_type != b"meta":
+            continue
+        # meta ma 4 bajty wersji i flag przed atomami potomnymi
+        for child, i_start, i_end in _mp4_atoms(f, m_start + 4, m_end):
+            if child != b"ilst":
+                continue
+            for item, d_start, d_end in _mp4_atoms(f, i_start, i_end):
+                key = _MP4_ATOMS.get(item)
+                if not key:
+                    continue
+                for data_type, v_start, v_end in _mp4_atoms(f, d_start, d_end):
+                    if data_type == b"data" and v_end - v_start <= MAX_BLOCK:
+                        f.seek(v_start + 8)  # typ i locale
+                        meta[key] = _text(f.read(v_end - v_start - 8).decode("utf-8", "replace"))
+                        break
+
+
+# ---------- WAV ----------
+
+def _read_wav(f, size, meta):
+    f.seek(12)
+    byte_rate = None
+    pos = 12
+    while pos + 8 <= size:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        chunk_id, chunk_size = header[:4], struct.unpack("<I", header[4:])[0]
+        if chunk_id == b"fmt ":
+            byte_rate = struct.unpack("<I", f.read(12)[8:12])[0]
+        elif chunk_id == b"data" and byte_rate:
+            meta["duration"] = chunk_size / byte_rate
+        elif chunk_id == b"LIST" and chunk_size <= MAX_BLOCK:
+            data = f.read(chunk_size)
+            if data.startswith(b"INFO"):
+                i = 4
+                while i + 8 <= len(data):
+                    sub_id, sub_size = data[i:i + 4], struct.unpack("<I", data[i + 4:i + 8])[0]
+                    field = {b"INAM": "title", b"IART": "artist", b"IPRD": "album"}.get(sub_id)
+                    if field:
+                        meta[field] = _text(data[i + 8:i + 8 + sub_size].decode("utf-8", "replace"))
+                    i += 8 + sub_size + (sub_size & 1)
+        pos += 8 + chunk_size + (chunk_size & 1)
@@ -0,0 +1,101 @@
+"""Odczyt metadanych w tle, w puli procesów, z pamięcią podręczną po (rozmiar, mtime)"""
+import os
+import time
+import logging
+import threading
+import functools
+
+from scripts.settings import metadata as settings
+from scripts.metadata import read_metadata
+from scripts.worker_pool import run_batches
+
+logger = logging.getLogger(__name__)
+
+EMPTY_METADATA = {"title": None, "artist": None, "album": None, "duration": None}
+
+
+def _extract_batch(music_dir, batch):
+    """Odczytuje metadane paczki plików, wywoływane w procesie roboczym
+    Args:
+        music_dir (str): katalog z muzyką
+        batch (list): (ścieżka względna, rozmiar, mtime)
+    Returns:
+        list: (ścieżka względna, rozmiar, mtime, metadane)"""
+    results = []
+    for rel_path, size, mtime in batch:
+        try:
+            meta = read_metadata(os.path.join(music_dir, rel_path))
+        except Exception:
+            # uszkodzony plik też trafia do pamięci podręcznej, żeby nie czytać go ponownie
+            meta = dict(EMPTY_METADATA)
+        results.append((rel_path, size, mtime, meta))
+    return results
+
+
+class MetadataExtractor:
+    """Wątek w tle, który sprawdza (rozmiar, mtime) plików i tylko dla nowych
+    lub zmienionych odczytuje metadane w puli procesów. Wyniki oddaje paczkami
+    przez on_batch."""
+
+    def __init__(self, music_dir: str, cache: dict, on_batch, workers: int = settings.workers):
+        """
+        Args:
+            music_dir (str): katalog z muzyką
+            cache (dict): ścieżka względna -> (rozmiar, mtime) już odczytanych plików
+            on_batch: funkcja wywoływana z listą (ścieżka, rozmiar, mtime, metadane)"""
+        self.music_dir = music_dir
+        self.cache = cache
+        self.on_batch = on_batch
+        self.workers = workers
+        self.stats = {"total": 0, "todo": 0, "done": 0, "time": 0.0}
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, songs):
+        """Uruchamia odczyt w tle
+        Args:
+            songs (list[str]): ścieżki względne plików do sprawdzenia"""
+        self._thread = threading.Thread(target=self._run, args=(list(songs),), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self, songs):
+        start = time.perf_counter()
+        self.stats["total"] = len(songs)
+        todo = []
+        for rel_path in songs:
+            if self._stop.is_set():
+                return
+            try:
+                st = os.stat(os.path.join(self.music_dir, rel_path))
+            except OSError:
+                continue
+            key = (st.st_size, st.st_mtime_ns)
+            if self.cache.get(rel_path) != key:
+                todo.append((rel_path,) + key)
+        self.stats["todo"] = len(todo)
+        if todo:
+            try:
+                self._extract(todo)
+            except Exception as e:
+                logger.error("Błąd odczytu metadanych: %s", e)
+        self.stats["time"] = round(time.perf_counter() - start, 3)
+        logger.info("Metadane: %(done)d/%(todo)d odczytanych, %(total)d plików, %(time).3f s", self.stats)
+
+    def _extract(self, todo):
+        run_batches(functools.partial(_extract_batch, self.music_dir), todo, self._collect, settings,
+                    self.workers, self._stop, "metadane")
+
+    def _collect(self, results):
+        self.stats["done"] += len(results)
+        self.on_batch(results)
@@ -2,144 +2,823 @@
 
 import os
 import json
-import random
+import atexit
+import logging
+import tempfile
+import time
+import threading
+from collections import deque
 
-from scripts.settings import paths, Player
+from scripts.settings import paths, Player, tag_edit
+from scripts.library_scanner import LibraryScanner, ScanError
+from scripts.library_store import LibraryStore
+from scripts.metadata_extractor import MetadataExtractor
+from scripts.duplicate_finder import DuplicateFinder
+from scripts.tag_writer import TagWriter
+from scripts.lazy_shuffle import LazyShuffle
+from scripts.search_index import SearchIndex
+from scripts.compact_library import CompactLibrary, SongList
+from scripts import tag_query
+from scripts import metrics
+
+logger = logging.getLogger(__name__)
+
+REBUILD_SECONDS = metrics.histogram("library_rebuild_seconds", "Czas przebudowy albumu w do_library")
+SCAN_SECONDS = metrics.histogram("library_scan_seconds", "Czas skanowania katalogu z muzyką",
+                                 buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0))
 
 class MusicLibrary():
     """Zarządza biblioteką muzyczną"""
     tags = [] 
     """Tagi piosenek które będą w biblitece, brak oznacza, że wszystkie będą dodane"""
-    full_library: dict[str, list[str]] = {}
-    """dict[str, list[str]], zawiera wszystkie dostępne piosenki i ich aktualne dane"""
+    tag_query = ""
+    """Zapytanie o tagi (AND/OR/NOT), jeśli jest ustawione to zastępuje tags"""
+    search_index = SearchIndex()
+    """Wyszukiwanie po początkach słów ze ścieżki i metadanych"""
+    full_library = CompactLibrary()
+    """ścieżka -> lista tagów, wszystkie dostępne piosenki. Indeks tag -> piosenki to full_library.tag_index"""
     library = []
-    """Zawiera listę piosenek z albumu"""
+    """Piosenki z albumu, SongList (numery piosenek z full_library) po do_library"""
+    library_version = 0
+    """Wersja albumu, rośnie przy każdej zmianie library (unikalna też między uruchomieniami)"""
+    _positions = {}
+    """Pozycja każdej piosenki w library (widok SongList.positions), aktualizowana przy każdej zmianie library"""
     music_dir = paths.music_location
     music_exts = {".mp3", ".wav", ".flac", ".ogg", ".m4a", ".aac", ".wma"}
     info_file = "info_music.json"
+    """Eksport biblioteki do json, stary plik jest jednorazowo importowany do bazy"""
+    db_file = "music_library.db"
+    """Baza SQLite z piosenkami, tagami i stanem skanowania"""
+    _store = None
+    _tag_writer = None
+    """Zapis zmian tagów do bazy w tle (TagWriter), związany z aktualną bazą"""
+    metadata: dict[str, dict] = {}
+    """Metadane piosenek: ścieżka -> {"title", "artist", "album", "duration"}"""
+    _metadata_keys: dict[str, tuple] = {}
+    """(rozmiar, mtime) pliku, z którego odczytano metadane"""
+    metadata_version = 0
+    """Rośnie przy każdej zmianie metadata (odczyt w tle nie zmienia wersji albumu)"""
+    _metadata_lock = threading.Lock()
+    _scan_lock = threading.Lock()
+    _pending_scans = set()
+    """Skanowania w tle, których wynik nie został jeszcze naniesiony przez apply_scan"""
+    _touched = set()
+    """Ścieżki zmienione przez apply_changes w trakcie skanowania w tle"""
+    _extractor = None
+    duplicates: list[list[str]] = []
+    """Grupy piosenek o tej samej zawartości (DuplicateFinder)"""
+    _copy_of: dict[str, str] = {}
+    """ścieżka -> pierwsza ścieżka z jej grupy duplikatów, tylko dla piosenek z duplikatami"""
+    _finder = None
+    unique = False
+    """Tryb albumu: z każdej grupy duplikatów tylko pierwsza kopia, która pasuje do zapytania"""
+    last_scan = {}
+    """Statystyki ostatniego skanowania: czas, liczba katalogów, pominięte katalogi, pliki"""
     _json_file_is_actual = True
     """okresla czy plik json jest aktualny wzgledem listy z muzyka"""
     _instance = None
     is_rnd_flag = False
-    """Okresla czy piosenki sa ulozone randomowo"""
+    """Okresla czy piosenki sa odtwarzane w losowej kolejnosci"""
+    _shuffle = LazyShuffle()
+    """Losowa kolejność pozycji w library, losowana po jednej przy next()"""
+    history = deque(maxlen=Player.history_size)
+    """Ostatnio odtworzone piosenki, od najstarszej"""
+    _forward: list[str] = []
+    """Piosenki, z których cofnięto się przez before(), next() do nich wraca"""
+    _current = None
+    """Piosenka, która ostatnio zaczęła grać"""
     is_actual_library = True
     """Okresla czy biblioteka jest aktualna"""
+    player_state = Player
+    """Indeks i nazwa aktualnej piosenki, dla strefy jej własna podklasa Player"""
+    zone_name = None
+    """Nazwa strefy, None dla albumu głównego"""
+    zones: dict[str, type] = {}
+    """Albumy dodatkowych stref: nazwa -> podklasa MusicLibrary"""
+
+    @classmethod
+    def zone(cls, name: str, player_state=Player):
+        """Tworzy album strefy: podklasę z własnym albumem, zapytaniem o tagi, losowaniem
+        i historią. Biblioteka, metadane, indeks tagów i wyszukiwania są wspólne
+        (zapisywane zawsze w MusicLibrary), więc strefa kosztuje tylko listę albumu.
+        Args:
+            name (str): nazwa strefy
+            player_state: podklasa Player z indeksem, nazwą piosenki i głośnością strefy
+        Returns:
+            type[MusicLibrary]: klasa albumu strefy"""
+        album = type(f"{cls.__name__}_{name}", (cls,), {
+            "zone_name": name, "player_state": player_state,
+            "tags": [], "tag_query": "", "library": [], "library_version": 0, "_positions": {},
+            "is_rnd_flag": False, "_shuffle": LazyShuffle(), "history": deque(maxlen=Player.history_size),
+            "_forward": [], "_current": None, "is_actual_library": True, "unique": False,
+        })
+        MusicLibrary.zones[name] = album
+        return album
 
     def __new__(cls, *args, **kwargs):
+        """Tylko tworzy instancję, wczytanie biblioteki to osobne kroki
+        (read_dir_library, _find_music_files, do_library), wykonywane w tle przy starcie"""
         if cls._instance is None:
             cls._instance = super().__new__(cls)
             cls._instance.current_track = None
-            cls.read_dir_library()
-            cls.do_library()
         return cls._instance
         
+    @classmethod
+    def scan_music_files(cls) -> tuple:
+        """Przyrostowo skanuje katalog z muzyką bez zmiany biblioteki, więc może działać
+        poza wątkiem poleceń (skanowania wykonują się po kolei). Wynik nanosi apply_scan
+        Returns:
+            tuple: (znalezione pliki albo None, gdy katalogu nie można odczytać, statystyki, błąd)"""
+        token = object()
+        # od tej chwili apply_changes zapamiętuje zmienione ścieżki, apply_scan ich nie rusza
+        cls._pending_scans.add(token)
+        with cls._scan_lock:
+            store = cls._get_store()
+            scanner = LibraryScanner(cls.music_dir, cls.music_exts, store.load_scan_cache())
+            try:
+                found = scanner.scan()
+            except ScanError as e:
+                return token, None, scanner.stats, str(e)
+            except BaseException:
+                cls._pending_scans.discard(token)
+                raise
+            # stan katalogów przed naniesieniem piosenek jest bezpieczny:
+            # następne skanowanie porównuje pliki z biblioteką, nie z tym stanem
+            store.save_scan_cache(scanner.cache)
+        return token, found, scanner.stats, None
+
+    @classmethod
+    def apply_scan(cls, scan: tuple):
+        """Nanosi wynik scan_music_files na bibliotekę i bazę: dodaje nowe pliki audio,
+        usuwa te, których już nie ma. Ścieżki zmienione w trakcie skanowania przez apply_changes
+        zostają bez zmian. Gdy katalogu z muzyką nie ma lub nie można go odczytać, biblioteka zostaje
+        bez zmian (usunięcie piosenki z bazy usuwa też jej tagi)
+        Returns:
+            tuple: (nowe pliki, usunięte pliki)"""
+        token, found, stats, error = scan
+        touched = set(cls._touched)
+        cls._pending_scans.discard(token)
+        if not cls._pending_scans:
+            cls._touched.clear()
+        if found is None:
+            logger.error("Skanowanie przerwane, biblioteka bez zmian: %s", error)
+            MusicLibrary.last_scan = dict(stats, added=0, removed=0, error=error)
+            return [], []
+        found_set = set(found)
+        new_files = [song for song in found if song not in cls.full_library and song not in touched]
+        removed_files = [song for song in cls.full_library if song not in found_set and song not in touched]
+        for song in new_files:
+            cls.full_library[song] = []
+        for song in removed_files:
+            del cls.full_library[song]
+            cls.metadata.pop(song, None)
+            cls._metadata_keys.pop(song, None)
+        cls._reindex_search(new_files, removed_files, {})
+        store = cls._get_store()
+        if new_files:
+            store.add_songs(new_files)
+        if removed_files:
+            store.remove_songs(removed_files)
+        MusicLibrary.last_scan = dict(stats, added=len(new_files), removed=len(removed_files))
+        SCAN_SECONDS.observe(stats.get("time", 0.0))
+        logger.info("Skanowanie: %(files)d plików w %(time)s s, pominięto %(skipped)d/%(dirs)d katalogów, "
+                    "nowe: %(added)d, usunięte: %(removed)d", cls.last_scan)
+        if new_files or removed_files:
+            MusicLibrary._json_file_is_actual = False
+        return new_files, removed_files
+
     @classmethod
     def _find_music_files(cls):
-        """zapisuje do pliku json wszystkie nowe pliki audio"""
-        _new_file_exist = False
-        for root, dirs, files in os.walk(cls.music_dir):
-            for file in files:
-                ext = os.path.splitext(file)[1].lower()
-                if ext in cls.music_exts:
-                    full_path = os.path.join(root, file)
-                    rel_path = os.path.relpath(full_path, cls.music_dir).replace("\\", "/")
-                    if rel_path not in cls.full_library:
-                        _new_file_exist = True
-                        cls.full_library[rel_path] = []
-        if _new_file_exist:
+        """Skanowanie i naniesienie wyniku w bieżącym wątku (scan_music_files i apply_scan)"""
+        return cls.apply_scan(cls.scan_music_files())
+
+    @classmethod
+    def rescan(cls, scan: tuple | None = None):
+        """Przyrostowe skanowanie w trakcie działania, zmiany trafiają od razu do albumu
+        Args:
+            scan (tuple | None): wynik scan_music_files wykonanego w tle, domyślnie skanuje teraz
+        Returns:
+            bool: True, jeśli album się zmienił"""
+        new_files, removed_files = cls.apply_scan(scan) if scan is not None else cls._find_music_files()
+        if new_files:
+            cls.update_metadata(new_files)
+        changed = cls._update_albums(new_files, removed_files, {})
+        cls._compact_library()
+        return changed
+
+    @classmethod
+    def apply_changes(cls, ops):
+        """Nanosi zmiany z LibraryWatcher na bibliotekę, bazę, indeks tagów, metadane i album
+        Args:
+            ops (list[tuple]): ("add", ścieżka), ("remove", ścieżka) lub ("move", stara, nowa),
+                usunięcie i przeniesienie może dotyczyć katalogu
+        Returns:
+            bool: True, jeśli album się zmienił"""
+        origin = {}
+        """aktualna ścieżka -> ścieżka przed zmianami (None dla nowych)"""
+        gone = {}
+        """ścieżka przed zmianami -> tagi usuniętych piosenek"""
+        modified = set()
+
+        def add(song):
+            if song in cls.full_library:
+                modified.add(song)
+            elif song in gone:
+                # usunięty i zapisany od nowa (np. przez edytor tagów), tagi zostają
+                cls.full_library[song] = gone.pop(song)
+                modified.add(song)
+            else:
+                cls.full_library[song] = []
+                origin[song] = None
+
+        def drop(song):
+            tags = cls.full_library.pop(song)
+            first = origin.pop(song, song)
+            if first is not None:
+                gone[first] = tags
+            modified.discard(song)
+
+        for op in ops:
+            if op[0] == "add":
+                add(op[1])
+            elif op[0] == "remove":
+                for song in cls._songs_under(op[1]):
+                    drop(song)
+            else:
+                old, new = op[1], op[2]
+                songs = cls._songs_under(old)
+                if not songs and os.path.splitext(new)[1].lower() in cls.music_exts:
+                    # plik nieznany bibliotece, np. przeniesiony z pliku tymczasowego
+                    add(new)
+                for song in songs:
+                    moved = new + song[len(old):]
+                    if moved in cls.full_library:
+                        # przeniesienie nadpisało istniejący plik
+                        drop(moved)
+                    cls.full_library[moved] = cls.full_library.pop(song)
+                    origin[moved] = origin.pop(song, song)
+                    if song in modified:
+                        modified.discard(song)
+                        modified.add(moved)
+        removed = list(gone)
+        added = [song for song, first in origin.items() if first is None]
+        renamed = {first: song for song, first in origin.items() if first is not None and first != song}
+        if not (added or removed or renamed or modified):
+            return False
+        if cls._pending_scans:
+            cls._touched.update(added, removed, renamed, renamed.values())
+
+        with cls._metadata_lock:
+            for song in removed:
+                cls.metadata.pop(song, None)
+                cls._metadata_keys.pop(song, None)
+            moved_meta = []
+            for first, song in renamed.items():
+                meta, key = cls.metadata.pop(first, None), cls._metadata_keys.pop(first, None)
+                if meta is not None and key is not None:
+                    cls.metadata[song] = meta
+                    cls._metadata_keys[song] = key
+                    moved_meta.append((song, key[0], key[1], meta))
+        cls._get_store().apply_changes(
+            removed + list(renamed),
+            added + list(renamed.values()),
+            {song: cls.full_library[song] for song in renamed.values()},
+            moved_meta,
+        )
+        MusicLibrary._json_file_is_actual = False
+        cls._reindex_search(added, removed, renamed)
+        if added or modified:
+            cls.update_metadata(added + list(modified))
+        logger.info("Zmiany w katalogu: nowe %d, usunięte %d, przeniesione %d, zmienione %d",
+                    len(added), len(removed), len(renamed), len(modified))
+        changed = cls._update_albums(added, removed, renamed)
+        cls._compact_library()
+        return changed
+
+    @classmethod
+    def _update_albums(cls, added, removed, renamed: dict) -> bool:
+        """_update_album dla albumu głównego i albumów wszystkich stref
+        Returns:
+            bool: True, jeśli zmienił się którykolwiek album"""
+        changed = MusicLibrary._update_album(added, removed, renamed)
+        for album in MusicLibrary.zones.values():
+            changed = album._update_album(added, removed, renamed) or changed
+        return changed
+
+    @classmethod
+    def _reindex_search(cls, added, removed, renamed: dict):
+        """Nanosi zmiany full_library na indeks wyszukiwania"""
+        for song in list(removed) + list(renamed):
+            cls.search_index.remove(song)
+        for song in list(added) + list(renamed.values()):
+            cls.search_index.update(song, cls.metadata.get(song))
+
+    @classmethod
+    def search(cls, query: str, limit: int = 20, album_only: bool = False) -> list[str]:
+        """Wyszukuje piosenki po początkach słów, bez rozróżniania polskich znaków
+        Args:
+            query (str): np. "kaz lodz"
+            album_only (bool): tylko piosenki z aktualnego albumu
+        Returns:
+            list[str]: ścieżki względne, od najlepiej pasującej"""
+        accept = cls._positions.__contains__ if album_only else None
+        return cls.search_index.search(query, limit, accept)
+
+    @classmethod
+    def _songs_under(cls, path: str) -> list[str]:
+        """Piosenka o tej ścieżce albo wszystkie piosenki w katalogu o tej ścieżce"""
+        return cls.full_library.songs_under(path)
+
+    @classmethod
+    def _compact_library(cls):
+        """Numery usuniętych i przeniesionych piosenek nie są używane ponownie. Gdy jest ich
+        więcej niż piosenek, full_library zostaje zastąpiona zwartą kopią, a albumy wszystkich
+        stref dostają te same piosenki z nowymi numerami (koszt rozłożony na usunięcia)"""
+        songs = cls.full_library
+        if songs.removed <= max(len(songs), 1000):
+            return
+        compact = songs.compacted()
+        MusicLibrary.full_library = compact
+        for album in (MusicLibrary, *MusicLibrary.zones.values()):
+            album.library = SongList.from_paths(compact, album.library)
+            album._update_positions()
+        logger.info("Biblioteka przenumerowana: %d piosenek, zwolniono %d numerów", len(compact), songs.removed)
+
+    @classmethod
+    def _update_album(cls, added, removed, renamed: dict) -> bool:
+        """Nanosi zmiany biblioteki na album bez przebudowy i bez zmiany aktualnej piosenki.
+        Nowe piosenki trafiają na koniec albumu. Jeśli usunięta zostanie grająca piosenka,
+        index_song wskazuje pozycję przed nią (także -1), żeby next() zagrał następną,
+        a current_song() zwraca "".
+        Args:
+            added: nowe piosenki w full_library
+            removed: piosenki usunięte z full_library
+            renamed (dict): stara ścieżka -> nowa
+        Returns:
+            bool: True, jeśli album się zmienił"""
+        # usunięte ścieżki nie mają już numeru w full_library, sprawdzane są nazwy z albumu
+        album = set(cls.library) if removed or renamed else ()
+        removed = {song for song in removed if song in album}
+        renamed = {old: new for old, new in renamed.items() if old in album}
+        if added:
+            selected = cls._select_ids()
+            if selected is not None:
+                added = [song for song in added if cls.full_library.id_of(song) in selected]
+        if not (added or removed or renamed):
+            return False
+
+        current = cls.player_state.index_song
+        library = []
+        for i, song in enumerate(cls.library):
+            if song in removed:
+                if i <= current:
+                    current -= 1
+                continue
+            library.append(renamed.get(song, song))
+        if cls.player_state.name_song in renamed:
+            cls.player_state.name_song = renamed[cls.player_state.name_song]
+        if cls._current in renamed:
+            cls._current = renamed[cls._current]
+        library.extend(added)
+        cls.library = SongList.from_paths(cls.full_library, library)
+        cls._update_positions()
+        cls.player_state.index_song = current if library else 0
+        cls._reset_shuffle()
+        cls.library_version = max(cls.library_version + 1, time.time_ns() // 1000)
+        cls.is_actual_library = False
+        return True
+
+    @classmethod
+    def _get_store(cls):
+        """Zwraca otwartą bazę biblioteki, otwiera ją ponownie po zmianie db_file"""
+        if cls._store is None or cls._store.db_file != cls.db_file:
+            if cls._tag_writer is not None:
+                # zaległe zmiany tagów trafiają jeszcze do poprzedniej bazy
+                atexit.unregister(cls._tag_writer.close)
+                cls._tag_writer.close()
+                MusicLibrary._tag_writer = None
+            if cls._store is not None:
+                cls._store.close()
+            MusicLibrary._store = LibraryStore(cls.db_file)
+            atexit.unregister(MusicLibrary.export_info_file)
+            atexit.register(MusicLibrary.export_info_file)
+        return cls._store
+
+    @classmethod
+    def _get_tag_writer(cls) -> TagWriter:
+        """Zapis zmian tagów w tle do aktualnej bazy, zaległe zmiany są zapisywane przy wyjściu z programu"""
+        store = cls._get_store()
+        if cls._tag_writer is None:
+            MusicLibrary._tag_writer = TagWriter(store.apply_tags)
+            atexit.register(cls._tag_writer.close)
+        return cls._tag_writer
+
+    @classmethod
+    def flush_tags(cls):
+        """Zapisuje od razu zaległe zmiany tagów"""
+        if cls._tag_writer is not None:
+            cls._tag_writer.flush()
+
+    @classmethod
+    def export_info_file(cls):
+        """Eksport do json przy wyjściu z programu, jeśli jest włączony (tag_edit.export_json)
+        i biblioteka zmieniła się od ostatniego eksportu. Zapisuje całą bibliotekę,
+        dlatego nie po każdym zapisie tagów"""
+        if tag_edit.export_json and not cls._json_file_is_actual and cls.full_library:
             cls._create_info_file()
-        
 
     @classmethod
-    def _create_info_file(cls):
+    def _create_info_file(cls, info_file: str | None = None):
         """tworzy plik json, 
-        zapisuje slownik z muzyka do pliku json"""
-        with open(cls.info_file, "w", encoding="utf-8") as f:
-            json.dump(cls.full_library, f, ensure_ascii=False, indent=4)
-            print(f"Zapisano {len(cls.full_library)} plików muzycznych do '{cls.info_file}'")
-        cls._json_file_is_actual = True
+        zapisuje slownik z muzyka do pliku json (eksport, danymi zarządza baza).
+        Zapis do pliku tymczasowego i zmiana nazwy, przerwany zapis nie psuje poprzedniego pliku"""
+        info_file = info_file or cls.info_file
+        # zmiany w trakcie eksportu ustawią flagę ponownie
+        MusicLibrary._json_file_is_actual = True
+        try:
+            songs = dict(cls.full_library)
+            fd, tmp_file = tempfile.mkstemp(prefix=os.path.basename(info_file) + ".",
+                                            suffix=".tmp", dir=os.path.dirname(info_file) or ".")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(songs, f, ensure_ascii=False, indent=4)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_file, info_file)
+            except BaseException:
+                os.remove(tmp_file)
+                raise
+        except BaseException:
+            MusicLibrary._json_file_is_actual = False
+            raise
+        logger.info("Zapisano %d plików muzycznych do '%s'", len(songs), info_file)
         
         
+    @classmethod
+    def load_dir_library(cls) -> dict:
+        """Odczytuje z bazy informacje o utworach i buduje indeks wyszukiwania bez zmiany
+        biblioteki, więc może działać poza wątkiem poleceń. Wynik podmienia set_dir_library.
+        Przy pierwszym uruchomieniu importuje do bazy stary plik JSON.
+        Returns:
+            dict: nazwa atrybutu MusicLibrary -> nowa wartość"""
+        store = cls._get_store()
+        cls.flush_tags()
+        store.import_json(cls.info_file)
+        full_library = store.load(CompactLibrary())
+        cached = store.load_metadata()
+        metadata = {path: meta for path, (_, _, meta) in cached.items()}
+        search_index = SearchIndex()
+        search_index.build(full_library, metadata)
+        return {"full_library": full_library, "metadata": metadata, "search_index": search_index,
+                "_metadata_keys": {path: (size, mtime) for path, (size, mtime, _) in cached.items()}}
+
+    @classmethod
+    def set_dir_library(cls, loaded: dict):
+        """Podmienia bibliotekę na wczytaną przez load_dir_library"""
+        for name, value in loaded.items():
+            setattr(MusicLibrary, name, value)
+        MusicLibrary.metadata_version += 1
+
     @classmethod
     def read_dir_library(cls):
-        """Odczytuje plik JSON z informacjami o utworach i nadpisuje słownik."""
-        if os.path.exists(cls.info_file):
-            with open(cls.info_file, "r", encoding="utf-8") as f:
-                cls.full_library = json.load(f)
-        else:
-            cls.full_library = {}
-            cls._create_info_file()
-        cls._json_file_is_actual = True
+        """Odczytuje z bazy informacje o utworach i nadpisuje słownik"""
+        cls.set_dir_library(cls.load_dir_library())
+
+    @classmethod
+    def save_resume(cls):
+        """Zapisuje w bazie stan potrzebny do wznowienia odtwarzania po uruchomieniu"""
+        snapshot = {"song": cls._current, "volume": cls.player_state.volume,
+                    "random": cls.is_rnd_flag, "tag_query": cls.tag_query, "unique": cls.unique}
+        cls._get_store().set_meta(cls._resume_key(), json.dumps(snapshot, ensure_ascii=False))
+
+    @classmethod
+    def _resume_key(cls) -> str:
+        return "resume" if cls.zone_name is None else f"resume:{cls.zone_name}"
+
+    @classmethod
+    def load_resume(cls) -> dict:
+        """Odczytuje stan zapisany przez save_resume, bez wczytywania biblioteki
+        Returns:
+            dict: {"song", "volume", "random", "tag_query", "unique"} albo pusty słownik"""
+        try:
+            snapshot = json.loads(cls._get_store().get_meta(cls._resume_key()) or "{}")
+        except ValueError as e:
+            logger.warning("Niepoprawny zapis stanu odtwarzania: %s", e)
+            return {}
+        return snapshot if isinstance(snapshot, dict) else {}
+
+    @classmethod
+    def update_metadata(cls, songs=None):
+        """Uruchamia w tle odczyt metadanych nowych i zmienionych plików,
+        nie blokuje odtwarzania ani zapytań HTTP
+        Args:
+            songs (list | None): pliki do sprawdzenia, domyślnie cała biblioteka"""
+        if songs is not None:
+            extractor = MetadataExtractor(cls.music_dir, dict(cls._metadata_keys), cls._save_metadata)
+            extractor.start(songs)
+            return extractor
+        if cls._extractor is not None and cls._extractor.running:
+            return cls._extractor
+        MusicLibrary._extractor = MetadataExtractor(cls.music_dir, dict(cls._metadata_keys), cls._save_metadata)
+        cls._extractor.start(list(cls.full_library))
+        return cls._extractor
+
+    @classmethod
+    def _save_metadata(cls, results):
+        """Zapisuje paczkę wyników z MetadataExtractor"""
+        results = [r for r in results if r[0] in cls.full_library]
+        with cls._metadata_lock:
+            for path, size, mtime, meta in results:
+                cls.metadata[path] = meta
+                cls._metadata_keys[path] = (size, mtime)
+                cls.search_index.update(path, meta)
+            if results:
+                MusicLibrary.metadata_version += 1
+        if results:
+            cls._get_store().save_metadata(results)
+
+    @classmethod
+    def get_metadata(cls, song_name: str):
+        """Zwraca metadane piosenki albo None, jeśli nie zostały jeszcze odczytane
+        Args:
+            song_name (str): ścieżka względna piosenki"""
+        return cls.metadata.get(song_name)
+
     @classmethod
     def change_music_tags(cls, name_audio, tag, add = True):
-        """dodaje/usuwa tag do utworu, nie dodaje duplikatow"""
-        if name_audio in cls.full_library:
-            if tag not in cls.full_library[name_audio] and add:
-                cls.full_library[name_audio].append(tag)
-            elif tag in cls.full_library[name_audio] and not add:
-                cls.full_library[name_audio].remove(tag)
-        cls._json_file_is_actual = False
-                
+        """dodaje/usuwa tag do utworu, nie dodaje duplikatow.
+        Zapis do bazy w tle, tak jak w change_tags"""
+        changed = cls.full_library.add_tag(name_audio, tag) if add else cls.full_library.remove_tag(name_audio, tag)
+        if changed:
+            MusicLibrary._json_file_is_actual = False
+            cls._get_tag_writer().add([(name_audio, tag, add)])
+
+    @classmethod
+    def change_tags(cls, ops) -> list[tuple]:
+        """Dodaje i usuwa tagi paczką. Najpierw sprawdzana jest cała paczka,
+        więc przy błędzie biblioteka zostaje bez zmian. Zmienia tylko bibliotekę
+        w pamięci, do bazy zapisuje TagWriter w tle
+        Args:
+            ops: lista (ścieżka, tag, dodać), ścieżka katalogu oznacza wszystkie piosenki w nim i w podkatalogach
+        Returns:
+            list[tuple]: (ścieżka, tag, dodany) - tylko operacje, które coś zmieniły
+        Raises:
+            ValueError: nieznana ścieżka albo pusty tag"""
+        expanded = []
+        for path, tag, add in ops:
+            if not isinstance(tag, str) or not tag.strip():
+                raise ValueError(f"niepoprawny tag: {tag!r}")
+            songs = cls._songs_under(path) if isinstance(path, str) and path else []
+            if not songs:
+                raise ValueError(f"nieznana ścieżka: {path!r}")
+            expanded.append((songs, tag, bool(add)))
+        library = cls.full_library
+        changes = []
+        for songs, tag, add in expanded:
+            change = library.add_tag if add else library.remove_tag
+            changes.extend((song, tag, add) for song in songs if change(song, tag))
+        if changes:
+            MusicLibrary._json_file_is_actual = False
+            cls._get_tag_writer().add(changes)
+        return changes
+
+    @classmethod
+    def select_songs(cls, query: str | None = None):
+        """Zwraca zbiór piosenek pasujących do zapytania o tagi
+        Args:
+            query (str | None): zapytanie AND/OR/NOT, domyślnie tag_query, a gdy puste - tags (OR)
+        Returns:
+            set | None: piosenki, None oznacza całą bibliotekę
+        Raises:
+            TagQueryError: niepoprawne zapytanie"""
+        selected = cls._select_ids(query)
+        return None if selected is None else {cls.full_library.path_of(song_id) for song_id in selected}
+
+    @classmethod
+    def _select_ids(cls, query: str | None = None):
+        """select_songs na numerach piosenek z full_library, bez tworzenia ścieżek
+        Returns:
+            set[int] | None: numery piosenek, None oznacza całą bibliotekę"""
+        songs = cls.full_library
+        query = cls.tag_query if query is None else query
+        if query:
+            return tag_query.query(query, songs.tag_id_index, songs.ids())
+        if cls.tags:
+            return set().union(*(songs.ids_with_tag(tag) for tag in cls.tags))
+        return None
+
+    @classmethod
+    def set_tag_query(cls, query: str):
+        """Ustawia zapytanie o tagi i przebudowuje album
+        Raises:
+            TagQueryError: niepoprawne zapytanie, album zostaje bez zmian"""
+        query = query.strip()
+        if query:
+            tag_query.parse(query)
+        cls.tag_query = query
+        cls.do_library()
+
     @classmethod
     def do_library(cls):
-        """tworzy liste piosenek, ktore beda odtwarzane"""
-        cls.library = []
-        for song, tags in cls.full_library.items():
-            if not cls.tags or any(tag in cls.tags for tag in tags):
-                cls.library.append(song)
-        if MusicLibrary.is_rnd_flag:
-            random.shuffle(cls.library)
-        Player.index_song = 0
-        Player.index_song = 0
+        """tworzy liste piosenek, ktore beda odtwarzane.
+        Aktualna piosenka zachowuje swoją pozycję, jeśli nadal jest w albumie"""
+        start = time.perf_counter()
+        current = cls.library[cls.player_state.index_song] if 0 <= cls.player_state.index_song < len(cls.library) else None
+        selected = cls._select_ids()
+        songs = cls.full_library
+        if selected is None:
+            cls.library = SongList(songs, songs.ids())
+        else:
+            # numery rosną w kolejności dodania, posortowane dają kolejność full_library
+            cls.library = SongList(songs, sorted(selected))
+        if cls.unique and cls._copy_of:
+            cls.library = SongList.from_paths(songs, cls._one_per_group(cls.library))
+        cls._update_positions()
+        cls.player_state.index_song = cls._positions.get(current, 0)
+        cls._reset_shuffle()
+        cls.library_version = max(cls.library_version + 1, time.time_ns() // 1000)
         cls.is_actual_library = False
+        REBUILD_SECONDS.observe(time.perf_counter() - start)
+
+    @staticmethod
+    def _one_per_group(songs: list[str]) -> list[str]:
+        """Zostawia pierwszą piosenkę z każdej grupy duplikatów, kolejność bez zmian"""
+        copy_of = MusicLibrary._copy_of
+        seen = set()
+        result = []
+        for song in songs:
+            first = copy_of.get(song)
+            if first is None:
+                result.append(song)
+            elif first not in seen:
+                seen.add(first)
+                result.append(song)
+        return result
+
+    @classmethod
+    def find_duplicates(cls, on_done=None):
+        """Uruchamia w tle wyszukiwanie duplikatów w całej bibliotece
+        Args:
+            on_done: funkcja wywoływana z grupami duplikatów w wątku wyszukiwania,
+                domyślnie od razu set_duplicates"""
+        if MusicLibrary._finder is not None and MusicLibrary._finder.running:
+            return MusicLibrary._finder
+        store = cls._get_store()
+        MusicLibrary._finder = DuplicateFinder(cls.music_dir, store.load_hashes(), store.save_hashes,
+                                               on_done or cls.set_duplicates)
+        MusicLibrary._finder.start(list(cls.full_library))
+        return MusicLibrary._finder
+
+    @classmethod
+    def set_duplicates(cls, groups):
+        """Zapisuje grupy duplikatów, albumy w trybie unique trzeba potem przebudować (do_library)
+        Args:
+            groups (list[list[str]]): grupy ścieżek o tej samej zawartości"""
+        groups = [[song for song in group if song in cls.full_library] for group in groups]
+        MusicLibrary.duplicates = [group for group in groups if len(group) > 1]
+        MusicLibrary._copy_of = {song: group[0] for group in MusicLibrary.duplicates for song in group}
+
+    @classmethod
+    def _update_positions(cls):
+        """Przelicza mapę nazwa -> pozycja po zmianie library"""
+        cls._positions = cls.library.positions
+
+    @classmethod
+    def _reset_shuffle(cls):
+        """Nowa runda losowania, bez aktualnej piosenki. Koszt O(1), album się nie zmienia"""
+        cls._shuffle.reset(len(cls.library))
+        if cls.library:
+            cls._shuffle.take(cls.player_state.index_song)
+
     @classmethod
     def do_random(cls, yes = True):
-        """ustawia randomowa kolejnosc w bibliotece"""
-        MusicLibrary.is_rnd_flag = yes
-        cls.do_library()
-            
-    @classmethod
-    def next(cls):
-        """Zwiększa aktualny indeks piosenki o +1, po ostatniej piosence w albumie cofa się do 0.
-        Jeśli piosenki w albumie są ustawione randomowo, to po ostatniej piosence losuje ponownie"""
-        Player.index_song +=1
-        if Player.index_song >= len(cls.library):
-            Player.index_song = 0
-            if MusicLibrary.is_rnd_flag:
-                MusicLibrary.do_random(True)
-        path = cls.library[Player.index_song]
+        """Włącza lub wyłącza losową kolejność odtwarzania.
+        Album i aktualna pozycja zostają bez zmian, losowana jest tylko kolejność następnych piosenek"""
+        cls.is_rnd_flag = yes
+        cls._reset_shuffle()
+
+    @classmethod
+    def _started(cls, song: str, from_history: bool = False):
+        """Zapamiętuje piosenkę, która zaczyna grać, poprzednia trafia do historii"""
+        if cls._current is not None and cls._current != song and not from_history:
+            cls.history.append(cls._current)
+        cls._current = song
+        cls.player_state.name_song = song
+
+    @classmethod
+    def _next_index(cls, draw: bool = True):
+        """Pozycja następnej piosenki: z listy powrotów, wylosowana albo kolejna
+        Args:
+            draw (bool): False - tylko podgląd, bez zużywania losowania"""
+        while cls._forward:
+            index = cls._positions.get(cls._forward[-1])
+            if index is not None:
+                if draw:
+                    cls._forward.pop()
+                return index
+            cls._forward.pop()
+        if not cls.is_rnd_flag:
+            index = cls.player_state.index_song + 1
+            return index if index < len(cls.library) else 0
+        index = cls._shuffle.draw() if draw else cls._shuffle.peek()
+        if index is None:
+            # koniec rundy, nowa runda losowania zamiast tasowania albumu
+            cls._reset_shuffle()
+            index = cls._shuffle.draw() if draw else cls._shuffle.peek()
+        return cls.player_state.index_song if index is None else index
+
+    @classmethod
+    def next(cls, steps: int = 1):
+        """Przechodzi do następnej piosenki: po before() wraca do piosenek, z których się cofnięto,
+        w trybie losowym losuje ją w O(1), a w zwykłym zwiększa indeks o 1 i po ostatniej wraca do 0
+        Args:
+            steps (int): o ile piosenek, do historii trafia tylko ta, która grała,
+                a nie pominięte po drodze"""
+        for _ in range(steps):
+            cls.player_state.index_song = cls._next_index()
+        path = cls.library[cls.player_state.index_song]
+        cls._started(path)
         return os.path.join(cls.music_dir, path)
     
     @classmethod
-    def before(cls):
-        """Ustawia indeks piosneki o 1 mniejszy, bo nie ma zapisanej historii odtwarzania"""
-        Player.index_song -=1
-        if Player.index_song == -1:
-            Player.index_song = len(cls.library) -1
-        path = cls.library[Player.index_song]
+    def peek_next(cls):
+        """Zwraca pełną ścieżkę piosenki, którą zwróci next(), bez zmiany indeksu
+        Returns:
+            str | None: ścieżka lub None dla pustego albumu"""
+        if not cls.library:
+            return None
+        return os.path.join(cls.music_dir, cls.library[cls._next_index(draw=False)])
+
+    @classmethod
+    def before(cls, steps: int = 1):
+        """Wraca do piosenki, która naprawdę grała wcześniej (historia odtwarzania).
+        Bez historii ustawia indeks piosenki o 1 mniejszy
+        Args:
+            steps (int): o ile piosenek, jak tyle naciśnięć po kolei"""
+        path = None
+        for _ in range(steps):
+            path = cls._back()
+        return path
+
+    @classmethod
+    def _back(cls):
+        """Jeden krok before()"""
+        while cls.history:
+            song = cls.history.pop()
+            if song in cls._positions:
+                if cls._current is not None:
+                    cls._forward.append(cls._current)
+                cls.player_state.index_song = cls._positions[song]
+                cls._started(song, from_history=True)
+                return os.path.join(cls.music_dir, song)
+        cls.player_state.index_song -=1
+        if cls.player_state.index_song < 0:
+            cls.player_state.index_song = len(cls.library) -1
+        path = cls.library[cls.player_state.index_song]
+        cls._started(path, from_history=True)
         return os.path.join(cls.music_dir, path)
 
     @classmethod
-    def play(cls, index: int = Player.index_song):
+    def play(cls, index: int | None = None):
         """Zwraca pełną ścieżkę, potrzebną do odtworzenia pliku audio
         Args:
-            index (int): Numer audio w albumie, domyślnie pobiera z Player.index_song
+            index (int): Numer audio w albumie, domyślnie pobiera z cls.player_state.index_song
         Returns:
-            str: Pełna ścieżka do pliku audio: cls.music_dir + Player.name_song"""
-        Player.name_song = cls.library[index]
-        return os.path.join(cls.music_dir, Player.name_song)
+            str: Pełna ścieżka do pliku audio: cls.music_dir + cls.player_state.name_song"""
+        if index is None:
+            index = cls.player_state.index_song
+        cls.player_state.index_song = index
+        song = cls.library[index]
+        if song != cls._current:
+            # wybór piosenki z listy zaczyna nową ścieżkę odtwarzania
+            cls._forward.clear()
+            if cls.is_rnd_flag:
+                cls._shuffle.take(index)
+        cls._started(song)
+        return os.path.join(cls.music_dir, song)
         
     @classmethod
-    def get_index_song(cls, song_name: str = Player.name_song):
-        """Zwraca numer piosenki w albumie.  
+    def current_song(cls) -> str:
+        """Aktualna piosenka albumu do wyświetlenia.
+        Returns:
+            str: ścieżka względna albo "", gdy album jest pusty lub grająca piosenka
+            została z niego usunięta (index_song wskazuje wtedy pozycję przed nią, np. -1)"""
+        index = cls.player_state.index_song
+        if not 0 <= index < len(cls.library):
+            return ""
+        song = cls.library[index]
+        if cls._current is not None and song != cls._current:
+            return ""
+        return song
+
+    @classmethod
+    def get_index_song(cls, song_name: str | None = None):
+        """Zwraca numer piosenki w albumie, w czasie stałym.  
         Ta sama piosenka będzie miała różne indeksy, jeśli w albumie piosenki są ustawione losowo.
         Args:
-            song_name (str): nazwa piosenki, default Player.name_song
+            song_name (str): nazwa piosenki, default cls.player_state.name_song
         Returns:
         int: indeks piosenki o danej nazwie, jeśli nie istnieje to zwraca 0"""
-        print(song_name)
-
-        if song_name in cls.library:
-            return cls.library.index(song_name)
-        else:
-            return 0
\ No newline at end of file
+        if song_name is None:
+            song_name = cls.player_state.name_song
+        return cls._positions.get(song_name, 0)
\ No newline at end of file
@@ -0,0 +1,131 @@
+"""Kolejka poleceń odtwarzacza wykonywanych przez jeden wątek"""
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+from scripts import metrics
+
+logger = logging.getLogger(__name__)
+
+COMMAND_SECONDS = metrics.histogram(
+    "player_command_seconds", "Czas wykonania polecenia odtwarzacza w wątku poleceń", ["command"])
+
+
+class _Command:
+    __slots__ = ("name", "func", "args", "key", "merge", "futures")
+
+    def __init__(self, name, func, args, key, merge):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.key = key
+        self.merge = merge
+        self.futures = []
+
+
+class PlayerCommands:
+    """Wszystkie zmiany stanu odtwarzacza (mpv, album, indeks piosenki) wykonuje
+    jeden wątek, po kolei. Wątki serwera i pętli zdarzeń mpv tylko dodają
+    polecenia do kolejki i od razu wracają.
+
+    Polecenia czekające w kolejce są łączone:
+    - z tym samym key (np. głośność) - zostaje tylko najnowsze, na miejscu starszego,
+    - z merge (np. następna/poprzednia), dodane zaraz po poleceniu o tej samej
+      nazwie - argumenty są łączone funkcją merge (np. suma kroków)."""
+
+    def __init__(self):
+        self.stats = {"submitted": 0, "executed": 0, "coalesced": 0, "failed": 0, "cancelled": 0}
+        self._queue: deque[_Command] = deque()
+        self._keys: dict[str, _Command] = {}
+        self._cond = threading.Condition()
+        self._busy = False
+        self._thread = None
+        self._running = False
+
+    def submit(self, name: str, func, *args, key: str | None = None, merge=None) -> Future:
+        """Dodaje polecenie do kolejki, nie czeka na wykonanie
+        Args:
+            name (str): nazwa polecenia
+            func: funkcja wywoływana w wątku poleceń z args
+            key (str | None): polecenia z tym samym kluczem zastępują się (wygrywa najnowsze)
+            merge: funkcja (stare_args, nowe_args) -> args dla poleceń dodanych jedno po drugim
+        Returns:
+            Future: wynik funkcji, wspólny dla wszystkich połączonych poleceń;
+                cancel() przed rozpoczęciem wykonania pomija polecenie"""
+        future = Future()
+        with self._cond:
+            self.stats["submitted"] += 1
+            command = self._keys.get(key) if key is not None else None
+            if command is not None:
+                command.func, command.args = func, args
+            elif merge is not None and self._queue and self._queue[-1].name == name and self._queue[-1].merge:
+                command = self._queue[-1]
+                command.args = merge(command.args, args)
+            if command is not None:
+                self.stats["coalesced"] += 1
+            else:
+                command = _Command(name, func, args, key, merge)
+                self._queue.append(command)
+                if key is not None:
+                    self._keys[key] = command
+            command.futures.append(future)
+            if not self._running:
+                self._start()
+            self._cond.notify()
+        return future
+
+    def wait_idle(self, timeout: float | None = None) -> bool:
+        """Czeka, aż kolejka będzie pusta i żadne polecenie nie będzie wykonywane
+        Returns:
+            bool: False po upływie timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queue and not self._busy, timeout)
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def _start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="player-commands", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+                self._cond.wait_for(lambda: self._queue or not self._running)
+                if not self._running:
+                    return
+                command = self._queue.popleft()
+                if command.key is not None:
+                    self._keys.pop(command.key, None)
+                # od tej chwili polecenie nie może już być zmienione przez submit
+                command.merge = None
+                # anulowane przez wszystkich czekających (Future.cancel) nie jest wykonywane
+                futures = [future for future in command.futures if future.set_running_or_notify_cancel()]
+                if not futures:
+                    self.stats["cancelled"] += 1
+                    continue
+                command.futures = futures
+                self._busy = True
+            start = time.perf_counter()
+            try:
+                result = command.func(*command.args)
+            except Exception as e:
+                logger.exception("Błąd polecenia %s: %s", command.name, e)
+                self.stats["failed"] += 1
+                for future in command.futures:
+                    future.set_exception(e)
+            else:
+                for future in command.futures:
+                    future.set_result(result)
+            self.stats["executed"] += 1
+            COMMAND_SECONDS.labels(command.name).observe(time.perf_counter() - start)
@@ -0,0 +1,188 @@
+"""Indeks wyszukiwania piosenek po fragmentach słów, bez polskich znaków"""
+import re
+import bisect
+import threading
+import unicodedata
+from functools import lru_cache
+
+_SPECIAL = str.maketrans({"ł": "l", "Ł": "l", "ß": "ss", "æ": "ae", "ø": "o", "đ": "d"})
+"""Litery, których NFKD nie rozkłada na literę bazową i znak diakrytyczny"""
+_WORD = re.compile(r"\w+")
+_SEARCHED = 250
+"""Tyle pasujących piosenek wystarczy do ułożenia wyników, szersze zapytania nie są sprawdzane do końca"""
+_COUNTED = 256
+"""Przy szacowaniu liczby piosenek dla początku słowa liczone jest najwyżej tyle słów"""
+
+
+@lru_cache(maxsize=65536)
+def normalize(text: str) -> str:
+    """Małe litery bez znaków diakrytycznych: "Łódź Ćma" -> "lodz cma" """
+    text = unicodedata.normalize("NFKD", text.lower().translate(_SPECIAL))
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def tokenize(text: str) -> list[str]:
+    return _WORD.findall(normalize(text))
+
+
+class _Entry:
+    __slots__ = ("tokens", "name_tokens")
+
+    def __init__(self, tokens, name_tokens):
+        self.tokens = tokens
+        """Wszystkie słowa: katalogi, nazwa pliku i metadane"""
+        self.name_tokens = name_tokens
+        """Słowa z nazwy pliku i tytułu, liczą się wyżej w wynikach"""
+
+
+class SearchIndex:
+    """Indeks odwrotny słowo -> piosenki, z posortowaną listą słów.
+
+    Każde słowo zapytania jest traktowane jako początek słowa (wyszukiwanie
+    w trakcie pisania). Zakres słów o danym początku to dwa wyszukiwania
+    binarne w posortowanej liście. Piosenki są zbierane z najbardziej
+    wybiórczego słowa zapytania i sprawdzane z pozostałymi, więc koszt zależy
+    od liczby wyników, a nie od wielkości biblioteki."""
+
+    def __init__(self):
+        self._postings: dict[str, set[str]] = {}
+        self._words: list[str] = []
+        """Posortowane klucze _postings"""
+        self._entries: dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def build(self, songs, metadata: dict | None = None):
+        """Buduje indeks od nowa
+        Args:
+            songs: ścieżki względne piosenek
+            metadata (dict | None): ścieżka -> {"title", "artist", "album", ...}"""
+        metadata = metadata or {}
+        postings, entries = {}, {}
+        for song in songs:
+            entry = self._make_entry(song, metadata.get(song))
+            entries[song] = entry
+            for token in entry.tokens:
+                postings.setdefault(token, set()).add(song)
+        with self._lock:
+            self._postings, self._entries = postings, entries
+            self._words = sorted(postings)
+
+    @staticmethod
+    def _make_entry(song: str, meta: dict | None) -> _Entry:
+        *dirs, name = song.split("/")
+        name_tokens = set(tokenize(name.rsplit(".", 1)[0]))
+        tokens = set(name_tokens)
+        for part in dirs:
+            tokens.update(tokenize(part))
+        if meta:
+            title = meta.get("title")
+            if title:
+                name_tokens.update(tokenize(title))
+            for key in ("title", "artist", "album"):
+                if meta.get(key):
+                    tokens.update(tokenize(meta[key]))
+            tokens |= name_tokens
+        return _Entry(frozenset(tokens), frozenset(name_tokens))
+
+    def update(self, song: str, meta: dict | None = None):
+        """Dodaje piosenkę albo odświeża jej słowa, np. po odczytaniu metadanych"""
+        entry = self._make_entry(song, meta)
+        with self._lock:
+            self._remove(song)
+            self._entries[song] = entry
+            for token in entry.tokens:
+                songs = self._postings.get(token)
+                if songs is None:
+                    songs = self._postings[token] = set()
+                    bisect.insort(self._words, token)
+                songs.add(song)
+
+    def remove(self, song: str):
+        with self._lock:
+            self._remove(song)
+
+    def _remove(self, song: str):
+        entry = self._entries.pop(song, None)
+        if entry is None:
+            return
+        for token in entry.tokens:
+            songs = self._postings.get(token)
+            if songs is None:
+                continue
+            songs.discard(song)
+            if not songs:
+                del self._postings[token]
+                i = bisect.bisect_left(self._words, token)
+                if i < len(self._words) and self._words[i] == token:
+                    del self._words[i]
+
+    def _prefix_range(self, prefix: str) -> tuple[int, int]:
+        lo = bisect.bisect_left(self._words, prefix)
+        hi = bisect.bisect_left(self._words, prefix + "\U0010ffff", lo)
+        return lo, hi
+
+    def search(self, query: str, limit: int = 20, accept=None) -> list[str]:
+        """Piosenki, w których każde słowo zapytania jest początkiem jakiegoś słowa
+        Args:
+            query (str): np. "lodz kaz" znajdzie "Kazik/Łódź.mp3"
+            limit (int): maksymalna liczba wyników
+            accept: opcjonalny warunek piosenki, np. obecność w albumie
+        Returns:
+            list[str]: ścieżki od najlepiej pasującej"""
+        terms = sorted(set(tokenize(query)), key=len, reverse=True)
+        if not terms or limit <= 0:
+            return []
+        with self._lock:
+            ranges = {term: self._prefix_range(term) for term in terms}
+            if any(lo == hi for lo, hi in ranges.values()):
+                return []
+            # zbieranie zaczyna słowo z najmniejszą liczbą piosenek
+            driver = min(terms, key=lambda term: self._estimate(*ranges[term]))
+            lo, hi = ranges[driver]
+            # pozostałe słowa jako zbiory pasujących słów, sprawdzenie to isdisjoint w C
+            others = [frozenset(self._words[lo:hi]) if hi - lo <= _COUNTED else term
+                      for term, (lo, hi) in ranges.items() if term != driver]
+            words = self._words[lo:hi]
+            if driver in self._postings:
+                # dokładne słowo przed dłuższymi
+                words.remove(driver)
+                words.insert(0, driver)
+            found = {}
+            enough = max(limit, _SEARCHED)
+            for word in words:
+                for song in self._postings[word]:
+                    if song in found:
+                        continue
+                    entry = self._entries[song]
+                    if not all(self._matches(entry, other) for other in others):
+                        continue
+                    if accept is not None and not accept(song):
+                        continue
+                    found[song] = self._score(entry, terms, song)
+                    if len(found) >= enough:
+                        break
+                if len(found) >= enough:
+                    break
+        return sorted(found, key=found.get)[:limit]
+
+    @staticmethod
+    def _matches(entry: _Entry, other) -> bool:
+        if isinstance(other, frozenset):
+            return not entry.tokens.isdisjoint(other)
+        return any(token.startswith(other) for token in entry.tokens)
+
+    def _estimate(self, lo: int, hi: int) -> int:
+        """Liczba piosenek dla słów z zakresu, dla bardzo szerokich zakresów zawyżona"""
+        if hi - lo > _COUNTED:
+            return len(self._entries) + hi - lo
+        return sum(len(self._postings[word]) for word in self._words[lo:hi])
+
+    @staticmethod
+    def _score(entry: _Entry, terms, song: str) -> tuple:
+        """Mniejszy wynik - lepsze dopasowanie: całe słowa, nazwa pliku, krótsza ścieżka"""
+        exact = sum(term in entry.tokens for term in terms)
+        in_name = sum(any(token.startswith(term) for token in entry.name_tokens) for term in terms)
+        return (-exact, -in_name, len(song), song)
@@ -13,6 +13,21 @@ class Player():
 	"""Ustawiona głośność, default 50"""
 	name_song = ""
 	index_song = 0
+	progress_interval = 1.0
+	"""Co ile sekund najczęściej wysyłać klientom pozycję odtwarzania"""
+	gapless = True
+	"""Dopisywanie następnej piosenki do playlisty mpv zawczasu (bez przerwy między utworami)"""
+	preread_bytes = 1024 * 1024
+	"""Ile bajtów z początku następnej piosenki wczytać zawczasu"""
+	history_size = 200
+	"""Ile ostatnio odtworzonych piosenek pamiętać dla przycisku "poprzednia" """
+
+
+class zones():
+	"""Dodatkowe strefy odtwarzania obok głównej, każda z własnym mpv, albumem i głośnością"""
+	devices = {}
+	"""nazwa strefy -> wyjście audio mpv (audio-device) albo None dla domyślnego,
+	np. {"kuchnia": "alsa/plughw:1"}. Strefa jest dostępna pod /zones/<nazwa>/"""
 
 
 class paths():
@@ -22,8 +37,107 @@ class paths():
 	
 	music_location = "/data/data/com.termux/files/home/storage/music"
 
+class stream():
+	"""Ustawienia kanału zdarzeń /stream (SSE)"""
+	queue_size = 64
+	"""Maksymalna liczba zdarzeń czekających w kolejce jednego klienta"""
+	history_size = 256
+	"""Liczba ostatnich zdarzeń trzymanych do powtórzenia po Last-Event-ID"""
+	merged_types = ("song", "volume", "random", "progress", "library_status")
+	"""Zdarzenia z pełnym stanem, nowsze zastępuje czekające starsze. Pozostałe (np. library_update,
+	zmiany albumu od wersji bazowej) trafiają do klienta wszystkie, po kolei"""
+	heartbeat = 15
+	"""Co ile sekund wysyłać komentarz podtrzymujący połączenie"""
+	retry_ms = 3000
+	"""Po ilu ms przeglądarka ma się ponownie połączyć"""
+
+class scan():
+	"""Ustawienia skanowania katalogu z muzyką"""
+	workers = 4
+	"""Liczba wątków skanujących katalogi najwyższego poziomu"""
+	mtime_granularity = 2
+	"""Dokładność mtime w sekundach (FAT na karcie SD: 2 s), młodsze wpisy są skanowane ponownie"""
+
+class watch():
+	"""Ustawienia obserwowania katalogu z muzyką (inotify)"""
+	enabled = True
+	coalesce = 1.0
+	"""Po ilu sekundach ciszy zmiany są wysyłane do biblioteki jedną paczką"""
+	max_delay = 5.0
+	"""Najdłuższe opóźnienie paczki przy ciągłych zmianach, np. kopiowaniu albumu"""
+	poll_interval = 300
+	"""Co ile sekund skanować katalog, gdy inotify jest niedostępne (brak limitu obserwacji)"""
+
+class metadata():
+	"""Ustawienia odczytu metadanych w tle"""
+	workers = 2
+	"""Liczba procesów czytających nagłówki plików"""
+	batch_size = 64
+	"""Liczba plików w jednym zleceniu dla procesu"""
+	nice = 10
+	"""O ile obniżyć priorytet procesów roboczych"""
+	start_method = "spawn"
+	"""Sposób tworzenia procesów, spawn nie kopiuje wątków serwera ani mpv"""
+
+class dedup():
+	"""Wyszukiwanie duplikatów po zawartości pliku, w tle po skanowaniu"""
+	enabled = True
+	edge_bytes = 64 * 1024
+	"""Ile bajtów z początku i z końca pliku hashować w pierwszym etapie"""
+	workers = 2
+	"""Liczba procesów liczących hashe"""
+	batch_size = 32
+	nice = 10
+	start_method = "spawn"
+
+class tag_edit():
+	"""Zmiany tagów: najpierw w pamięci, do bazy zapisywane w tle"""
+	flush_delay = 2.0
+	"""Po ilu sekundach bez zmian tagi są zapisywane do bazy"""
+	max_delay = 10.0
+	"""Najdłuższe opóźnienie zapisu przy ciągłych zmianach"""
+	export_json = False
+	"""Przy wyjściu z programu eksportuje bibliotekę do info_file (cały plik od nowa), danymi zarządza baza"""
+	max_ops = 10000
+	"""Najwięcej operacji w jednym POST /tags (operacja na katalogu liczy się jako jedna)"""
+
+class assets():
+	"""Pliki statyczne (script.js, style.css) z hashem w nazwie"""
+	max_age = 31536000
+	"""Czas przechowywania w przeglądarce, nazwa zmienia się razem z zawartością"""
+	min_size = 512
+	"""Mniejsze pliki nie są kompresowane"""
+	gzip_level = 9
+	brotli_quality = 11
+
+class log():
+	"""Ustawienia logowania, zapis do pliku robi osobny wątek"""
+	file = "app.log"
+	max_bytes = 1024 * 1024
+	"""Po przekroczeniu rozmiaru plik jest przenoszony do app.log.1"""
+	backups = 3
+	level = "INFO"
+	"""Poziom domyślny, dla podsystemów z levels ustawiany osobno"""
+	levels = {
+		"music_serwer": "INFO",
+		"scripts.lib_mpv_player": "INFO",
+		"scripts.async_server": "INFO",
+		"scripts.library_watcher": "INFO",
+		"werkzeug": "WARNING",
+	}
+	console = True
+	"""Czy kopiować logi na konsolę (zastępuje print)"""
+	rate = 5.0
+	"""Ile komunikatów na sekundę z tego samego miejsca w kodzie przepuszczać (poniżej WARNING)"""
+	burst = 20
+	"""Ile takich komunikatów może przejść naraz, zanim zacznie działać limit"""
+
 class server():
 	port = 8000
+	mode = "async"
+	""""async" - serwer asyncio, klient /stream to korutyna zamiast wątku, "flask" - serwer wątkowy Flask"""
+	workers = 8
+	"""Liczba wątków obsługujących zapytania Flask w trybie async"""
 	_address = None # "192.168.0.106"
 	@classmethod
 	def get_address(cls):
@@ -36,9 +150,13 @@ class server():
 		"""Adres np: 192.168.0.106"""
 		if cls._address is None:
 			s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+			s.settimeout(1)
 			try:
 				s.connect(("8.8.8.8", 80))
 				cls._address = s.getsockname()[0]
+			except OSError:
+				# brak sieci, serwer i tak działa lokalnie
+				return "127.0.0.1"
 			finally:
 				s.close()
 		return cls._address
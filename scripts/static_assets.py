@@ -0,0 +1,96 @@
+"""Pliki statyczne z hashem zawartości w nazwie i wersjami skompresowanymi przy starcie"""
+import os
+import gzip
+import hashlib
+import logging
+import mimetypes
+
+from scripts.settings import assets
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+class _Asset:
+    __slots__ = ("name", "hashed", "mimetype", "etag", "variants")
+
+    def __init__(self, name, hashed, mimetype, etag, variants):
+        self.name = name
+        self.hashed = hashed
+        self.mimetype = mimetype
+        self.etag = etag
+        self.variants = variants
+        """kodowanie ("br", "gzip", "identity") -> bajty, od najmniejszego"""
+
+
+class StaticAssets:
+    """Wczytuje katalog static raz, przy starcie.
+
+    Każdy plik dostaje nazwę z hashem zawartości (script.3f2a9c1b04de.js),
+    więc przeglądarka może go trzymać bez sprawdzania (immutable), a po zmianie
+    pliku strona i tak odwołuje się do nowej nazwy. Wersje gzip i brotli
+    (jeśli moduł brotli jest zainstalowany) są liczone raz, nie przy każdym zapytaniu."""
+
+    def __init__(self, static_dir: str):
+        self.static_dir = static_dir
+        self._by_name: dict[str, _Asset] = {}
+        self._by_hashed: dict[str, _Asset] = {}
+
+    def build(self):
+        """Wczytuje i kompresuje wszystkie pliki z katalogu static"""
+        by_name, by_hashed = {}, {}
+        for root, _, files in os.walk(self.static_dir):
+            for file in files:
+                path = os.path.join(root, file)
+                name = os.path.relpath(path, self.static_dir).replace("\\", "/")
+                with open(path, "rb") as f:
+                    data = f.read()
+                asset = self._make(name, data)
+                by_name[name] = by_hashed[asset.hashed] = asset
+        self._by_name, self._by_hashed = by_name, by_hashed
+        logger.info("Pliki statyczne: %d, brotli: %s", len(by_name), brotli is not None)
+        return self
+
+    @staticmethod
+    def _make(name: str, data: bytes) -> _Asset:
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        base, ext = os.path.splitext(name)
+        mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        variants = {"identity": data}
+        if len(data) >= assets.min_size:
+            compressed = gzip.compress(data, assets.gzip_level, mtime=0)
+            if len(compressed) < len(data):
+                variants["gzip"] = compressed
+            if brotli is not None:
+                compressed = brotli.compress(data, quality=assets.brotli_quality)
+                if len(compressed) < len(data):
+                    variants["br"] = compressed
+        variants = dict(sorted(variants.items(), key=lambda item: len(item[1])))
+        return _Asset(name, f"{base}.{digest}{ext}", mimetype, digest, variants)
+
+    def url(self, name: str) -> str:
+        """Adres pliku z hashem w nazwie, /assets/script.<hash>.js
+        Args:
+            name (str): ścieżka w katalogu static, np. script.js"""
+        asset = self._by_name.get(name)
+        return "/assets/" + (asset.hashed if asset is not None else name)
+
+    def get(self, hashed: str, accept_encoding: str = ""):
+        """Wybiera najmniejszą wersję, którą klient przyjmie
+        Args:
+            hashed (str): nazwa z hashem
+            accept_encoding (str): nagłówek Accept-Encoding
+        Returns:
+            tuple | None: (plik, kodowanie, bajty) albo None dla nieznanej nazwy"""
+        asset = self._by_hashed.get(hashed)
+        if asset is None:
+            return None
+        accepted = {part.split(";")[0].strip() for part in accept_encoding.lower().split(",")}
+        for encoding, data in asset.variants.items():
+            if encoding == "identity" or encoding in accepted:
+                return asset, encoding, data
+        return asset, "identity", asset.variants["identity"]
@@ -0,0 +1,139 @@
+"""Zapytania o tagi: AND / OR / NOT i nawiasy
+
+Przykłady:
+    rock
+    rock OR jazz
+    rock AND NOT live
+    (rock | jazz) !live
+    "hip hop" & polskie
+
+Sąsiednie wyrażenia bez operatora są łączone przez AND.
+Zapytanie jest wykonywane na indeksie odwrotnym tag -> zbiór piosenek,
+więc koszt zależy od liczby piosenek z danymi tagami, a nie od całej biblioteki.
+"""
+import re
+
+_TOKEN = re.compile(r'\s*(?:(\()|(\))|(&&?|\|\|?|!|-(?=[\s("!\w]))|"([^"]*)"|([^\s()&|!"]+))')
+_KEYWORDS = {"AND": "&", "OR": "|", "NOT": "!"}
+
+
+class TagQueryError(ValueError):
+    """Niepoprawne zapytanie o tagi"""
+
+
+def tokenize(query: str):
+    """Dzieli zapytanie na tokeny: ("op", "&"|"|"|"!"|"("|")") lub ("tag", nazwa)"""
+    tokens = []
+    pos = 0
+    query = query.strip()
+    while pos < len(query):
+        match = _TOKEN.match(query, pos)
+        if not match or match.end() == pos:
+            raise TagQueryError(f"Niepoprawny znak na pozycji {pos}: {query[pos:]!r}")
+        pos = match.end()
+        lpar, rpar, op, quoted, word = match.groups()
+        if lpar or rpar:
+            tokens.append(("op", lpar or rpar))
+        elif op:
+            tokens.append(("op", "!" if op == "-" else op[0]))
+        elif quoted is not None:
+            tokens.append(("tag", quoted))
+        elif word.upper() in _KEYWORDS:
+            tokens.append(("op", _KEYWORDS[word.upper()]))
+        else:
+            tokens.append(("tag", word))
+    return tokens
+
+
+def parse(query: str):
+    """Zamienia zapytanie na drzewo: ("tag", nazwa), ("not", x), ("and", [..]), ("or", [..])"""
+    tokens = tokenize(query)
+    if not tokens:
+        raise TagQueryError("Puste zapytanie")
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else (None, None)
+
+    def parse_or():
+        nonlocal pos
+        items = [parse_and()]
+        while peek() == ("op", "|"):
+            pos += 1
+            items.append(parse_and())
+        return items[0] if len(items) == 1 else ("or", items)
+
+    def parse_and():
+        nonlocal pos
+        items = [parse_not()]
+        while True:
+            kind, value = peek()
+            if (kind, value) == ("op", "&"):
+                pos += 1
+            elif not (kind == "tag" or value in ("(", "!")):
+                break
+            items.append(parse_not())
+        return items[0] if len(items) == 1 else ("and", items)
+
+    def parse_not():
+        nonlocal pos
+        kind, value = peek()
+        if (kind, value) == ("op", "!"):
+            pos += 1
+            return ("not", parse_not())
+        if (kind, value) == ("op", "("):
+            pos += 1
+            node = parse_or()
+            if peek() != ("op", ")"):
+                raise TagQueryError("Brak nawiasu zamykającego")
+            pos += 1
+            return node
+        if kind == "tag":
+            pos += 1
+            return ("tag", value)
+        raise TagQueryError(f"Oczekiwano tagu, jest: {value!r}")
+
+    node = parse_or()
+    if pos != len(tokens):
+        raise TagQueryError(f"Nadmiarowy token: {tokens[pos][1]!r}")
+    return node
+
+
+def evaluate(node, index: dict[str, set], universe):
+    """Wykonuje zapytanie na indeksie odwrotnym
+    Args:
+        node: drzewo z parse()
+        index (dict[str, set]): tag -> zbiór piosenek
+        universe: wszystkie piosenki (set lub dict.keys()), potrzebne tylko dla samego NOT
+    Returns:
+        set: piosenki spełniające zapytanie"""
+    kind = node[0]
+    if kind == "tag":
+        return set(index.get(node[1], ()))
+    if kind == "or":
+        result = set()
+        for item in node[1]:
+            result |= evaluate(item, index, universe)
+        return result
+    if kind == "not":
+        return set(universe) - evaluate(node[1], index, universe)
+    # AND: najpierw przecięcie od najmniejszego zbioru, potem odejmowanie negacji
+    positives = [evaluate(item, index, universe) for item in node[1] if item[0] != "not"]
+    negatives = [item[1] for item in node[1] if item[0] == "not"]
+    if positives:
+        positives.sort(key=len)
+        result = positives[0]
+        for other in positives[1:]:
+            result &= other
+    else:
+        result = set(universe)
+    for item in negatives:
+        if not result:
+            break
+        result -= evaluate(item, index, universe)
+    return result
+
+
+def query(text: str, index: dict[str, set], universe) -> set:
+    """parse() + evaluate()"""
+    return evaluate(parse(text), index, universe)
@@ -0,0 +1,108 @@
+"""Zapis zmian tagów w tle: zapytanie zmienia bibliotekę w pamięci, baza dostaje zmiany paczkami"""
+import time
+import logging
+import threading
+
+from scripts.settings import tag_edit
+
+logger = logging.getLogger(__name__)
+
+
+class TagWriter:
+    """Opóźniony zapis (write-behind) zmian tagów.
+
+    add() tylko dopisuje zmiany i wraca, nie czeka na dysk. Wątek zapisuje
+    zebrane zmiany jedną transakcją, gdy przez tag_edit.flush_delay sekund
+    nic się nie zmieni (najdłużej tag_edit.max_delay od pierwszej
+    niezapisanej zmiany), oraz przy close(). Kolejne zmiany tej samej pary
+    (piosenka, tag) są scalane, zapisywana jest ostatnia."""
+
+    def __init__(self, write):
+        """
+        Args:
+            write: funkcja zapisująca, wywoływana z listami (ścieżka, tag) dodanych i usuniętych tagów"""
+        self.write = write
+        self.stats = {"queued": 0, "written": 0, "flushes": 0, "errors": 0}
+        self._pending: dict[tuple[str, str], bool] = {}
+        """(ścieżka, tag) -> True dodany, False usunięty"""
+        self._first = None
+        self._last = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        """Jeden zapis naraz, zapisy w kolejności zmian"""
+        self._thread = threading.Thread(target=self._run, name="tag-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        """Liczba zmian czekających na zapis"""
+        return len(self._pending)
+
+    def add(self, changes):
+        """Dopisuje zmiany do zapisu w tle, po close() zapisuje od razu
+        Args:
+            changes: lista (ścieżka, tag, dodany)"""
+        with self._cond:
+            count = 0
+            for path, tag, added in changes:
+                self._pending[(path, tag)] = added
+                count += 1
+            if not count:
+                return
+            self._last = time.monotonic()
+            if self._first is None:
+                self._first = self._last
+            self.stats["queued"] += count
+            self._cond.notify()
+            closed = self._closed
+        if closed:
+            self.flush()
+
+    def _due(self) -> float:
+        return min(self._last + tag_edit.flush_delay, self._first + tag_edit.max_delay)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and (self._first is None or time.monotonic() < self._due()):
+                    self._cond.wait(None if self._first is None else self._due() - time.monotonic())
+                if self._closed:
+                    return
+            self.flush()
+
+    def flush(self) -> int:
+        """Zapisuje od razu wszystkie zebrane zmiany
+        Returns:
+            int: liczba zapisanych zmian, 0 także przy błędzie zapisu (zmiany czekają na kolejną próbę)"""
+        with self._write_lock:
+            with self._cond:
+                pending, self._pending = self._pending, {}
+                self._first = self._last = None
+            if not pending:
+                return 0
+            added = [key for key, add in pending.items() if add]
+            removed = [key for key, add in pending.items() if not add]
+            try:
+                self.write(added, removed)
+            except Exception as e:
+                with self._cond:
+                    # zmiany dopisane w czasie zapisu są nowsze
+                    pending.update(self._pending)
+                    self._pending = pending
+                    self._first = self._last = time.monotonic()
+                self.stats["errors"] += 1
+                logger.error("Nie udało się zapisać %d zmian tagów: %s", len(pending), e)
+                return 0
+            self.stats["written"] += len(pending)
+            self.stats["flushes"] += 1
+            logger.debug("Zapisano %d zmian tagów", len(pending))
+            return len(pending)
+
+    def close(self):
+        """Zatrzymuje wątek i zapisuje zaległe zmiany, wywoływane przy zamykaniu programu"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
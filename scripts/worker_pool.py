@@ -0,0 +1,107 @@
+"""Pula procesów roboczych do pracy w tle (metadane, hashe duplikatów), zlecenia paczkami"""
+import os
+import sys
+import logging
+import threading
+import contextlib
+import multiprocessing
+from multiprocessing.context import SpawnContext, SpawnProcess
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+logger = logging.getLogger(__name__)
+
+
+def _init_worker(nice: int):
+    """Procesy robocze mają niższy priorytet, żeby nie przeszkadzać w odtwarzaniu"""
+    try:
+        os.nice(nice)
+    except (AttributeError, OSError):
+        pass
+
+
+_main_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _light_main():
+    """Proces tworzony przez spawn wykonuje od nowa skrypt główny, czyli cały serwer
+    (Flask, kompresja plików statycznych, strefy). Funkcje robocze są w modułach
+    bez importu serwera, więc tylko na czas uruchamiania procesu skrypt główny
+    (także uruchomiony przez -m) wskazuje ten moduł, potem wraca poprzedni stan."""
+    main = sys.modules.get("__main__")
+    if main is None or not getattr(main, "__file__", None):
+        yield
+        return
+    with _main_lock:
+        missing = "__spec__" not in vars(main)
+        spec = getattr(main, "__spec__", None)
+        main.__spec__ = sys.modules[__name__].__spec__
+        try:
+            yield
+        finally:
+            if missing:
+                del main.__spec__
+            else:
+                main.__spec__ = spec
+
+
+class _LightProcess(SpawnProcess):
+    """Proces spawn, który wczytuje ten moduł zamiast skryptu głównego"""
+
+    def start(self):
+        with _light_main():
+            super().start()
+
+
+class _LightContext(SpawnContext):
+    """Kontekst spawn dla puli, z procesami _LightProcess"""
+    Process = _LightProcess
+
+
+def _context(start_method: str):
+    """Kontekst procesów puli, dla spawn bez wykonywania skryptu głównego"""
+    return _LightContext() if start_method == "spawn" else multiprocessing.get_context(start_method)
+
+
+def process_pool(workers: int, start_method: str, nice: int, name: str = ""):
+    """Pula procesów, a gdy platforma jej nie obsługuje (np. Android bez sem_open) - jeden wątek
+    Args:
+        name (str): do komunikatu, co będzie wykonywane w wątku"""
+    try:
+        return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(nice,),
+                                   mp_context=_context(start_method))
+    except (ImportError, NotImplementedError, OSError, ValueError) as e:
+        logger.warning("Pula procesów niedostępna (%s), %s w wątku", e, name or "zadania")
+        return ThreadPoolExecutor(max_workers=1)
+
+
+def run_batches(func, items: list, on_result, settings, workers: int | None = None, stop=None, name: str = ""):
+    """Wykonuje func(paczka) dla kolejnych paczek items w puli procesów
+    Args:
+        func: funkcja z modułu bez importu serwera (np. functools.partial), wynik musi dać się przesłać
+        on_result: funkcja wywoływana w bieżącym wątku z wynikiem każdej paczki, w kolejności ukończenia
+        settings: klasa ustawień z batch_size, workers, nice i start_method
+        stop (threading.Event | None): przerywa wysyłanie kolejnych paczek
+    Returns:
+        bool: False, jeśli przerwane przez stop"""
+    workers = workers or settings.workers
+    size = settings.batch_size
+    batches = (items[i:i + size] for i in range(0, len(items), size))
+    stopped = False
+    with process_pool(workers, settings.start_method, settings.nice, name) as pool:
+        pending = set()
+        for batch in batches:
+            if stop is not None and stop.is_set():
+                stopped = True
+                break
+            pending.add(pool.submit(func, batch))
+            # ograniczona liczba zleceń w locie, żeby nie trzymać w pamięci całej kolejki
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    on_result(future.result())
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                on_result(future.result())
+    return not stopped
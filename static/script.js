@@ -1,5 +1,7 @@
 
 const API_URL = document.body.dataset.apiUrl;
+// Prefiks adresów strefy: "" dla głównej, "/zones/<nazwa>" dla pozostałych
+const ZONE_BASE = document.body.dataset.zoneBase || "";
 console.log("Script loaded");
 console.log("API_URL from data attribute:", document.body.dataset.apiUrl);
 console.log("Full API URL:", API_URL);
@@ -16,8 +18,14 @@ const volumeSlider = document.getElementById('volumeSlider');
 const volumeValue = document.getElementById('volumeValue');
 const rndButton = document.getElementById('rndBtn');
 const currentSongEl = document.getElementById("currentSong"); 
+const progressEl = document.getElementById("progress");
+
+const listenBtn = document.getElementById("listenBtn");
+const localPlayer = document.getElementById("localPlayer");
 
 let volumeChangeTimeout = null;
+// Ścieżka aktualnej piosenki w bibliotece, do odtworzenia przez /media
+let currentPath = initialState.currentSong || "";
 
 // Uaktualnij UI
 currentSongEl.textContent = initialState.currentSong || "Brak";
@@ -55,6 +63,14 @@ function updateRandomButton(isRandom) {
 }
 
 
+// Czas w sekundach jako m:ss
+function formatTime(seconds) {
+  if (seconds === null || seconds === undefined) return "0:00";
+  const s = Math.floor(seconds);
+  return `${Math.floor(s / 60)}:${String(s % 60).padStart(2, "0")}`;
+}
+
+
 function setBusy(busy) {
   buttons.forEach(b => b.disabled = busy);
 }
@@ -65,14 +81,30 @@ function log(msg, cls = "") {
 }
 
 
-const evtSource = new EventSource("/stream");
+// Odtwarzanie aktualnej piosenki w przeglądarce, przewijanie działa przez zapytania Range
+function playHere() {
+  if (!currentPath) return;
+  localPlayer.src = "/media/" + currentPath.split("/").map(encodeURIComponent).join("/");
+  localPlayer.play().catch(err => log("Nie można odtworzyć: " + err, "err"));
+}
+listenBtn.addEventListener("click", playHere);
+
+
+const evtSource = new EventSource(ZONE_BASE + "/stream");
 evtSource.onmessage = (event) => {
   const data = JSON.parse(event.data);
   // Odbiera wiadomosc z serwera
 
   if (data.type === "song") {
-	  currentSongEl.textContent = data.value;
+	  const meta = data.meta;
+	  currentSongEl.textContent = (meta && meta.title)
+		  ? (meta.artist ? `${meta.artist} - ${meta.title}` : meta.title)
+		  : data.value;
 	  log("Odtwarzana piosenka: " + data.value, "ok");
+	  if (data.path) {
+		  currentPath = data.path;
+		  if (!localPlayer.paused) playHere();
+	  }
   }
 
   if (data.type === "volume") {
@@ -80,6 +112,10 @@ evtSource.onmessage = (event) => {
 	  volumeValue.textContent = data.value;
 	  log("Nowa głośność: " + data.value + "%", "ok");
   }
+  if (data.type === "progress") {
+      const p = data.value;
+      progressEl.textContent = `${formatTime(p.time)} / ${formatTime(p.duration)}` + (p.pause ? " (pauza)" : "");
+  }
   if (data.type === "random") {
       if (rndButton) {
         rndButton.textContent = data.value ? "Random ON" : "Random OFF";
@@ -87,32 +123,34 @@ evtSource.onmessage = (event) => {
         log("ustawiono random: " + data.value, "ok");
       }
     }
+  if (data.type === "library_status") {
+      const status = data.value;
+      log("Biblioteka: " + status.state + (status.songs !== undefined ? ` (${status.songs} piosenek)` : ""), "ok");
+  }
   if (data.type === "library_update") {
-    const songListEl = document.getElementById("songList");
-    songListEl.innerHTML = "";
-
-    data.value.forEach((song, index) => {
-        const li = document.createElement("li");
-        li.textContent = song;
-        li.style.cursor = "pointer";
-
-        // klikniecie w piosenkę - wysłanie do serwera
-        li.addEventListener("click", () => sendSelectedSong(song, index));
-
-        songListEl.appendChild(li);
-    });
-
-    log("Pobrano informacje o albumie", "ok");
+    const value = data.value;
+    // Różnica pasuje tylko do wersji, którą mamy - w innym wypadku pobieramy album od nowa
+    if (value.full || value.base !== albumVersion) {
+        fetchAlbum();
+    } else {
+        applyLibraryDelta(value);
+        renderAlbum();
+        log("Zaktualizowano album", "ok");
+    }
 }
 
 };
 
 evtSource.onerror = (err) => {
   log("Błąd połączenia z /stream: " + err, "err");
-  // Próba ponownego połączenia po 3 sekundach
-  setTimeout(() => {
-    location.reload();
-  }, 3000);
+  // EventSource sam łączy się ponownie i wysyła Last-Event-ID,
+  // serwer dośle wtedy zdarzenia, które nas ominęły.
+  // Przeładowanie tylko gdy przeglądarka zrezygnowała z połączenia.
+  if (evtSource.readyState === EventSource.CLOSED) {
+    setTimeout(() => {
+      location.reload();
+    }, 3000);
+  }
 };
 
 // Obsługa zmiany głośności
@@ -130,7 +168,7 @@ volumeSlider.addEventListener('input', (e) => {
 // wysyłanie wybranej piosenki
 async function sendSelectedSong(song, index) {
     try {
-        const res = await fetch("/wybrana-piosenka", {
+        const res = await fetch(ZONE_BASE + "/wybrana-piosenka", {
             method: "POST",
             headers: { "Content-Type": "application/json" },
             body: JSON.stringify({ title: song, index: index })
@@ -148,6 +186,65 @@ async function sendSelectedSong(song, index) {
     }
 }
 
+// Budowanie albumu z zapytania o tagi
+async function sendTagQuery(query) {
+    try {
+        const res = await fetch(ZONE_BASE + "/playlist", {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ query: query })
+        });
+        const resp = await res.json();
+        if (!res.ok) {
+            log(`Błędne zapytanie: ${resp.error}`, "err");
+            return;
+        }
+        log(`Album z zapytania "${resp.query}": ${resp.count} piosenek`, "ok");
+    } catch (err) {
+        console.error("blad:", err);
+        log(`Błąd zapytania: ${err.message}`, "err");
+    }
+}
+
+document.getElementById("tagQueryBtn").addEventListener("click", () => {
+    sendTagQuery(document.getElementById("tagQuery").value);
+});
+
+// Wyszukiwanie w trakcie pisania, odpowiedź na nieaktualne zapytanie jest pomijana
+const searchInput = document.getElementById("searchInput");
+const searchResultsEl = document.getElementById("searchResults");
+let searchTimeout = null;
+let searchSeq = 0;
+
+async function runSearch(query) {
+    const seq = ++searchSeq;
+    if (!query.trim()) {
+        searchResultsEl.replaceChildren();
+        return;
+    }
+    try {
+        const res = await fetch(`${ZONE_BASE}/search?album=1&limit=20&q=${encodeURIComponent(query)}`);
+        if (!res.ok || seq !== searchSeq) return;
+        const data = await res.json();
+        const fragment = document.createDocumentFragment();
+        data.items.forEach(song => {
+            const li = document.createElement("li");
+            li.textContent = song;
+            li.style.cursor = "pointer";
+            li.addEventListener("click", () => sendSelectedSong(song, albumSongs.indexOf(song)));
+            fragment.appendChild(li);
+        });
+        searchResultsEl.replaceChildren(fragment);
+    } catch (err) {
+        console.error("blad wyszukiwania:", err);
+    }
+}
+
+searchInput.addEventListener("input", (e) => {
+    clearTimeout(searchTimeout);
+    searchTimeout = setTimeout(() => runSearch(e.target.value), 80);
+});
+
 // Funkcja do wysyłania zmiany głośności
 async function changeVolume(volume) {
 	setBusy(true);
@@ -211,48 +308,89 @@ async function sendCommand(buttonId) {
   }
 }
 
-// Funkcja do pobierania informacji o albumie
-async function fetchAlbum() {
-    try {
-        const res = await fetch("/album", { method: "GET" });
-        if (!res.ok) {
-            log(`blad pobrania albumu: ${res.status}`, "err");
-            return;
-        }
-        const data = await res.json();  // ["aaa", "bbb", "ccc"]
-        console.log("Otrzymano dane albumu:", data);
+// Album po stronie klienta, aktualizowany różnicami z /stream
+let albumSongs = [];
+let albumVersion = null;
+let albumFetching = false;
+let albumRefetch = false;
+const ALBUM_PAGE_SIZE = 500;
 
-        // Wy?wietlenie listy piosenek
-        const songListEl = document.getElementById("songList");
-        songListEl.innerHTML = "";
+// Wyświetlenie listy piosenek
+function renderAlbum() {
+    const songListEl = document.getElementById("songList");
+    const fragment = document.createDocumentFragment();
+    albumSongs.forEach((song, index) => {
+        const li = document.createElement("li");
+        li.textContent = song;
+        li.style.cursor = "pointer";
 
-        data.forEach((song, index) => {
-            const li = document.createElement("li");
-            li.textContent = song;
-            li.style.cursor = "pointer";
+        // klikniecie w piosenkę - wysłanie do serwera
+        li.addEventListener("click", () => sendSelectedSong(song, index));
 
-            // Obsluga klikniecia w piosenk
-            li.addEventListener("click", () => {
-                console.log("Wybrano:", song);
-
-                // informacja do serwera o wybranej piosence
-                fetch("/wybrana-piosenka", {
-                    method: "POST",
-                    headers: { "Content-Type": "application/json" },
-                    body: JSON.stringify({ title: song, index: index })
-                })
-                .then(res => res.json())
-                .then(resp => console.log("dostarczono", resp.status))
-                .catch(err => console.error("blad przy wysylaniu", err));
-            });
-
-            songListEl.appendChild(li);
-        });
+        fragment.appendChild(li);
+    });
+    songListEl.replaceChildren(fragment);
+}
 
+// Odtwarza nową wersję albumu z różnicy (jak library_delta.apply na serwerze)
+function applyLibraryDelta(delta) {
+    const removed = new Set(delta.remove || []);
+    let songs = albumSongs.filter((_, i) => !removed.has(i));
+    if (delta.order) {
+        songs = delta.order.map(i => songs[i]);
+    }
+    (delta.insert || []).forEach(([i, song]) => songs.splice(i, 0, song));
+    albumSongs = songs;
+    albumVersion = delta.version;
+}
+
+// Funkcja do pobierania informacji o albumie, stronami
+async function fetchAlbum() {
+    if (albumFetching) {
+        albumRefetch = true;
+        return;
+    }
+    albumFetching = true;
+    try {
+        let songs = [];
+        let version = null;
+        let offset = 0;
+        let total = Infinity;
+        while (offset < total) {
+            const res = await fetch(`${ZONE_BASE}/album?offset=${offset}&limit=${ALBUM_PAGE_SIZE}`, { method: "GET" });
+            if (!res.ok) {
+                log(`blad pobrania albumu: ${res.status}`, "err");
+                return;
+            }
+            const page = await res.json();
+            if (version !== null && page.version !== version) {
+                // album zmienił się w trakcie pobierania - od początku
+                songs = [];
+                offset = 0;
+                version = null;
+                continue;
+            }
+            version = page.version;
+            total = page.total;
+            songs = songs.concat(page.items);
+            offset += page.items.length;
+            if (page.items.length === 0) {
+                break;
+            }
+        }
+        albumSongs = songs;
+        albumVersion = version;
+        renderAlbum();
         log("Pobrano informacje o albumie", "ok");
     } catch (e) {
         console.error("Fetch /album error:", e);
         log(`Błąd pobrania albumu: ${e.message}`, "err");
+    } finally {
+        albumFetching = false;
+        if (albumRefetch) {
+            albumRefetch = false;
+            fetchAlbum();
+        }
     }
 }
 
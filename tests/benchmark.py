@@ -0,0 +1,354 @@
+"""Testy wydajności na sztucznych katalogach z muzyką, bez dźwięku.
+
+Uruchomienie:
+    python tests/benchmark.py                              # 1k, 10k, 100k plików
+    python tests/benchmark.py --sizes 1000 --save base.json
+    python tests/benchmark.py --sizes 1000 --compare base.json
+
+Tryb --compare porównuje wyniki z zapisanymi i kończy się kodem 1,
+jeśli któryś pomiar jest wolniejszy o więcej niż --threshold."""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import io
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import threading
+import contextlib
+import statistics
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+FILES_PER_DIR = 100
+"""Plików w jednym katalogu albumu, po 10 albumów na wykonawcę"""
+
+
+class StubPlayer:
+    """Zastępuje LibMPVPlayer: ten sam interfejs, zapisuje polecenia zamiast odtwarzać"""
+    player = True
+    on_song_end = None
+    on_track_advance = None
+    on_progress = None
+    state = {"time": None, "duration": None, "pause": False, "volume": None}
+    commands = []
+
+    @classmethod
+    def play(cls, file_path):
+        cls.commands.append(("play", file_path))
+
+    @classmethod
+    def next(cls, file_path):
+        cls.play(file_path)
+
+    @classmethod
+    def queue_next(cls, file_path):
+        cls.commands.append(("queue", file_path))
+
+    @classmethod
+    def pause(cls):
+        cls.commands.append(("pause",))
+
+    @classmethod
+    def resume(cls):
+        cls.commands.append(("resume",))
+
+    @classmethod
+    def stop(cls):
+        cls.commands.append(("stop",))
+
+    @classmethod
+    def set_volume(cls):
+        cls.commands.append(("volume",))
+
+    @classmethod
+    def close(cls):
+        cls.commands.clear()
+
+
+def make_tree(root: str, count: int) -> str:
+    """Tworzy katalog wykonawca/album/utwór.mp3 z count pustymi plikami
+    Returns:
+        str: ścieżka katalogu z muzyką"""
+    music_dir = os.path.join(root, f"music_{count}")
+    for i in range(count):
+        album = i // FILES_PER_DIR
+        folder = os.path.join(music_dir, f"wykonawca {album // 10:04d}", f"album {album:05d}")
+        if i % FILES_PER_DIR == 0:
+            os.makedirs(folder, exist_ok=True)
+        open(os.path.join(folder, f"{i % FILES_PER_DIR:03d} utwór.mp3"), "wb").close()
+    return music_dir
+
+
+def measure(func, repeat: int = 5, number: int = 1) -> float:
+    """Najlepszy czas jednego wywołania func w sekundach"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+@contextlib.contextmanager
+def library_state(music_dir: str, work_dir: str):
+    """Ustawia MusicLibrary na sztuczny katalog i przywraca stan po pomiarach"""
+    from scripts.music_library import MusicLibrary
+    from scripts.compact_library import CompactLibrary
+    from scripts.settings import Player, scan
+    names = ("music_dir", "db_file", "info_file", "full_library", "library", "tags",
+             "tag_query", "metadata", "_metadata_keys", "_positions", "_store", "is_rnd_flag",
+             "history", "_forward", "_current", "search_index", "duplicates", "_copy_of", "unique")
+    saved = {name: getattr(MusicLibrary, name) for name in names}
+    saved_player = (Player.index_song, Player.name_song)
+    saved_granularity = scan.mtime_granularity
+    MusicLibrary.music_dir = music_dir
+    MusicLibrary.db_file = os.path.join(work_dir, "music_library.db")
+    MusicLibrary.info_file = os.path.join(work_dir, "info_music.json")
+    MusicLibrary.full_library, MusicLibrary.metadata, MusicLibrary._metadata_keys = CompactLibrary(), {}, {}
+    MusicLibrary.tags, MusicLibrary.tag_query, MusicLibrary._store = [], "", None
+    MusicLibrary._forward, MusicLibrary._current = [], None
+    MusicLibrary.search_index = type(saved["search_index"])()
+    MusicLibrary.history = type(saved["history"])(maxlen=saved["history"].maxlen)
+    # pliki są tworzone tuż przed skanowaniem, bez tego każdy katalog byłby "niepewny"
+    scan.mtime_granularity = 0
+    try:
+        yield MusicLibrary
+    finally:
+        if MusicLibrary._store is not None:
+            MusicLibrary._store.close()
+        for name, value in saved.items():
+            setattr(MusicLibrary, name, value)
+        Player.index_song, Player.name_song = saved_player
+        scan.mtime_granularity = saved_granularity
+
+
+def bench_library(lib, results: dict):
+    from scripts.settings import Player
+    start = time.perf_counter()
+    lib._find_music_files()
+    results["find_music_files_cold"] = time.perf_counter() - start
+    results["find_music_files_warm"] = measure(lib._find_music_files, repeat=3)
+    results["read_dir_library"] = measure(lib.read_dir_library, repeat=3)
+    results["do_library"] = measure(lib.do_library)
+
+    songs = list(lib.full_library)
+    for i, song in enumerate(songs[::10]):
+        lib.change_music_tags(song, "rock" if i % 2 else "jazz")
+    lib.tag_query = "rock OR jazz AND NOT live"
+    results["do_library_query"] = measure(lib.do_library)
+    lib.tag_query = ""
+    lib.do_library()
+
+    names = lib.library[::max(1, len(lib.library) // 1000)]
+    def lookups():
+        for name in names:
+            lib.get_index_song(name)
+    results["get_index_song"] = measure(lookups) / len(names)
+
+    results["shuffle_on"] = measure(lambda: lib.do_random(True), number=10)
+    results["shuffle_next"] = measure(lib.next, number=1000)
+    results["before"] = measure(lib.before, number=100)
+    lib.do_random(False)
+    Player.index_song = 0
+
+
+def bench_search(lib, results: dict):
+    """Budowa indeksu wyszukiwania i czas odpowiedzi na kolejne litery wpisywanego zapytania"""
+    results["search_build"] = measure(lambda: lib.search_index.build(lib.full_library, lib.metadata), repeat=3)
+    typed = "wykonawca 0003 utwor 05"
+    times = []
+    for end in range(1, len(typed) + 1):
+        times.append(measure(lambda: lib.search(typed[:end]), repeat=3))
+    times.sort()
+    results["search_keystroke_p50"] = statistics.median(times)
+    results["search_keystroke_max"] = times[-1]
+
+
+def bench_click(lib, results: dict, count: int = 200):
+    """Czas odpowiedzi /click (next, volume) przez aplikację Flask z StubPlayer
+    i czas wykonania zaległych poleceń po serii kliknięć"""
+    import music_serwer
+    saved = music_serwer.PlayerCtrl.mpv
+    music_serwer.PlayerCtrl.mpv = StubPlayer
+    client = music_serwer.app.test_client()
+    try:
+        for button in ("next", "volume"):
+            times = []
+            for i in range(count):
+                start = time.perf_counter()
+                res = client.post("/click", json={"button": button, "volume": i % 100})
+                times.append(time.perf_counter() - start)
+                if res.status_code != 200:
+                    raise RuntimeError(f"/click {button}: {res.status_code} {res.get_data(as_text=True)}")
+            start = time.perf_counter()
+            music_serwer.commands.wait_idle(60)
+            results[f"click_{button}_drain"] = time.perf_counter() - start
+            times.sort()
+            results[f"click_{button}_p50"] = statistics.median(times)
+            results[f"click_{button}_p95"] = times[int(len(times) * 0.95) - 1]
+    finally:
+        music_serwer.commands.wait_idle(60)
+        music_serwer.PlayerCtrl.mpv = saved
+        StubPlayer.close()
+
+
+def bench_sse(results: dict, clients: int = 50, events: int = 2000):
+    """Przepustowość EventBroadcaster: zdarzenia na sekundę doręczone wszystkim klientom"""
+    from scripts.event_broadcaster import EventBroadcaster, format_sse
+    broadcaster = EventBroadcaster(queue_size=events)
+    subscribers = [broadcaster.subscribe() for _ in range(clients)]
+    received = [0] * clients
+
+    def drain(i, sub):
+        while received[i] < events:
+            item = sub.get(1)
+            if item is None:
+                return
+            format_sse(*item)
+            received[i] += 1
+
+    threads = [threading.Thread(target=drain, args=(i, sub)) for i, sub in enumerate(subscribers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for i in range(events):
+        # różne typy, żeby zdarzenia nie były scalane w kolejkach
+        broadcaster.publish({"type": f"e{i}", "value": i})
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if sum(received) != clients * events:
+        raise RuntimeError(f"zgubione zdarzenia: {sum(received)}/{clients * events}")
+    results["sse_events_per_s"] = clients * events / elapsed
+
+
+def bench_memory(results: dict, count: int, tags_per_song: int = 2):
+    """Pamięć biblioteki z albumem na piosenkę: dict, lista i słownik pozycji
+    (poprzednia postać) oraz CompactLibrary z SongList"""
+    import tracemalloc
+    from scripts.compact_library import CompactLibrary, SongList
+
+    def rows():
+        # nowe obiekty str dla każdej piosenki, jak przy odczycie z bazy
+        for i in range(count):
+            album = i // FILES_PER_DIR
+            path = f"wykonawca {album // 10:04d}/album {album:05d}/{i % FILES_PER_DIR:03d} utwór.mp3"
+            yield path, [f"tag {(i + k) % 20}" for k in range(tags_per_song if i % 10 == 0 else 0)]
+
+    def plain():
+        library = dict(rows())
+        album = list(library)
+        return library, album, {song: i for i, song in enumerate(album)}
+
+    def compact():
+        library = CompactLibrary()
+        for path, tags in rows():
+            library[path] = tags
+        return library, SongList(library, library.ids())
+
+    for name, build in (("dict", plain), ("compact", compact)):
+        tracemalloc.start()
+        try:
+            data = build()
+            results[f"memory_{name}_bytes_per_track"] = tracemalloc.get_traced_memory()[0] / count
+        finally:
+            tracemalloc.stop()
+        del data
+
+
+HIGHER_IS_BETTER = {"sse_events_per_s"}
+
+
+def run(sizes=DEFAULT_SIZES, work_dir: str | None = None) -> dict:
+    """Wykonuje wszystkie pomiary
+    Returns:
+        dict: {"meta": {...}, "results": {"rozmiar": {"pomiar": wartość}}}"""
+    report = {
+        "meta": {"python": platform.python_version(), "machine": platform.machine(),
+                 "system": platform.system(), "time": time.strftime("%Y-%m-%d %H:%M:%S")},
+        "results": {},
+    }
+    own_dir = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix="music_bench_")
+    try:
+        for count in sizes:
+            results = {}
+            start = time.perf_counter()
+            music_dir = make_tree(work_dir, count)
+            results["make_tree"] = time.perf_counter() - start
+            with contextlib.redirect_stdout(io.StringIO()), library_state(music_dir, work_dir) as lib:
+                bench_library(lib, results)
+                bench_search(lib, results)
+                bench_click(lib, results)
+            bench_memory(results, count)
+            shutil.rmtree(music_dir, ignore_errors=True)
+            for name in ("music_library.db", "music_library.db-wal", "music_library.db-shm"):
+                with contextlib.suppress(OSError):
+                    os.remove(os.path.join(work_dir, name))
+            report["results"][str(count)] = results
+        sse = {}
+        bench_sse(sse)
+        report["results"]["sse"] = sse
+    finally:
+        if own_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+
+def compare(report: dict, baseline: dict, threshold: float = 0.25) -> list[str]:
+    """Porównuje wyniki z zapisanymi
+    Args:
+        threshold (float): dopuszczalne pogorszenie, 0.25 = 25%
+    Returns:
+        list[str]: opisy regresji, pusta lista gdy ich nie ma"""
+    regressions = []
+    for group, results in report["results"].items():
+        for name, value in results.items():
+            base = baseline.get("results", {}).get(group, {}).get(name)
+            if not base or name == "make_tree":
+                continue
+            ratio = base / value if name in HIGHER_IS_BETTER else value / base
+            if ratio > 1 + threshold:
+                regressions.append(f"{group}/{name}: {base:.6g} -> {value:.6g} ({ratio:.2f}x)")
+    return regressions
+
+
+def _print_report(report: dict):
+    for group, results in report["results"].items():
+        print(f"[{group}]")
+        for name, value in results.items():
+            unit = "/s" if name in HIGHER_IS_BETTER else " B" if name.startswith("memory_") else " s"
+            print(f"  {name:32} {value:.6g}{unit}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Testy wydajności odtwarzacza")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--save", help="zapisz wyniki jako punkt odniesienia (JSON)")
+    parser.add_argument("--compare", help="porównaj z zapisanymi wynikami (JSON)")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    report = run(args.sizes)
+    _print_report(report)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Zapisano wyniki do {args.save}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for line in regressions:
+            print("REGRESJA " + line)
+        if regressions:
+            return 1
+        print("Brak regresji")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
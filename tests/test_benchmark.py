@@ -0,0 +1,25 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import pytest
+
+
+def test_benchmark_and_compare(tmp_path):
+    from tests import benchmark
+    from scripts.music_library import MusicLibrary
+    music_dir = MusicLibrary.music_dir
+    report = benchmark.run([200], str(tmp_path))
+    results = report["results"]["200"]
+    for name in ("find_music_files_cold", "do_library", "get_index_song", "shuffle_next", "click_next_p50"):
+        if not results.get(name, 0) > 0:
+            pytest.fail(f"brak pomiaru {name}: {results}")
+    if MusicLibrary.music_dir != music_dir:
+        pytest.fail("benchmark nie przywrocil stanu biblioteki")
+
+    if benchmark.compare(report, report):
+        pytest.fail("te same wyniki nie moga byc regresja")
+    slower = {"results": {"200": {"do_library": results["do_library"] / 2},
+                          "sse": {"sse_events_per_s": report["results"]["sse"]["sse_events_per_s"] * 2}}}
+    regressions = benchmark.compare(report, slower)
+    if len(regressions) != 2:
+        pytest.fail(f"regresje nie zostaly wykryte: {regressions}")
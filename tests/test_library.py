@@ -0,0 +1,575 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import pytest
+from scripts.compact_library import CompactLibrary
+
+
+def _touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb"):
+        pass
+
+
+def test_scanner_incremental(tmp_path, monkeypatch):
+    from scripts.settings import scan
+    from scripts.library_scanner import LibraryScanner
+    monkeypatch.setattr(scan, "mtime_granularity", 0)
+    for name in ("a/1.mp3", "a/x/2.FLAC", "b/3.ogg", "b/okladka.jpg", "4.mp3"):
+        _touch(os.path.join(tmp_path, name))
+    exts = {".mp3", ".flac", ".ogg"}
+
+    scanner = LibraryScanner(str(tmp_path), exts)
+    found = scanner.scan()
+    if sorted(found) != ["4.mp3", "a/1.mp3", "a/x/2.FLAC", "b/3.ogg"]:
+        pytest.fail(f"zle znalezione pliki: {found}")
+    if scanner.stats["skipped"] != 0:
+        pytest.fail("pierwsze skanowanie nie moze niczego pominac")
+
+    os.remove(os.path.join(tmp_path, "b/3.ogg"))
+    scanner = LibraryScanner(str(tmp_path), exts, scanner.cache)
+    found = scanner.scan()
+    if "b/3.ogg" in found:
+        pytest.fail("usuniety plik nadal jest w bibliotece")
+    if scanner.stats["skipped"] != scanner.stats["dirs"] - 1:
+        pytest.fail(f"niezmienione katalogi nie zostaly pominiete: {scanner.stats}")
+
+
+def test_find_music_files_removes_deleted(tmp_path, monkeypatch):
+    from scripts.music_library import MusicLibrary
+    _touch(os.path.join(tmp_path, "music", "a.mp3"))
+    monkeypatch.setattr(MusicLibrary, "music_dir", str(tmp_path / "music"))
+    monkeypatch.setattr(MusicLibrary, "info_file", str(tmp_path / "info_music.json"))
+    monkeypatch.setattr(MusicLibrary, "db_file", str(tmp_path / "music_library.db"))
+    monkeypatch.setattr(MusicLibrary, "full_library", CompactLibrary({"a.mp3": ["tag"], "stary.mp3": []}))
+    MusicLibrary._find_music_files()
+    if MusicLibrary.full_library != {"a.mp3": ["tag"]}:
+        pytest.fail(f"zle zaktualizowana biblioteka: {MusicLibrary.full_library}")
+    if MusicLibrary.last_scan.get("removed") != 1:
+        pytest.fail(f"brak statystyk skanowania: {MusicLibrary.last_scan}")
+
+
+def test_background_scan_keeps_watcher_changes(tmp_path, monkeypatch):
+    from scripts.music_library import MusicLibrary
+    music_dir = tmp_path / "music"
+    for name in ("a.mp3", "b.mp3"):
+        _touch(os.path.join(music_dir, name))
+    monkeypatch.setattr(MusicLibrary, "music_dir", str(music_dir))
+    monkeypatch.setattr(MusicLibrary, "db_file", str(tmp_path / "music_library.db"))
+    monkeypatch.setattr(MusicLibrary, "full_library", CompactLibrary({"a.mp3": [], "b.mp3": []}))
+    monkeypatch.setattr(MusicLibrary, "tag_query", "")
+    monkeypatch.setattr(MusicLibrary, "tags", [])
+    monkeypatch.setattr(MusicLibrary, "library", [])
+    monkeypatch.setattr(MusicLibrary, "update_metadata", lambda songs=None: None)
+    MusicLibrary._get_store().add_songs(MusicLibrary.full_library)
+    MusicLibrary.do_library()
+    scan = MusicLibrary.scan_music_files()
+    # zmiany z LibraryWatcher naniesione, zanim wynik skanowania trafił do wątku poleceń
+    _touch(os.path.join(music_dir, "c.mp3"))
+    os.remove(os.path.join(music_dir, "b.mp3"))
+    MusicLibrary.apply_changes([("add", "c.mp3"), ("remove", "b.mp3")])
+    MusicLibrary.rescan(scan)
+    if MusicLibrary.full_library != {"a.mp3": [], "c.mp3": []} or MusicLibrary._touched:
+        pytest.fail(f"skanowanie cofnelo zmiany z obserwatora: {MusicLibrary.full_library}")
+    MusicLibrary._store.close()
+    MusicLibrary._store = None
+
+
+def test_scan_keeps_unreadable(tmp_path, monkeypatch):
+    from scripts import library_scanner
+    from scripts.music_library import MusicLibrary
+    for name in ("a/1.mp3", "b/2.mp3"):
+        _touch(os.path.join(tmp_path, "music", name))
+    monkeypatch.setattr(MusicLibrary, "music_dir", str(tmp_path / "music"))
+    monkeypatch.setattr(MusicLibrary, "info_file", str(tmp_path / "info_music.json"))
+    monkeypatch.setattr(MusicLibrary, "db_file", str(tmp_path / "music_library.db"))
+    monkeypatch.setattr(MusicLibrary, "full_library", CompactLibrary())
+    MusicLibrary._find_music_files()
+    store = MusicLibrary._get_store()
+    store.add_tag("a/1.mp3", "fav")
+
+    # katalog b nie daje się odczytać - jego piosenki zostają
+    scandir = os.scandir
+    def failing_scandir(path):
+        if os.path.basename(path) == "b":
+            raise PermissionError(13, "Permission denied", path)
+        return scandir(path)
+    monkeypatch.setattr(library_scanner.os, "scandir", failing_scandir)
+    os.utime(tmp_path / "music" / "b", ns=(1, 1))
+    if MusicLibrary._find_music_files() != ([], []) or "b/2.mp3" not in MusicLibrary.full_library:
+        pytest.fail(f"nieczytelny katalog zostal usuniety z biblioteki: {dict(MusicLibrary.full_library)}")
+    monkeypatch.setattr(library_scanner.os, "scandir", scandir)
+
+    # brak katalogu z muzyką (odmontowany, zmieniona nazwa) - nic nie jest usuwane
+    os.rename(tmp_path / "music", tmp_path / "muzyka")
+    if MusicLibrary._find_music_files() != ([], []) or "error" not in MusicLibrary.last_scan:
+        pytest.fail(f"skanowanie brakujacego katalogu powinno zostac przerwane: {MusicLibrary.last_scan}")
+    if store.load() != {"a/1.mp3": ["fav"], "b/2.mp3": []}:
+        pytest.fail(f"tagi zostaly usuniete z bazy: {store.load()}")
+
+
+def test_store_roundtrip(tmp_path):
+    import json
+    from scripts.library_store import LibraryStore
+    info_file = tmp_path / "info_music.json"
+    with open(info_file, "w", encoding="utf-8") as f:
+        json.dump({"a.mp3": ["rock"], "b.mp3": []}, f)
+    store = LibraryStore(str(tmp_path / "music_library.db"))
+    store.import_json(str(info_file))
+    store.add_songs(["c.mp3"])
+    store.add_tag("c.mp3", "jazz")
+    store.remove_songs(["b.mp3"])
+    with open(info_file, "w", encoding="utf-8") as f:
+        json.dump({"stary.mp3": []}, f)
+    store.import_json(str(info_file))
+    if store.load() != {"a.mp3": ["rock"], "c.mp3": ["jazz"]}:
+        pytest.fail(f"zly stan bazy: {store.load()}")
+    store.close()
+
+
+def test_tag_query(tmp_path, monkeypatch):
+    from scripts.music_library import MusicLibrary
+    from scripts.tag_query import TagQueryError
+    monkeypatch.setattr(MusicLibrary, "db_file", str(tmp_path / "music_library.db"))
+    monkeypatch.setattr(MusicLibrary, "info_file", str(tmp_path / "info_music.json"))
+    monkeypatch.setattr(MusicLibrary, "full_library", CompactLibrary({
+        "a.mp3": ["rock"], "b.mp3": ["rock", "live"], "c.mp3": ["jazz"], "d.mp3": ["hip hop"]}))
+    monkeypatch.setattr(MusicLibrary, "tag_query", "")
+    cases = {
+        "rock": {"a.mp3", "b.mp3"},
+        "rock AND NOT live": {"a.mp3"},
+        "rock | jazz": {"a.mp3", "b.mp3", "c.mp3"},
+        "NOT rock": {"c.mp3", "d.mp3"},
+        '"hip hop" OR (jazz !rock)': {"c.mp3", "d.mp3"},
+    }
+    for query, expected in cases.items():
+        if MusicLibrary.select_songs(query) != expected:
+            pytest.fail(f"zly wynik zapytania {query!r}: {MusicLibrary.select_songs(query)}")
+    MusicLibrary.change_music_tags("c.mp3", "live")
+    MusicLibrary.set_tag_query("live")
+    if MusicLibrary.library != ["b.mp3", "c.mp3"]:
+        pytest.fail(f"indeks nie zostal zaktualizowany: {MusicLibrary.library}")
+    with pytest.raises(TagQueryError):
+        MusicLibrary.set_tag_query("(rock")
+    if MusicLibrary.tag_query != "live":
+        pytest.fail("niepoprawne zapytanie zmienilo album")
+
+
+def test_get_index_song(monkeypatch):
+    from scripts.music_library import MusicLibrary
+    from scripts.settings import Player
+    songs = {f"{i}.mp3": [] for i in range(50)}
+    monkeypatch.setattr(MusicLibrary, "full_library", CompactLibrary(songs))
+    monkeypatch.setattr(MusicLibrary, "tag_query", "")
+    monkeypatch.setattr(MusicLibrary, "tags", [])
+    for rnd in (False, True):
+        MusicLibrary.do_random(rnd)
+        for _ in range(len(songs) + 3):
+            name = os.path.basename(MusicLibrary.next())
+            if MusicLibrary.get_index_song(name) != Player.index_song:
+                pytest.fail(f"zla pozycja piosenki {name} (random={rnd})")
+    if MusicLibrary.get_index_song("brak.mp3") != 0:
+        pytest.fail("nieznana piosenka powinna miec indeks 0")
+    MusicLibrary.do_random(False)
+
+
+def test_apply_changes(tmp_path, monkeypatch):
+    from scripts.music_library import MusicLibrary
+    from scripts.settings import Player
+    monkeypatch.setattr(MusicLibrary, "db_file", str(tmp_path / "music_library.db"))
+    monkeypatch.setattr(MusicLibrary, "full_library",
+                        CompactLibrary({"a/1.mp3": ["rock"], "a/2.mp3": [], "b.mp3": []}))
+    monkeypatch.setattr(MusicLibrary, "metadata", {})
+    monkeypatch.setattr(MusicLibrary, "_metadata_keys", {})
+    monkeypatch.setattr(MusicLibrary, "tag_query", "")
+    monkeypatch.setattr(MusicLibrary, "tags", [])
+    monkeypatch.setattr(MusicLibrary, "update_metadata", lambda songs=None: None)
+    store = MusicLibrary._get_store()
+    store.add_songs(MusicLibrary.full_library)
+    store.add_tag("a/1.mp3", "rock")
+    MusicLibrary.do_library()
+    monkeypatch.setattr(Player, "index_song", 2)
+
+    ops = [("move", "a", "c"), ("remove", "b.mp3"), ("add", "d.mp3"), ("add", "d.mp3")]
+    if not MusicLibrary.apply_changes(ops):
+        pytest.fail("zmiany nie zostaly naniesione na album")
+    expected = {"c/1.mp3": ["rock"], "c/2.mp3": [], "d.mp3": []}
+    if MusicLibrary.full_library != expected or store.load() != expected:
+        pytest.fail(f"zle zmiany w bibliotece: {MusicLibrary.full_library}, {store.load()}")
+    if MusicLibrary.full_library.tag_index != {"rock": {"c/1.mp3"}}:
+        pytest.fail(f"zly indeks tagow: {MusicLibrary.full_library.tag_index}")
+    if MusicLibrary.library != ["c/1.mp3", "c/2.mp3", "d.mp3"] or Player.index_song != 1:
+        pytest.fail(f"zly album po zmianach: {MusicLibrary.library}, {Player.index_song}")
+    if MusicLibrary.get_index_song("d.mp3") != 2:
+        pytest.fail("pozycje piosenek nie zostaly przeliczone")
+    MusicLibrary._store.close()
+    MusicLibrary._store = None
+
+
+def test_watcher(tmp_path, monkeypatch):
+    import time
+    from scripts.settings import watch
+    from scripts.library_watcher import LibraryWatcher
+    monkeypatch.setattr(watch, "coalesce", 0.2)
+    _touch(os.path.join(tmp_path, "a", "1.mp3"))
+    batches = []
+    watcher = LibraryWatcher(str(tmp_path), {".mp3"}, batches.append, lambda: batches.append("rescan"))
+    watcher.start()
+    for _ in range(50):
+        if watcher.mode:
+            break
+        time.sleep(0.05)
+    if watcher.mode != "inotify":
+        watcher.stop()
+        pytest.skip("inotify niedostepne")
+
+    _touch(os.path.join(tmp_path, "b", "2.mp3"))
+    _touch(os.path.join(tmp_path, "b", "okladka.jpg"))
+    os.rename(os.path.join(tmp_path, "a"), os.path.join(tmp_path, "c"))
+    os.remove(os.path.join(tmp_path, "c", "1.mp3"))
+    for _ in range(50):
+        if batches:
+            break
+        time.sleep(0.05)
+    watcher.stop()
+    if batches != [[("add", "b/2.mp3"), ("move", "a", "c"), ("remove", "c/1.mp3")]]:
+        pytest.fail(f"zle zmiany z inotify: {batches}")
+
+
+def test_lazy_shuffle():
+    from scripts.lazy_shuffle import LazyShuffle
+    shuffle = LazyShuffle(1000)
+    shuffle.take(500)
+    first = shuffle.peek()
+    drawn = [shuffle.draw() for _ in range(999)]
+    if drawn[0] != first or shuffle.draw() is not None:
+        pytest.fail("peek() nie zgadza sie z draw() albo runda sie nie skonczyla")
+    if sorted(drawn + [500]) != list(range(1000)):
+        pytest.fail("losowanie nie jest permutacja")
+    shuffle.reset(10 ** 9)
+    shuffle.draw()
+    if len(shuffle._values) > 2:
+        pytest.fail("rzadka permutacja zajmuje za duzo pamieci")
+
+
+def test_history_and_random(monkeypatch):
+    from collections import deque
+    from scripts.music_library import MusicLibrary
+    from scripts.settings import Player
+    monkeypatch.setattr(MusicLibrary, "full_library", CompactLibrary({f"{i}.mp3": [] for i in range(50)}))
+    monkeypatch.setattr(MusicLibrary, "tag_query", "")
+    monkeypatch.setattr(MusicLibrary, "tags", [])
+    monkeypatch.setattr(MusicLibrary, "history", deque(maxlen=5))
+    monkeypatch.setattr(MusicLibrary, "_forward", [])
+    monkeypatch.setattr(MusicLibrary, "_current", None)
+    monkeypatch.setattr(MusicLibrary, "is_rnd_flag", False)
+    MusicLibrary.do_library()
+    MusicLibrary.play(10)
+    version = MusicLibrary.library_version
+    MusicLibrary.do_random(True)
+    if Player.index_song != 10 or MusicLibrary.library_version != version:
+        pytest.fail("wlaczenie losowania zmienilo album albo pozycje")
+
+    played = [MusicLibrary.play()]
+    for _ in range(49):
+        upcoming = MusicLibrary.peek_next()
+        played.append(MusicLibrary.next())
+        if played[-1] != upcoming:
+            pytest.fail("peek_next() nie zgadza sie z next()")
+    if len(set(played)) != 50:
+        pytest.fail("piosenka powtorzyla sie przed koncem rundy")
+    MusicLibrary.next()  # nowa runda bez przebudowy albumu
+    if MusicLibrary.library_version != version:
+        pytest.fail("koniec rundy przebudowal album")
+
+    back = [MusicLibrary.before() for _ in range(3)]
+    if back != played[-1:-4:-1]:
+        pytest.fail(f"before() nie wraca do naprawde granych piosenek: {back}")
+    if MusicLibrary.next() != played[-2]:
+        pytest.fail("next() po before() nie wraca do piosenki, z ktorej sie cofnieto")
+    MusicLibrary.do_random(False)
+
+    # połączone naciśnięcia "następna": pominięte piosenki nie trafiają do historii
+    MusicLibrary.play(20)
+    MusicLibrary.next(3)
+    if Player.index_song != 23 or MusicLibrary.history[-1] != "20.mp3":
+        pytest.fail(f"zly skok o kilka piosenek: {Player.index_song} {list(MusicLibrary.history)}")
+    if MusicLibrary.before() != os.path.join(MusicLibrary.music_dir, "20.mp3"):
+        pytest.fail("before() po skoku wraca do pominietej piosenki")
+
+
+def test_search_index():
+    from scripts.search_index import SearchIndex, normalize
+    if normalize("Łódź ĆMA Żółw") != "lodz cma zolw":
+        pytest.fail(f"zla normalizacja: {normalize('Łódź ĆMA Żółw')}")
+    index = SearchIndex()
+    index.build(["Kazik/Łódź.mp3", "Kazik/12 groszy.mp3", "Lady Pank/Zawsze tam gdzie ty.mp3", "lodzie/inne.mp3"],
+                {"Kazik/12 groszy.mp3": {"title": "Dwanaście groszy", "artist": "Kazik"}})
+    if index.search("lodz")[:2] != ["Kazik/Łódź.mp3", "lodzie/inne.mp3"]:
+        pytest.fail(f"zle wyniki bez polskich znakow: {index.search('lodz')}")
+    if index.search("kaz ŁÓ") != ["Kazik/Łódź.mp3"]:
+        pytest.fail(f"zle wyniki dla dwoch slow: {index.search('kaz ŁÓ')}")
+    if index.search("dwana") != ["Kazik/12 groszy.mp3"]:
+        pytest.fail("brak wyniku z metadanych")
+    if index.search("kazik", limit=1) != ["Kazik/Łódź.mp3"] or index.search("xyz") or index.search(""):
+        pytest.fail("zly limit lub wyniki dla braku dopasowania")
+    index.update("Kazik/Łódź.mp3", {"title": "Nowy tytuł"})
+    index.remove("lodzie/inne.mp3")
+    if index.search("lodz") != ["Kazik/Łódź.mp3"] or index.search("tytul") != ["Kazik/Łódź.mp3"]:
+        pytest.fail(f"indeks nie zostal zaktualizowany: {index.search('lodz')}")
+    if index.search("zawsze", accept=lambda song: not song.startswith("Lady")):
+        pytest.fail("warunek accept nie zostal uwzgledniony")
+
+
+def test_search_follows_library(tmp_path, monkeypatch):
+    from scripts.music_library import MusicLibrary
+    from scripts.search_index import SearchIndex
+    music = tmp_path / "music"
+    (music / "Żuki").mkdir(parents=True)
+    (music / "Żuki" / "pierwsza.mp3").write_bytes(b"")
+    monkeypatch.setattr(MusicLibrary, "music_dir", str(music))
+    monkeypatch.setattr(MusicLibrary, "db_file", str(tmp_path / "music_library.db"))
+    monkeypatch.setattr(MusicLibrary, "info_file", str(tmp_path / "info_music.json"))
+    monkeypatch.setattr(MusicLibrary, "full_library", CompactLibrary())
+    monkeypatch.setattr(MusicLibrary, "tag_query", "")
+    monkeypatch.setattr(MusicLibrary, "tags", [])
+    monkeypatch.setattr(MusicLibrary, "search_index", SearchIndex())
+    monkeypatch.setattr(MusicLibrary, "update_metadata", lambda songs=None: None)
+    MusicLibrary._find_music_files()
+    MusicLibrary.do_library()
+    if MusicLibrary.search("zuki") != ["Żuki/pierwsza.mp3"]:
+        pytest.fail(f"brak piosenki po skanowaniu: {MusicLibrary.search('zuki')}")
+    MusicLibrary.apply_changes([("move", "Żuki/pierwsza.mp3", "Żuki/druga.mp3"), ("add", "Żuki/trzecia.mp3")])
+    if MusicLibrary.search("zuk") != ["Żuki/druga.mp3", "Żuki/trzecia.mp3"] or MusicLibrary.search("pierwsza"):
+        pytest.fail(f"indeks nie nadaza za zmianami: {MusicLibrary.search('zuk')}")
+    if MusicLibrary.search("zuki", album_only=True) != ["Żuki/druga.mp3", "Żuki/trzecia.mp3"]:
+        pytest.fail("zle wyniki z albumu")
+
+
+def test_duplicate_finder(tmp_path, monkeypatch):
+    from scripts.settings import dedup
+    from scripts.duplicate_finder import DuplicateFinder
+    from scripts.music_library import MusicLibrary
+    monkeypatch.setattr(dedup, "edge_bytes", 1024)
+    data = os.urandom(8192)
+    files = {
+        "a.mp3": data,
+        "kopia/a.mp3": data,
+        "b.mp3": data[:4096] + b"x" + data[4097:],  # ten sam początek i koniec, inny środek
+        "c.mp3": b"y" + data[1:],
+        "d.mp3": data[:100],
+    }
+    for name, content in files.items():
+        os.makedirs(os.path.dirname(os.path.join(tmp_path, name)), exist_ok=True)
+        with open(os.path.join(tmp_path, name), "wb") as f:
+            f.write(content)
+    cache = {}
+    finder = DuplicateFinder(str(tmp_path), cache, lambda rows: cache.update((r[0], r[1:]) for r in rows), None)
+    groups = finder.find(files)
+    if groups != [["a.mp3", "kopia/a.mp3"]]:
+        pytest.fail(f"zle grupy duplikatow: {groups}")
+    if (finder.stats["partial"], finder.stats["full"]) != (4, 3):
+        pytest.fail(f"hashowane niepotrzebne pliki: {finder.stats}")
+    finder = DuplicateFinder(str(tmp_path), cache, cache.update, None)
+    if finder.find(files) != groups or finder.stats["partial"] + finder.stats["full"] != 0:
+        pytest.fail(f"niezmienione pliki hashowane ponownie: {finder.stats}")
+
+    monkeypatch.setattr(MusicLibrary, "full_library", CompactLibrary({name: [] for name in files}))
+    monkeypatch.setattr(MusicLibrary, "tag_query", "")
+    monkeypatch.setattr(MusicLibrary, "tags", [])
+    monkeypatch.setattr(MusicLibrary, "unique", True)
+    monkeypatch.setattr(MusicLibrary, "library", [])
+    monkeypatch.setattr(MusicLibrary, "duplicates", [])
+    monkeypatch.setattr(MusicLibrary, "_copy_of", {})
+    MusicLibrary.set_duplicates(groups)
+    MusicLibrary.do_library()
+    if MusicLibrary.library != ["a.mp3", "b.mp3", "c.mp3", "d.mp3"]:
+        pytest.fail(f"album w trybie jednej kopii: {MusicLibrary.library}")
+
+
+def test_compact_library():
+    from scripts.compact_library import SongList
+    library = CompactLibrary({"a/1.mp3": ["rock"], "a/b/2.mp3": [], "c/3.mp3": ["jazz", "rock"], "4.mp3": []})
+    # tagi w kolejnosci numerow tagow, "rock" dostal numer jako pierwszy
+    if dict(library) != {"a/1.mp3": ["rock"], "a/b/2.mp3": [], "c/3.mp3": ["rock", "jazz"], "4.mp3": []}:
+        pytest.fail(f"zla zawartosc biblioteki: {dict(library)}")
+    if library.songs_under("a") != ["a/1.mp3", "a/b/2.mp3"] or library.songs_under("4.mp3") != ["4.mp3"]:
+        pytest.fail(f"zle piosenki w katalogu: {library.songs_under('a')}")
+    if not library.add_tag("a/b/2.mp3", "rock") or library.add_tag("a/b/2.mp3", "rock"):
+        pytest.fail("add_tag nie zwraca informacji o zmianie")
+    if library.tag_index["rock"] != {"a/1.mp3", "a/b/2.mp3", "c/3.mp3"}:
+        pytest.fail(f"zly indeks tagow: {dict(library.tag_index)}")
+    library.remove_tag("c/3.mp3", "jazz")
+    if "jazz" in library.tag_index or library["c/3.mp3"] != ["rock"]:
+        pytest.fail("remove_tag nie usunal tagu")
+
+    album = SongList.from_paths(library, ["c/3.mp3", "a/1.mp3", "brak.mp3"])
+    if album != ["c/3.mp3", "a/1.mp3"] or album.positions.get("a/1.mp3") != 1 or "4.mp3" in album:
+        pytest.fail(f"zly album: {album}")
+    del library["a/1.mp3"]
+    library["a/5.mp3"] = []
+    if album[1] != "a/1.mp3" or "a/1.mp3" in library or list(library)[-1] != "a/5.mp3" or len(library) != 4:
+        pytest.fail("usuniecie piosenki zmienilo album albo kolejnosc biblioteki")
+    # zbiory numerów tagów nadążają za usunięciem i nadpisaniem tagów
+    library["4.mp3"] = ["jazz"]
+    if library.ids_with_tag("rock") != {library.id_of("a/b/2.mp3"), library.id_of("c/3.mp3")}:
+        pytest.fail(f"zly zbior numerow tagu: {library.ids_with_tag('rock')}")
+    if library.tag_index != {"rock": {"a/b/2.mp3", "c/3.mp3"}, "jazz": {"4.mp3"}}:
+        pytest.fail(f"zly indeks tagow po zmianach: {dict(library.tag_index)}")
+    compact = library.compacted()
+    if compact != library or list(compact) != list(library) or compact.removed or library.removed != 1:
+        pytest.fail(f"zla kopia biblioteki: {compact}")
+    if list(compact.ids()) != [0, 1, 2, 3] or compact.tag_id_index["jazz"] != {compact.id_of("4.mp3")}:
+        pytest.fail(f"kopia bez kolejnych numerow: {list(compact.ids())}")
+
+
+def test_remove_and_add_same_path(tmp_path, monkeypatch):
+    from scripts.music_library import MusicLibrary
+    from scripts.settings import Player
+    monkeypatch.setattr(MusicLibrary, "db_file", str(tmp_path / "music_library.db"))
+    monkeypatch.setattr(MusicLibrary, "full_library", CompactLibrary({"a.mp3": [], "b.mp3": ["rock"], "c.mp3": []}))
+    monkeypatch.setattr(MusicLibrary, "metadata", {})
+    monkeypatch.setattr(MusicLibrary, "_metadata_keys", {})
+    monkeypatch.setattr(MusicLibrary, "tag_query", "")
+    monkeypatch.setattr(MusicLibrary, "tags", [])
+    monkeypatch.setattr(MusicLibrary, "library", [])
+    monkeypatch.setattr(MusicLibrary, "update_metadata", lambda songs=None: None)
+    monkeypatch.setattr(Player, "index_song", 0)
+    MusicLibrary._get_store().add_songs(MusicLibrary.full_library)
+    MusicLibrary.do_library()
+    # plik zapisany od nowa: usunięcie i dodanie tej samej ścieżki w jednej paczce
+    MusicLibrary.apply_changes([("remove", "b.mp3"), ("add", "b.mp3")])
+    if "b.mp3" not in MusicLibrary._positions or MusicLibrary.get_index_song("b.mp3") != 1:
+        pytest.fail(f"piosenka zniknela z albumu: {list(MusicLibrary.library)}")
+    if MusicLibrary.full_library["b.mp3"] != ["rock"] or list(MusicLibrary.full_library) != ["a.mp3", "b.mp3", "c.mp3"]:
+        pytest.fail(f"zla biblioteka po ponownym dodaniu: {MusicLibrary.full_library}")
+    MusicLibrary._store.close()
+    MusicLibrary._store = None
+
+
+def test_library_compaction(tmp_path, monkeypatch):
+    from scripts.music_library import MusicLibrary
+    from scripts.settings import Player
+    songs = {f"a/{i}.mp3": [] for i in range(1200)}
+    songs.update({f"b/{i}.mp3": ["rock"] if i % 2 else [] for i in range(10)})
+    monkeypatch.setattr(MusicLibrary, "db_file", str(tmp_path / "music_library.db"))
+    monkeypatch.setattr(MusicLibrary, "full_library", CompactLibrary(songs))
+    monkeypatch.setattr(MusicLibrary, "metadata", {})
+    monkeypatch.setattr(MusicLibrary, "_metadata_keys", {})
+    monkeypatch.setattr(MusicLibrary, "tag_query", "rock OR NOT rock")
+    monkeypatch.setattr(MusicLibrary, "tags", [])
+    monkeypatch.setattr(MusicLibrary, "library", [])
+    monkeypatch.setattr(MusicLibrary, "update_metadata", lambda songs=None: None)
+    monkeypatch.setattr(Player, "index_song", 0)
+    MusicLibrary._get_store().add_songs(MusicLibrary.full_library)
+    MusicLibrary.do_library()
+    MusicLibrary.apply_changes([("remove", "a")])
+    library = MusicLibrary.full_library
+    expected = [f"b/{i}.mp3" for i in range(10)]
+    if library.removed or list(library.ids()) != list(range(10)) or MusicLibrary.library.library is not library:
+        pytest.fail(f"biblioteka nie zostala przenumerowana: {library.removed} {list(library.ids())}")
+    if MusicLibrary.library != expected or MusicLibrary.get_index_song("b/3.mp3") != 3:
+        pytest.fail(f"zly album po przenumerowaniu: {MusicLibrary.library}")
+    MusicLibrary.set_tag_query("rock")
+    if MusicLibrary.library != expected[1::2]:
+        pytest.fail(f"zle zapytanie po przenumerowaniu: {MusicLibrary.library}")
+    MusicLibrary._store.close()
+    MusicLibrary._store = None
+
+
+def test_tag_writer(tmp_path, monkeypatch):
+    import json
+    import time
+    from scripts.settings import tag_edit
+    from scripts.tag_writer import TagWriter
+    from scripts.music_library import MusicLibrary
+    monkeypatch.setattr(tag_edit, "flush_delay", 0.05)
+    writes = []
+    writer = TagWriter(lambda added, removed: writes.append((sorted(added), sorted(removed))))
+    writer.add([("a.mp3", "rock", True), ("b.mp3", "rock", True)])
+    writer.add([("a.mp3", "rock", False), ("b.mp3", "jazz", True)])
+    if writes or writer.pending != 3:
+        pytest.fail(f"zapis nie powinien czekac na add(): {writes}")
+    deadline = time.monotonic() + 5
+    while not writes and time.monotonic() < deadline:
+        time.sleep(0.01)
+    if writes != [([("b.mp3", "jazz"), ("b.mp3", "rock")], [("a.mp3", "rock")])]:
+        pytest.fail(f"zmiany nie zostaly scalone w jeden zapis: {writes}")
+    monkeypatch.setattr(tag_edit, "flush_delay", 60)
+    writer.add([("c.mp3", "live", True)])
+    writer.close()
+    if writes[-1] != ([("c.mp3", "live")], []) or writer.pending:
+        pytest.fail("close() nie zapisal zaleglych zmian")
+
+    monkeypatch.setattr(MusicLibrary, "db_file", str(tmp_path / "music_library.db"))
+    monkeypatch.setattr(MusicLibrary, "info_file", str(tmp_path / "info_music.json"))
+    monkeypatch.setattr(MusicLibrary, "full_library", CompactLibrary({"a/1.mp3": [], "a/2.mp3": ["rock"], "b.mp3": []}))
+    store = MusicLibrary._get_store()
+    store.add_songs(MusicLibrary.full_library)
+    store.add_tag("a/2.mp3", "rock")
+    with pytest.raises(ValueError):
+        MusicLibrary.change_tags([("a", "jazz", True), ("brak", "jazz", True)])
+    if MusicLibrary.full_library.tag_index.get("jazz"):
+        pytest.fail("niepoprawna paczka zmienila biblioteke")
+    changes = MusicLibrary.change_tags([("a", "jazz", True), ("a", "rock", True), ("b.mp3", "rock", False)])
+    if changes != [("a/1.mp3", "jazz", True), ("a/2.mp3", "jazz", True), ("a/1.mp3", "rock", True)]:
+        pytest.fail(f"zle zmiany: {changes}")
+    if store.load()["a/1.mp3"]:
+        pytest.fail("tagi zapisane do bazy w trakcie zapytania")
+    MusicLibrary.flush_tags()
+    if store.load() != {"a/1.mp3": ["jazz", "rock"], "a/2.mp3": ["rock", "jazz"], "b.mp3": []}:
+        pytest.fail(f"tagi nie zostaly zapisane do bazy: {store.load()}")
+    # zapis tagów nie przepisuje całej biblioteki do json, eksport tylko na żądanie (przy wyjściu)
+    if (tmp_path / "info_music.json").exists():
+        pytest.fail("eksport json po zapisie tagow")
+    monkeypatch.setattr(tag_edit, "export_json", True)
+    MusicLibrary.export_info_file()
+    with open(tmp_path / "info_music.json", encoding="utf-8") as f:
+        if json.load(f) != dict(MusicLibrary.full_library):
+            pytest.fail("eksport json nie odpowiada bibliotece")
+    if [p.name for p in tmp_path.iterdir() if p.name.endswith(".tmp")]:
+        pytest.fail("zostal plik tymczasowy eksportu")
+
+
+def test_worker_pool_skips_main(tmp_path):
+    import subprocess
+    # procesy robocze nie mogą wykonywać skryptu głównego (u nas - całego serwera)
+    script = tmp_path / "main.py"
+    script.write_text(
+        "import sys\n"
+        f"sys.path.insert(0, {os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))!r})\n"
+        "print('MAIN', flush=True)\n"
+        "from scripts.worker_pool import run_batches\n"
+        "class S: workers = 2; batch_size = 2; nice = 0; start_method = 'spawn'\n"
+        "if __name__ == '__main__':\n"
+        "    out = []\n"
+        "    run_batches(len, list(range(7)), out.append, S)\n"
+        "    print(sorted(out), __spec__)\n", encoding="utf-8")
+    output = subprocess.run([sys.executable, str(script)], capture_output=True, text=True, timeout=60).stdout
+    # __spec__ skryptu głównego wraca do poprzedniej wartości po uruchomieniu procesów
+    if output.split() != ["MAIN", "[1,", "2,", "2,", "2]", "None"]:
+        pytest.fail(f"skrypt glowny wykonany w procesach roboczych: {output!r}")
+
+
+def test_current_song_removed(tmp_path, monkeypatch):
+    from scripts.music_library import MusicLibrary
+    from scripts.settings import Player
+    monkeypatch.setattr(MusicLibrary, "db_file", str(tmp_path / "music_library.db"))
+    monkeypatch.setattr(MusicLibrary, "full_library", CompactLibrary({"a.mp3": [], "b.mp3": [], "c.mp3": []}))
+    monkeypatch.setattr(MusicLibrary, "tag_query", "")
+    monkeypatch.setattr(MusicLibrary, "tags", [])
+    monkeypatch.setattr(MusicLibrary, "is_rnd_flag", False)
+    monkeypatch.setattr(MusicLibrary, "_current", None)
+    monkeypatch.setattr(MusicLibrary, "_forward", [])
+    monkeypatch.setattr(Player, "index_song", 0)
+    monkeypatch.setattr(Player, "name_song", "")
+    MusicLibrary.do_library()
+    MusicLibrary.play(0)
+    if MusicLibrary.current_song() != "a.mp3":
+        pytest.fail(f"zla aktualna piosenka: {MusicLibrary.current_song()}")
+    # grająca pierwsza piosenka znika z albumu - nie może być pokazana ostatnia (library[-1])
+    MusicLibrary._update_album([], ["a.mp3"], {})
+    if MusicLibrary.current_song() != "":
+        pytest.fail(f"usunieta piosenka pokazana jako {MusicLibrary.current_song()!r}")
+    if os.path.basename(MusicLibrary.next()) != "b.mp3" or MusicLibrary.current_song() != "b.mp3":
+        pytest.fail("next() po usunieciu grajacej piosenki nie gra nastepnej")
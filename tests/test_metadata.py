@@ -0,0 +1,109 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import struct
+import pytest
+
+
+def _vorbis_comment(**fields):
+    vendor = b"test"
+    comments = [f"{k.upper()}={v}".encode() for k, v in fields.items()]
+    data = struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", len(comments))
+    for c in comments:
+        data += struct.pack("<I", len(c)) + c
+    return data
+
+
+def _atom(kind, payload):
+    return struct.pack(">I", 8 + len(payload)) + kind + payload
+
+
+def test_mp3():
+    from scripts.metadata import read_metadata
+    meta = read_metadata("tests/test.mp3")
+    if meta["title"] != "When Domz attack" or meta["artist"] != "Christophe Heral":
+        pytest.fail(f"zle odczytany ID3v2: {meta}")
+    if not meta["duration"] or not 80 < meta["duration"] < 95:
+        pytest.fail(f"zla dlugosc mp3: {meta}")
+
+
+def test_wav(tmp_path):
+    import wave
+    from scripts.metadata import read_metadata
+    path = str(tmp_path / "a.wav")
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(8000)
+        w.writeframes(b"\x00\x00" * 16000)
+    if read_metadata(path)["duration"] != 2.0:
+        pytest.fail(f"zla dlugosc wav: {read_metadata(path)}")
+
+
+def test_flac(tmp_path):
+    from scripts.metadata import read_metadata
+    # STREAMINFO: 44100 Hz, 2 kanały, 16 bit, 441000 próbek
+    info = bytearray(34)
+    packed = (44100 << 44) | (1 << 41) | (15 << 36) | 441000
+    info[10:18] = packed.to_bytes(8, "big")
+    comment = _vorbis_comment(title="Żółć", artist="Zespół")
+    picture = b"\x00" * 5000
+    data = b"fLaC"
+    data += bytes([0]) + len(info).to_bytes(3, "big") + bytes(info)
+    data += bytes([6]) + len(picture).to_bytes(3, "big") + picture
+    data += bytes([0x80 | 4]) + len(comment).to_bytes(3, "big") + comment
+    path = tmp_path / "a.flac"
+    path.write_bytes(data)
+    meta = read_metadata(str(path))
+    if meta != {"title": "Żółć", "artist": "Zespół", "album": None, "duration": 10.0}:
+        pytest.fail(f"zle odczytany flac: {meta}")
+
+
+def test_ogg(tmp_path):
+    from scripts.metadata import read_metadata
+
+    def page(packet, granule):
+        segments = [255] * (len(packet) // 255) + [len(packet) % 255]
+        return b"OggS\x00\x00" + struct.pack("<q", granule) + b"\x00" * 12 + bytes([len(segments)]) + bytes(segments) + packet
+
+    ident = b"\x01vorbis" + struct.pack("<I", 0) + b"\x01" + struct.pack("<I", 22050) + b"\x00" * 16
+    comment = b"\x03vorbis" + _vorbis_comment(title="Piosenka", album="Płyta" * 100)
+    path = tmp_path / "a.ogg"
+    path.write_bytes(page(ident, 0) + page(comment, 0) + page(b"\x00" * 10, 22050 * 3))
+    meta = read_metadata(str(path))
+    if meta["title"] != "Piosenka" or meta["album"] != "Płyta" * 100 or meta["duration"] != 3.0:
+        pytest.fail(f"zle odczytany ogg: {meta}")
+
+
+def test_mp4(tmp_path):
+    from scripts.metadata import read_metadata
+    mvhd = _atom(b"mvhd", b"\x00" * 12 + struct.pack(">II", 1000, 4500) + b"\x00" * 80)
+    title = _atom(b"\xa9nam", _atom(b"data", b"\x00\x00\x00\x01\x00\x00\x00\x00" + "Tytuł".encode()))
+    meta_atom = _atom(b"meta", b"\x00" * 4 + _atom(b"ilst", title))
+    moov = _atom(b"moov", mvhd + _atom(b"trak", b"\x00" * 1000) + _atom(b"udta", meta_atom))
+    path = tmp_path / "a.m4a"
+    path.write_bytes(_atom(b"ftyp", b"M4A \x00\x00\x00\x00") + _atom(b"mdat", b"\x00" * 2000) + moov)
+    meta = read_metadata(str(path))
+    if meta["title"] != "Tytuł" or meta["duration"] != 4.5:
+        pytest.fail(f"zle odczytany mp4: {meta}")
+
+
+def test_extractor_cache(tmp_path):
+    import shutil
+    from scripts.metadata_extractor import MetadataExtractor
+    shutil.copy("tests/test.mp3", tmp_path / "a.mp3")
+    shutil.copy("tests/test.mp3", tmp_path / "b.mp3")
+    results = []
+    extractor = MetadataExtractor(str(tmp_path), {}, results.extend, workers=1)
+    extractor.start(["a.mp3", "b.mp3", "brak.mp3"])
+    extractor.join(60)
+    if sorted(r[0] for r in results) != ["a.mp3", "b.mp3"]:
+        pytest.fail(f"zle wyniki odczytu metadanych: {results}")
+    cache = {r[0]: (r[1], r[2]) for r in results}
+    results.clear()
+    os.utime(tmp_path / "b.mp3", ns=(0, 10**18))
+    extractor = MetadataExtractor(str(tmp_path), cache, results.extend, workers=1)
+    extractor.start(["a.mp3", "b.mp3"])
+    extractor.join(60)
+    if [r[0] for r in results] != ["b.mp3"]:
+        pytest.fail(f"niezmieniony plik zostal odczytany ponownie: {results}")
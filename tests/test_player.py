@@ -0,0 +1,176 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import ctypes
+import pytest
+
+
+def _event(event_id, data=None, reply_userdata=0, error=0):
+    from scripts import lib_mpv_player as mpv
+    ptr = ctypes.cast(ctypes.pointer(data), ctypes.c_void_p) if data is not None else None
+    return mpv.mpv_event(event_id, error, reply_userdata, ptr)
+
+
+def _load_reply(token, entry_id):
+    """Odpowiedź na loadfile: mapa {"playlist_entry_id": entry_id}"""
+    from scripts import lib_mpv_player as mpv
+    keys = (ctypes.c_char_p * 1)(b"playlist_entry_id")
+    values = (mpv.mpv_node * 1)()
+    values[0].format = mpv.MPV_FORMAT_INT64
+    values[0].u.int64 = entry_id
+    node_list = mpv.mpv_node_list(1, values, keys)
+    node = mpv.mpv_node()
+    node.format = mpv.MPV_FORMAT_NODE_MAP
+    node.u.list = ctypes.pointer(node_list)
+    reply = mpv.mpv_event_command(node)
+    return _event(mpv.MPV_EVENT_COMMAND_REPLY, reply, reply_userdata=token), (keys, values, node_list, reply)
+
+
+def test_end_file_matched_to_load(monkeypatch):
+    from scripts import lib_mpv_player as mpv
+    player = mpv.LibMPVPlayer
+    ended = []
+    monkeypatch.setattr(player, "on_song_end", lambda: ended.append(True))
+    monkeypatch.setattr(player, "_pending_load", 7)
+    monkeypatch.setattr(player, "_current_entry_id", None)
+
+    event, keep_alive = _load_reply(7, 5)
+    player._handle_event(event)
+    if player._current_entry_id != 5 or player._pending_load is not None:
+        pytest.fail("odpowiedz na loadfile nie zostala dopasowana po reply_userdata")
+    # koniec poprzedniego pliku (zastąpionego) nie może przełączyć piosenki
+    player._handle_event(_event(mpv.MPV_EVENT_END_FILE, mpv.mpv_event_end_file(mpv.MPV_END_FILE_REASON_STOP, 0, 4, 0, 0)))
+    player._handle_event(_event(mpv.MPV_EVENT_END_FILE, mpv.mpv_event_end_file(mpv.MPV_END_FILE_REASON_EOF, 0, 4, 0, 0)))
+    if ended:
+        pytest.fail("koniec starego pliku zostal uznany za koniec piosenki")
+    player._handle_event(_event(mpv.MPV_EVENT_END_FILE, mpv.mpv_event_end_file(mpv.MPV_END_FILE_REASON_EOF, 0, 5, 0, 0)))
+    if ended != [True]:
+        pytest.fail("koniec aktualnego pliku nie wywolal on_song_end")
+
+
+def test_progress_rate_limited(monkeypatch):
+    from scripts import lib_mpv_player as mpv
+    from scripts.settings import Player
+    player = mpv.LibMPVPlayer
+    sent = []
+    monkeypatch.setattr(player, "on_progress", sent.append)
+    monkeypatch.setattr(player, "state", {"time": None, "duration": None, "pause": False, "volume": None})
+    monkeypatch.setattr(player, "_last_progress", 0.0)
+    monkeypatch.setattr(Player, "progress_interval", 60)
+    for t in (1.0, 1.1, 1.2):
+        value = ctypes.c_double(t)
+        prop = mpv.mpv_event_property(b"time-pos", mpv.MPV_FORMAT_DOUBLE, ctypes.cast(ctypes.pointer(value), ctypes.c_void_p))
+        player._handle_event(_event(mpv.MPV_EVENT_PROPERTY_CHANGE, prop, reply_userdata=1))
+    flag = ctypes.c_int(1)
+    prop = mpv.mpv_event_property(b"pause", mpv.MPV_FORMAT_FLAG, ctypes.cast(ctypes.pointer(flag), ctypes.c_void_p))
+    player._handle_event(_event(mpv.MPV_EVENT_PROPERTY_CHANGE, prop, reply_userdata=3))
+    if len(sent) != 2 or sent[-1]["pause"] is not True or sent[-1]["time"] != 1.2:
+        pytest.fail(f"zle ograniczanie zdarzen postepu: {sent}")
+
+
+def test_gapless_advance(monkeypatch):
+    from scripts import lib_mpv_player as mpv
+    player = mpv.LibMPVPlayer
+    advanced, ended = [], []
+    monkeypatch.setattr(player, "on_track_advance", advanced.append)
+    monkeypatch.setattr(player, "on_song_end", lambda: ended.append(True))
+    monkeypatch.setattr(player, "_pending_load", None)
+    monkeypatch.setattr(player, "_current_entry_id", 5)
+    monkeypatch.setattr(player, "_queued_path", "/muzyka/b.mp3")
+    monkeypatch.setattr(player, "_queued_entry_id", 6)
+    player._handle_event(_event(mpv.MPV_EVENT_END_FILE, mpv.mpv_event_end_file(mpv.MPV_END_FILE_REASON_EOF, 0, 5, 0, 0)))
+    if advanced != ["/muzyka/b.mp3"] or ended:
+        pytest.fail("przejscie do pliku z kolejki nie zostalo rozpoznane")
+    if player._current_entry_id != 6 or player._queued_path is not None:
+        pytest.fail("po przejsciu plik z kolejki nie jest aktualnym plikiem")
+
+
+def test_command_futures(monkeypatch):
+    from concurrent.futures import Future
+    from scripts import lib_mpv_player as mpv
+    player = mpv.LibMPVPlayer
+    ok, failed, prop = Future(), Future(), Future()
+    monkeypatch.setattr(player, "_replies", {11: (ok, "loadfile", 0.0), 12: (failed, "stop", 0.0), 13: (prop, "set volume", 0.0)})
+    monkeypatch.setattr(player, "_pending_load", None)
+    monkeypatch.setattr(player, "_pending_queue", None)
+    event, keep_alive = _load_reply(11, 3)
+    player._handle_event(event)
+    player._handle_event(_event(mpv.MPV_EVENT_COMMAND_REPLY, mpv.mpv_event_command(), reply_userdata=12, error=-12))
+    player._handle_event(_event(mpv.MPV_EVENT_SET_PROPERTY_REPLY, reply_userdata=13))
+    if ok.result(0) != {"playlist_entry_id": 3} or prop.result(0) is not None:
+        pytest.fail("odpowiedz mpv nie zakonczyla Future polecenia")
+    if not isinstance(failed.exception(0), mpv.MPVError) or failed.exception(0).code != -12:
+        pytest.fail("blad mpv nie zostal przekazany do wywolujacego")
+    if player._replies:
+        pytest.fail("zakonczone polecenia zostaly w _replies")
+
+
+def test_reply_during_send(monkeypatch):
+    from scripts import lib_mpv_player as mpv
+    player = mpv.LibMPVPlayer
+    keep_alive = []
+
+    def send(token):
+        # odpowiedź obsłużona, zanim send zwróci (pętla zdarzeń może wyprzedzić wysyłającego)
+        event, data = _load_reply(token, 8)
+        keep_alive.append(data)
+        player._handle_event(event)
+        return 0
+    monkeypatch.setattr(player, "player", 1)
+    monkeypatch.setattr(player, "_replies", {})
+    monkeypatch.setattr(player, "_pending_load", None)
+    monkeypatch.setattr(player, "_pending_queue", None)
+    monkeypatch.setattr(player, "_queued_entry_id", None)
+    future = player._submit("loadfile", send, "_pending_queue")
+    if not future.done() or future.result(0) != {"playlist_entry_id": 8}:
+        pytest.fail("odpowiedz w trakcie wysylania nie zakonczyla Future")
+    if player._pending_queue is not None or player._queued_entry_id != 8 or player._replies:
+        pytest.fail(f"token czekajacy na odpowiedz nie zostal wyczyszczony: {player._pending_queue}")
+    failed = player._submit("loadfile", lambda token: -1, "_pending_queue")
+    if player._pending_queue is not None or failed.token is not None or not isinstance(failed.exception(0), mpv.MPVError):
+        pytest.fail("niewyslane polecenie zostalo jako czekajace")
+
+
+def test_play_reply_before_return(monkeypatch, tmp_path):
+    import types
+    from scripts import lib_mpv_player as mpv
+    player = mpv.LibMPVPlayer
+    song = tmp_path / "a.mp3"
+    song.write_bytes(b"")
+    keep_alive = []
+    ended = []
+
+    def command_async(handle, token, args):
+        event, data = _load_reply(token, 4)
+        keep_alive.append(data)
+        player._handle_event(event)
+        return 0
+    monkeypatch.setattr(mpv, "libmpv", types.SimpleNamespace(mpv_command_async=command_async))
+    monkeypatch.setattr(player, "player", 1)
+    monkeypatch.setattr(player, "_replies", {})
+    monkeypatch.setattr(player, "_pending_load", None)
+    monkeypatch.setattr(player, "_pending_queue", None)
+    monkeypatch.setattr(player, "_queued_path", None)
+    monkeypatch.setattr(player, "_current_entry_id", None)
+    monkeypatch.setattr(player, "_current_path", None)
+    monkeypatch.setattr(player, "on_song_end", lambda: ended.append(True))
+    player.play(str(song))
+    # koniec pliku po odpowiedzi, która wyprzedziła powrót z play, przełącza piosenkę
+    player._handle_event(_event(mpv.MPV_EVENT_END_FILE, mpv.mpv_event_end_file(mpv.MPV_END_FILE_REASON_EOF, 0, 4, 0, 0)))
+    if player._pending_load is not None or ended != [True]:
+        pytest.fail(f"koniec pliku zignorowany po szybkiej odpowiedzi: {player._pending_load} {ended}")
+
+
+def test_typed_properties():
+    import ctypes
+    from scripts import lib_mpv_player as mpv
+    fmt, data = mpv._property_data(55.0)
+    if fmt != mpv.MPV_FORMAT_DOUBLE or data.value != 55.0:
+        pytest.fail("glosnosc nie jest przekazywana jako double")
+    fmt, data = mpv._property_data(True)
+    if fmt != mpv.MPV_FORMAT_FLAG or data.value != 1:
+        pytest.fail("pauza nie jest przekazywana jako flag")
+    if mpv._encode_args(("playlist-clear",)) is not mpv._encode_args(("playlist-clear",)):
+        pytest.fail("argumenty powtarzanych polecen sa kodowane za kazdym razem")
+    if mpv.LibMPVPlayer.player is None and not isinstance(mpv.LibMPVPlayer.pause().exception(0), mpv.MPVError):
+        pytest.fail("polecenie bez playera powinno zwrocic blad w Future")
@@ -0,0 +1,565 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import pytest
+from scripts.compact_library import CompactLibrary
+
+
+@pytest.fixture
+def async_server():
+    """Uruchamia AsyncServer w pętli w osobnym wątku, po teście zamyka serwer, pętlę i wątek"""
+    import asyncio
+    import threading
+    from scripts.async_server import AsyncServer
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    servers = []
+
+    def start(app, broadcaster, **kwargs):
+        srv = AsyncServer(app, broadcaster, **kwargs)
+        servers.append(srv)
+        asyncio.run_coroutine_threadsafe(srv.start("127.0.0.1", 0), loop).result(5)
+        return srv
+    try:
+        yield start
+    finally:
+        try:
+            for srv in servers:
+                asyncio.run_coroutine_threadsafe(srv.close(), loop).result(5)
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(5)
+            loop.close()
+
+
+def test_broadcaster_fan_out():
+    from scripts.event_broadcaster import EventBroadcaster
+    broadcaster = EventBroadcaster()
+    first = broadcaster.subscribe()
+    second = broadcaster.subscribe()
+    broadcaster.publish({"type": "song", "value": "a.mp3"})
+    for sub in (first, second):
+        item = sub.get(0)
+        if item is None or item[1]["value"] != "a.mp3":
+            pytest.fail(f"klient nie dostal zdarzenia: {item}")
+    broadcaster.unsubscribe(second)
+    broadcaster.publish({"type": "volume", "value": 10})
+    if second.get(0) is not None:
+        pytest.fail("odlaczony klient dostal zdarzenie")
+
+
+def test_broadcaster_merge_and_drop():
+    from scripts.event_broadcaster import EventBroadcaster
+    broadcaster = EventBroadcaster(queue_size=2)
+    sub = broadcaster.subscribe()
+    for volume in range(10):
+        broadcaster.publish({"type": "volume", "value": volume})
+    if len(sub) != 1 or sub.get(0)[1]["value"] != 9:
+        pytest.fail("zdarzenia tego samego typu nie zostaly scalone")
+    # zmiany albumu od wersji bazowej muszą dojść wszystkie
+    for version in (1, 2):
+        broadcaster.publish({"type": "library_update", "value": {"base": version - 1, "version": version}})
+    if [e["value"]["version"] for _, e in sub.events] != [1, 2]:
+        pytest.fail(f"zmiany albumu zostaly scalone: {list(sub.events)}")
+    sub.events.clear()
+    for song in ("a", "b", "c"):
+        broadcaster.publish({"type": song, "value": song})
+    if sub.dropped != 1 or [e["type"] for _, e in sub.events] != ["b", "c"]:
+        pytest.fail(f"najstarsze zdarzenie nie zostalo odrzucone: {list(sub.events)}")
+
+
+def test_broadcaster_replay():
+    from scripts.event_broadcaster import EventBroadcaster
+    broadcaster = EventBroadcaster(history_size=3)
+    broadcaster.snapshot = lambda: [{"type": "song", "value": "snapshot"}]
+    ids = [broadcaster.publish({"type": f"e{i}", "value": i}) for i in range(5)]
+    sub = broadcaster.subscribe(last_event_id=str(ids[2]))
+    if [e["value"] for _, e in sub.events] != [3, 4]:
+        pytest.fail(f"zle powtorzone zdarzenia: {list(sub.events)}")
+    sub = broadcaster.subscribe(last_event_id=str(ids[0]))
+    if [e["value"] for _, e in sub.events] != ["snapshot"]:
+        pytest.fail(f"brak pelnego stanu dla starego Last-Event-ID: {list(sub.events)}")
+    sub = broadcaster.subscribe(last_event_id=str(ids[-1]))
+    if len(sub):
+        pytest.fail("aktualny klient dostal niepotrzebne zdarzenia")
+    # postęp odtwarzania nie wypycha z bufora zdarzeń do powtórzenia
+    for position in range(10):
+        broadcaster.publish({"type": "progress", "value": position}, replay=False)
+    sub = broadcaster.subscribe(last_event_id=str(ids[3]))
+    if [e["value"] for _, e in sub.events] != [4]:
+        pytest.fail(f"postep odtwarzania wypchnal zdarzenia z bufora: {list(sub.events)}")
+
+
+def test_library_delta():
+    import random
+    from scripts.library_delta import diff, apply
+    old = [f"{i}.mp3" for i in range(100)]
+    shuffled = old[:]
+    random.shuffle(shuffled)
+    changed = [song for song in old if song != "5.mp3"]
+    changed.insert(10, "nowa.mp3")
+    for new in (shuffled, changed, old):
+        delta = diff(old, new)
+        if delta is None or apply(old, delta) != new:
+            pytest.fail(f"zla roznica albumu: {delta}")
+    if any(isinstance(i, str) for i in diff(old, shuffled)["order"]):
+        pytest.fail("przetasowanie powinno wysylac same indeksy")
+
+
+def test_album_pagination(monkeypatch):
+    import music_serwer
+    from music_serwer import app, MusicLibrary
+    monkeypatch.setattr(MusicLibrary, "full_library", CompactLibrary({f"{i}.mp3": [] for i in range(10)}))
+    monkeypatch.setattr(MusicLibrary, "tag_query", "")
+    monkeypatch.setattr(MusicLibrary, "tags", [])
+    MusicLibrary.do_library()
+    client = app.test_client()
+    res = client.get("/album?offset=8&limit=5")
+    data = res.get_json()
+    if data["items"] != ["8.mp3", "9.mp3"] or data["total"] != 10:
+        pytest.fail(f"zla strona albumu: {data}")
+    res = client.get("/album?offset=8&limit=5", headers={"If-None-Match": res.headers["ETag"]})
+    if res.status_code != 304:
+        pytest.fail(f"brak 304 dla aktualnego ETag: {res.status_code}")
+    # metadane odczytane w tle nie zmieniają wersji albumu, ale zmieniają odpowiedź z meta=1
+    import types
+    from scripts.search_index import SearchIndex
+    monkeypatch.setattr(MusicLibrary, "metadata", {})
+    monkeypatch.setattr(MusicLibrary, "_metadata_keys", {})
+    monkeypatch.setattr(MusicLibrary, "search_index", SearchIndex())
+    monkeypatch.setattr(MusicLibrary, "metadata_version", 0)
+    monkeypatch.setattr(MusicLibrary, "_get_store", lambda: types.SimpleNamespace(save_metadata=lambda results: None))
+    res = client.get("/album?offset=8&meta=1")
+    MusicLibrary._save_metadata([("8.mp3", 1, 1.0, {"title": "Osiem", "artist": "", "album": "", "duration": 1.0})])
+    res = client.get("/album?offset=8&meta=1", headers={"If-None-Match": res.headers["ETag"]})
+    if res.status_code != 200 or res.get_json()["meta"]["8.mp3"]["title"] != "Osiem":
+        pytest.fail(f"nieaktualne metadane albumu: {res.status_code}")
+
+    sub = music_serwer.broadcaster.subscribe()
+    music_serwer.PlayerCtrl.notify_update_library()
+    version = MusicLibrary.library_version
+    MusicLibrary.do_random(True)
+    music_serwer.PlayerCtrl.notify_update_library()
+    if len(sub) != 1:
+        pytest.fail("wlaczenie losowej kolejnosci nie powinno zmieniac albumu")
+    del MusicLibrary.full_library["3.mp3"]
+    MusicLibrary.do_library()
+    music_serwer.PlayerCtrl.notify_update_library()
+    events = [event["value"] for _, event in sub.events]
+    music_serwer.broadcaster.unsubscribe(sub)
+    MusicLibrary.do_random(False)
+    if events[-1].get("base") != version or events[-1].get("remove") is None:
+        pytest.fail(f"zmiana albumu nie zostala wyslana jako roznica: {events[-1]}")
+
+
+def test_async_server(async_server):
+    import json
+    import time
+    import socket
+    import http.client
+    from flask import Flask, jsonify, request
+    from scripts.event_broadcaster import EventBroadcaster
+    app = Flask(__name__)
+
+    @app.route("/echo", methods=["POST"])
+    def echo():
+        return jsonify({"data": request.get_json(), "q": request.args.get("q")})
+
+    broadcaster = EventBroadcaster()
+    srv = async_server(app, broadcaster)
+
+    conn = http.client.HTTPConnection("127.0.0.1", srv.port, timeout=5)
+    for i in range(2):
+        # drugie zapytanie tym samym połączeniem (keep-alive)
+        conn.request("POST", "/echo?q=%C5%BC", body=json.dumps({"i": i}), headers={"Content-Type": "application/json"})
+        res = conn.getresponse()
+        data = json.loads(res.read())
+        if res.status != 200 or data != {"data": {"i": i}, "q": "ż"}:
+            pytest.fail(f"zla odpowiedz Flask przez serwer async: {res.status} {data}")
+    conn.close()
+
+    sock = socket.create_connection(("127.0.0.1", srv.port), timeout=5)
+    sock.sendall(b"GET /stream HTTP/1.1\r\nHost: test\r\n\r\n")
+    received = b""
+    while b"retry:" not in received:
+        received += sock.recv(4096)
+    broadcaster.publish({"type": "song", "value": "a.mp3"})
+    while b"a.mp3" not in received:
+        received += sock.recv(4096)
+    if not received.startswith(b"HTTP/1.1 200") or srv.stream_clients != 1:
+        pytest.fail(f"zly poczatek strumienia: {received}")
+    sock.close()
+    for _ in range(50):
+        if not broadcaster.subscribers:
+            break
+        time.sleep(0.02)
+    if broadcaster.subscribers or srv.stream_clients:
+        pytest.fail("rozlaczony klient /stream nie zostal od razu usuniety")
+
+
+def test_player_commands_coalescing():
+    import threading
+    from scripts.player_commands import PlayerCommands
+    commands = PlayerCommands()
+    gate = threading.Event()
+    done = []
+    commands.submit("blokada", gate.wait, 5)
+    for volume in range(20):
+        commands.submit("volume", done.append, ("volume", volume), key="volume")
+    for step in (1, 1, 1, -1):
+        commands.submit("skip", lambda steps: done.append(("skip", steps)), step,
+                        merge=lambda old, new: (old[0] + new[0],))
+    last = commands.submit("volume", done.append, ("volume", 99), key="volume")
+    gate.set()
+    if not commands.wait_idle(5):
+        pytest.fail("kolejka polecen nie zostala wykonana")
+    commands.stop()
+    if done != [("volume", 99), ("skip", 2)]:
+        pytest.fail(f"polecenia nie zostaly polaczone: {done}")
+    if not last.done() or commands.stats["coalesced"] != 23:
+        pytest.fail(f"zle statystyki kolejki: {commands.stats}")
+
+
+def test_command_timeout_cancels(monkeypatch):
+    import threading
+    import music_serwer
+    from music_serwer import app
+    gate = threading.Event()
+    done = []
+    music_serwer.commands.submit("blokada", gate.wait, 5)
+    future = music_serwer.commands.submit("tags", done.append, "tags")
+    with app.test_request_context():
+        res, status, headers = music_serwer.busy_response(future)
+    gate.set()
+    music_serwer.commands.wait_idle(5)
+    if status != 503 or "Retry-After" not in headers or done:
+        pytest.fail(f"polecenie po przekroczeniu czasu nie zostalo anulowane: {status} {done}")
+    if music_serwer.commands.stats["cancelled"] < 1:
+        pytest.fail(f"brak anulowanego polecenia w statystykach: {music_serwer.commands.stats}")
+
+
+def test_click_goes_through_queue(monkeypatch, tmp_path):
+    import music_serwer
+    from tests.benchmark import StubPlayer
+    from music_serwer import app, MusicLibrary, Player
+    monkeypatch.setattr(music_serwer.PlayerCtrl, "mpv", StubPlayer)
+    monkeypatch.setattr(MusicLibrary, "db_file", str(tmp_path / "music_library.db"))
+    monkeypatch.setattr(MusicLibrary, "full_library", CompactLibrary({f"{i}.mp3": [] for i in range(10)}))
+    monkeypatch.setattr(MusicLibrary, "tag_query", "")
+    monkeypatch.setattr(MusicLibrary, "tags", [])
+    monkeypatch.setattr(Player, "volume", Player.volume)
+    monkeypatch.setattr(Player, "index_song", 0)
+    monkeypatch.setattr(MusicLibrary, "library", [])
+    MusicLibrary.do_library()
+    client = app.test_client()
+    for volume in range(30):
+        client.post("/click", json={"button": "volume", "volume": volume})
+    for _ in range(3):
+        client.post("/click", json={"button": "next"})
+    music_serwer.commands.wait_idle(5)
+    plays = [c for c in StubPlayer.commands if c[0] == "play"]
+    StubPlayer.close()
+    if Player.volume != 29 or Player.index_song != 3 or not plays:
+        pytest.fail(f"zly stan po poleceniach z kolejki: {Player.volume} {Player.index_song}")
+
+
+
+def test_zones(monkeypatch, tmp_path):
+    import music_serwer
+    from tests.benchmark import StubPlayer
+    from music_serwer import app, MusicLibrary, Player
+    monkeypatch.setattr(music_serwer, "zones", dict(music_serwer.zones))
+    monkeypatch.setattr(MusicLibrary, "zones", {})
+    monkeypatch.setattr(music_serwer.PlayerCtrl, "mpv", StubPlayer)
+    monkeypatch.setattr(MusicLibrary, "db_file", str(tmp_path / "music_library.db"))
+    monkeypatch.setattr(MusicLibrary, "full_library", CompactLibrary({f"{i}.mp3": [] for i in range(10)}))
+    monkeypatch.setattr(MusicLibrary, "tag_query", "")
+    monkeypatch.setattr(MusicLibrary, "tags", [])
+    monkeypatch.setattr(MusicLibrary, "library", [])
+    monkeypatch.setattr(Player, "volume", 50)
+    monkeypatch.setattr(Player, "index_song", 0)
+    zone = music_serwer.add_zone("kuchnia")
+    monkeypatch.setattr(zone, "mpv", StubPlayer)
+    MusicLibrary.do_library()
+    zone.library.do_library()
+    client = app.test_client()
+    client.post("/zones/kuchnia/click", json={"button": "volume", "volume": 20})
+    for _ in range(2):
+        client.post("/zones/kuchnia/click", json={"button": "next"})
+    music_serwer.commands.wait_idle(5)
+    StubPlayer.close()
+    if (zone.state.volume, zone.state.index_song) != (20, 2) or (Player.volume, Player.index_song) != (50, 0):
+        pytest.fail(f"strefy nie sa niezalezne: {zone.state.volume} {zone.state.index_song} "
+                    f"{Player.volume} {Player.index_song}")
+    if client.get("/zones/nieznana/album").status_code != 404:
+        pytest.fail("nieznana strefa powinna zwracac 404")
+
+    # strona główna z poprzedniego renderowania nie może pominąć nowej strefy
+    client.get("/")
+    music_serwer.add_zone("salon")
+    if 'href="/zones/salon/"' not in client.get("/").get_data(as_text=True):
+        pytest.fail("strona glowna bez nowej strefy")
+
+    # wspólna biblioteka: usunięcie pliku zmienia albumy obu stref
+    music_serwer.library_changed([("remove", "0.mp3")])
+    album = client.get("/zones/kuchnia/album").get_json()
+    if album["total"] != 9 or len(MusicLibrary.library) != 9 or zone.library.library[zone.state.index_song] != "2.mp3":
+        pytest.fail(f"zmiana biblioteki nie trafila do albumu strefy: {album}")
+    if zone.library.full_library is not MusicLibrary.full_library:
+        pytest.fail("strefa powinna dzielic biblioteke z glowna")
+    ids = [z["id"] for z in client.get("/zones").get_json()["zones"]]
+    if ids != ["main", "kuchnia", "salon"]:
+        pytest.fail(f"zla lista stref: {ids}")
+
+
+def test_tags_endpoint(monkeypatch, tmp_path):
+    import music_serwer
+    from tests.benchmark import StubPlayer
+    from music_serwer import app, MusicLibrary, Player
+    monkeypatch.setattr(music_serwer.PlayerCtrl, "mpv", StubPlayer)
+    monkeypatch.setattr(MusicLibrary, "db_file", str(tmp_path / "music_library.db"))
+    monkeypatch.setattr(MusicLibrary, "info_file", str(tmp_path / "info_music.json"))
+    monkeypatch.setattr(MusicLibrary, "full_library", CompactLibrary(
+        {f"{folder}/{i}.mp3": [] for folder in ("a", "b") for i in range(3)}))
+    monkeypatch.setattr(MusicLibrary, "tag_query", "rock")
+    monkeypatch.setattr(MusicLibrary, "tags", [])
+    monkeypatch.setattr(MusicLibrary, "library", [])
+    monkeypatch.setattr(Player, "index_song", 0)
+    MusicLibrary._get_store().add_songs(MusicLibrary.full_library)
+    MusicLibrary.do_library()
+    client = app.test_client()
+    res = client.post("/tags", json={"ops": [{"path": "a", "tag": "rock"}, {"path": "b/0.mp3", "tag": "rock"}]})
+    data = res.get_json()
+    StubPlayer.close()
+    if res.status_code != 200 or data["changed"] != 4 or len(MusicLibrary.library) != 4:
+        pytest.fail(f"zla odpowiedz /tags albo album nie zostal przebudowany: {data}")
+    for body in ({"ops": [{"path": "a", "tag": "live"}, {"path": "brak", "tag": "live"}]}, {"ops": "a"}):
+        if client.post("/tags", json=body).status_code != 400:
+            pytest.fail(f"niepoprawne zapytanie powinno zwrocic 400: {body}")
+    if "live" in MusicLibrary.full_library.tag_index:
+        pytest.fail("odrzucona paczka zmienila tagi")
+    MusicLibrary.flush_tags()
+    if client.get("/tags").get_json() != {"tags": ["rock"], "pending": 0, "stats": MusicLibrary._tag_writer.stats}:
+        pytest.fail(f"zla odpowiedz GET /tags: {client.get('/tags').get_json()}")
+
+
+def test_metrics_format():
+    from scripts.metrics import Registry
+    registry = Registry()
+    latency = registry.histogram("op_seconds", "czas", ["op"], buckets=(0.1, 1.0))
+    errors = registry.counter("op_errors_total", "bledy", ["op"])
+    latency.labels("a").observe(0.05)
+    latency.labels("a").observe(0.5)
+    latency.labels("a").observe(3)
+    errors.labels('x"y').inc(2)
+    text = registry.render()
+    for line in ('# TYPE op_seconds histogram', 'op_seconds_bucket{op="a",le="0.1"} 1',
+                 'op_seconds_bucket{op="a",le="1"} 2', 'op_seconds_bucket{op="a",le="+Inf"} 3',
+                 'op_seconds_count{op="a"} 3', 'op_errors_total{op="x\\"y"} 2'):
+        if line not in text.splitlines():
+            pytest.fail(f"brak linii {line!r} w metrykach:\n{text}")
+
+
+def test_metrics_endpoint(monkeypatch, tmp_path):
+    import music_serwer
+    from tests.benchmark import StubPlayer
+    from music_serwer import app, MusicLibrary, Player
+    monkeypatch.setattr(music_serwer.PlayerCtrl, "mpv", StubPlayer)
+    monkeypatch.setattr(MusicLibrary, "db_file", str(tmp_path / "music_library.db"))
+    monkeypatch.setattr(Player, "volume", Player.volume)
+    client = app.test_client()
+    client.post("/click", json={"button": "volume", "volume": 40})
+    client.post("/click", json={"button": "nieznany"})
+    music_serwer.commands.wait_idle(5)
+    StubPlayer.close()
+    res = client.get("/metrics")
+    text = res.get_data(as_text=True)
+    if res.status_code != 200 or not res.mimetype.startswith("text/plain"):
+        pytest.fail(f"zla odpowiedz /metrics: {res.status_code} {res.mimetype}")
+    for name in ('http_click_seconds_count{button="volume"}', 'http_click_seconds_count{button="other"}',
+                 "sse_clients ", 'player_commands{kind="executed"}', 'library_songs{set="full"}'):
+        if name not in text:
+            pytest.fail(f"brak {name} w /metrics")
+
+
+def test_startup_resume(monkeypatch, tmp_path):
+    import music_serwer
+    from tests.benchmark import StubPlayer, make_tree, library_state
+    from music_serwer import Player
+    monkeypatch.setattr(music_serwer.PlayerCtrl, "mpv", StubPlayer)
+    monkeypatch.setattr(Player, "volume", Player.volume)
+    music_dir = make_tree(str(tmp_path), 20)
+    with library_state(music_dir, str(tmp_path)) as lib:
+        # puste pliki, odczyt metadanych nie jest tu sprawdzany
+        monkeypatch.setattr(lib, "update_metadata", lambda songs=None: None)
+        monkeypatch.setattr(lib, "find_duplicates", lambda on_done=None: None)
+        lib.read_dir_library()
+        lib._find_music_files()
+        lib.do_library()
+        lib.play(7)
+        Player.volume = 35
+        lib.save_resume()
+        resumed = lib.library[7]
+        # nowe uruchomienie: pusta biblioteka w pamięci, ten sam plik bazy
+        lib.full_library, lib.library, lib._current = CompactLibrary(), [], None
+        Player.index_song, Player.name_song, Player.volume = 0, "", 50
+        events = []
+        # kolejka klienta zostawia tylko najnowsze zdarzenie danego typu, tu liczą się wszystkie
+        monkeypatch.setattr(music_serwer.broadcaster, "publish", events.append)
+        music_serwer.start_library().join(10)
+        music_serwer.commands.wait_idle(10)
+        plays = [c for c in StubPlayer.commands if c[0] == "play"]
+        StubPlayer.close()
+        if plays != [("play", os.path.join(music_dir, resumed))]:
+            pytest.fail(f"zle wznowienie odtwarzania: {plays}")
+        if Player.volume != 35 or lib.library[Player.index_song] != resumed or len(lib.library) != 20:
+            pytest.fail(f"zly stan po starcie: {Player.volume} {Player.index_song} {len(lib.library)}")
+        states = [e["value"]["state"] for e in events if e["type"] == "library_status"]
+        if states != ["loading", "scanning", "ready"]:
+            pytest.fail(f"zle etapy wczytywania: {states}")
+
+
+def test_static_assets(monkeypatch):
+    import re
+    import gzip
+    from music_serwer import app, Player
+    monkeypatch.setattr(Player, "volume", 42)
+    client = app.test_client()
+    page = client.get("/")
+    html = page.get_data(as_text=True)
+    match = re.search(r'src="(/assets/script\.[0-9a-f]{12}\.js)"', html)
+    if match is None or "&#34;volume&#34;: 42" not in html:
+        pytest.fail(f"brak pliku z hashem lub stanu w stronie: {html[-300:]}")
+    if client.get("/", headers={"If-None-Match": page.headers["ETag"]}).status_code != 304:
+        pytest.fail("niezmieniona strona glowna nie zwraca 304")
+    Player.volume = 43
+    if client.get("/", headers={"If-None-Match": page.headers["ETag"]}).status_code != 200:
+        pytest.fail("strona glowna nie zostala wyrenderowana po zmianie stanu")
+
+    res = client.get(match.group(1), headers={"Accept-Encoding": "gzip, deflate"})
+    with open(os.path.join(app.root_path, "static", "script.js"), "rb") as f:
+        original = f.read()
+    if res.headers.get("Content-Encoding") != "gzip" or gzip.decompress(res.get_data()) != original:
+        pytest.fail(f"zla wersja skompresowana: {res.headers}")
+    if "immutable" not in res.headers["Cache-Control"] or "Accept-Encoding" not in res.headers["Vary"]:
+        pytest.fail(f"zle naglowki cache: {res.headers}")
+    plain = client.get(match.group(1))
+    if "Content-Encoding" in plain.headers or plain.get_data() != original:
+        pytest.fail("klient bez kompresji dostal skompresowany plik")
+    if client.get(match.group(1), headers={"If-None-Match": res.headers["ETag"]}).status_code != 304:
+        pytest.fail("brak 304 dla pliku z hashem")
+    if client.get("/assets/script.000000000000.js").status_code != 404:
+        pytest.fail("nieznany plik powinien zwrocic 404")
+
+
+def test_rate_limit_filter():
+    import logging
+    from scripts.log_setup import RateLimitFilter
+    limit = RateLimitFilter(rate=0.001, burst=3)
+    def record(level=logging.DEBUG, lineno=10):
+        return logging.LogRecord("music_serwer", level, "music_serwer.py", lineno, "klik %s", ("next",), None)
+    passed = [limit.filter(record()) for _ in range(10)]
+    if passed != [True] * 3 + [False] * 7:
+        pytest.fail(f"zly limit komunikatow: {passed}")
+    if not limit.filter(record(logging.WARNING)) or not limit.filter(record(lineno=11)):
+        pytest.fail("ostrzezenia i inne miejsca w kodzie nie powinny byc ograniczane")
+    limit._buckets[("music_serwer.py", 10)][0] = 1
+    late = record()
+    limit.filter(late)
+    if "pominięto 7" not in late.getMessage():
+        pytest.fail(f"brak liczby pominietych: {late.getMessage()}")
+
+
+def test_setup_logging(tmp_path, monkeypatch):
+    import atexit
+    import logging
+    from scripts.log_setup import setup_logging
+    from scripts.settings import log
+    monkeypatch.setattr(log, "max_bytes", 2000)
+    root = logging.getLogger()
+    saved = root.handlers[:], root.level
+    log_file = tmp_path / "app.log"
+    listener = setup_logging(str(log_file), console=False)
+    try:
+        for i in range(100):
+            logging.getLogger("music_serwer").warning("komunikat %d %s", i, "x" * 50)
+    finally:
+        listener.stop()
+        atexit.unregister(listener.stop)
+        root.handlers[:], level = saved
+        root.setLevel(level)
+    text = log_file.read_text(encoding="utf-8")
+    if "komunikat 99" not in text or not (tmp_path / "app.log.1").exists():
+        pytest.fail("logi nie trafily do pliku z rotacja")
+
+
+def test_media_range(monkeypatch, tmp_path, async_server):
+    import time
+    import http.client
+    from scripts.async_server import FileWrapper
+    from music_serwer import app, MusicLibrary, broadcaster
+    music_dir = tmp_path / "muzyka"
+    (music_dir / "album").mkdir(parents=True)
+    data = bytes(range(256)) * 1024
+    (music_dir / "album" / "utwór 1.mp3").write_bytes(data)
+    (tmp_path / "sekret.mp3").write_bytes(b"x")
+    monkeypatch.setattr(MusicLibrary, "music_dir", str(music_dir))
+    monkeypatch.setattr(MusicLibrary, "full_library",
+                        CompactLibrary({"album/utwór 1.mp3": [], "../sekret.mp3": []}))
+
+    client = app.test_client()
+    def get(path, **headers):
+        res = client.get(path, headers=headers)
+        res.get_data()
+        res.close()
+        return res
+    full = get("/media/album/utwór 1.mp3")
+    if full.status_code != 200 or full.get_data() != data or "ETag" not in full.headers:
+        pytest.fail(f"zla odpowiedz /media: {full.status_code}")
+    part = get("/media/album/utwór 1.mp3", Range="bytes=1000-1999")
+    if part.status_code != 206 or part.get_data() != data[1000:2000]:
+        pytest.fail(f"zla odpowiedz na Range: {part.status_code} {part.headers}")
+    if get("/media/album/utwór 1.mp3", **{"If-None-Match": full.headers["ETag"]}).status_code != 304:
+        pytest.fail("brak 304 dla niezmienionego pliku")
+    for path in ("/media/../sekret.mp3", "/media/inny.mp3"):
+        if get(path).status_code != 404:
+            pytest.fail(f"plik spoza biblioteki nie zostal odrzucony: {path}")
+
+    # serwer async wysyła plik przez loop.sendfile, także od przesunięcia z Range;
+    # 416 ma treść błędu, więc następne zapytanie na tym samym połączeniu dostaje swoją odpowiedź
+    wrappers = []
+    init = FileWrapper.__init__
+    monkeypatch.setattr(FileWrapper, "__init__", lambda self, *args: (wrappers.append(self), init(self, *args))[1])
+    srv = async_server(app, broadcaster)
+    conn = http.client.HTTPConnection("127.0.0.1", srv.port, timeout=5)
+    for headers, expected, status in (({"Range": "bytes=999999-"}, None, 416), ({}, data, 200),
+                                      ({"Range": "bytes=70000-"}, data[70000:], 206)):
+        conn.request("GET", "/media/album/utw%C3%B3r%201.mp3", headers=headers)
+        res = conn.getresponse()
+        body = res.read()
+        if res.status != status or (expected is not None and body != expected):
+            pytest.fail(f"zly plik z serwera async: {res.status} {len(body)}")
+        if len(body) != int(res.headers["Content-Length"]):
+            pytest.fail(f"tresc niezgodna z Content-Length: {len(body)} {res.headers['Content-Length']}")
+    conn.close()
+    # plik jest zamykany po wysłaniu odpowiedzi
+    deadline = time.monotonic() + 2
+    while not all(wrapper.file.closed for wrapper in wrappers) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    if len(wrappers) != 3 or not all(wrapper.file.closed for wrapper in wrappers):
+        pytest.fail(f"nie wszystkie pliki zostaly zamkniete: {[w.file.closed for w in wrappers]}")
+
+
+def test_search_endpoint(monkeypatch):
+    from music_serwer import app, MusicLibrary
+    from scripts.search_index import SearchIndex
+    index = SearchIndex()
+    index.build(["Kult/Arahja.mp3", "Kult/Łączka.mp3"])
+    monkeypatch.setattr(MusicLibrary, "search_index", index)
+    client = app.test_client()
+    data = client.get("/search?q=lacz&meta=1").get_json()
+    if data["items"] != ["Kult/Łączka.mp3"] or "Kult/Łączka.mp3" not in data["meta"]:
+        pytest.fail(f"zla odpowiedz /search: {data}")
+    if client.get("/search?q=kult&limit=x").status_code != 400:
+        pytest.fail("niepoprawny limit powinien zwrocic 400")
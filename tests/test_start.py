@@ -78,13 +78,15 @@ def test_music_dir_exists():
     else:
         pytest.fail(f"sciezka z piosenkami nie zawiera muzyki")
 
-def test_MusicLibrary():
+def test_MusicLibrary(tmp_path, monkeypatch):
     import json
     from music_serwer import MusicLibrary
-    MusicLibrary.music_dir = "tests"
-    MusicLibrary.info_file = "tests/info_music.json"
-    if os.path.exists(MusicLibrary.info_file):
-        os.remove(MusicLibrary.info_file)
+    # baza i json w katalogu tymczasowym, test nie zostawia plików w repozytorium
+    monkeypatch.setattr(MusicLibrary, "music_dir", "tests")
+    monkeypatch.setattr(MusicLibrary, "info_file", str(tmp_path / "info_music.json"))
+    monkeypatch.setattr(MusicLibrary, "db_file", str(tmp_path / "music_library.db"))
+    monkeypatch.setattr(MusicLibrary, "full_library", MusicLibrary.full_library)
+    monkeypatch.setattr(MusicLibrary, "_json_file_is_actual", MusicLibrary._json_file_is_actual)
     try:
         MusicLibrary._find_music_files()
     except: